@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import EmailStr, PostgresDsn, validator
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -13,11 +13,171 @@ class Settings(BaseSettings):
             return v
         return str(v)
 
+    # Потоки для синхронных запросов к БД, которые идут параллельно в одном ходе чата
+    DB_THREAD_POOL_SIZE: int = 8
+
     # === Security ===
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    TOKEN_CACHE_SIZE: int = 4096
+    REVOCATION_BLOOM_CAPACITY: int = 100_000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    REVOCATION_SYNC_SECONDS: int = 30
+
+    # === Shared state (optional) ===
+    REDIS_URL: Optional[str] = None
+
+    # === Rate limiting ===
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_PATHS: List[str] = ["/api/chat/message", "/api/chat/message/stream", "/api/ai/analyze"]
+    RATE_LIMIT_REQUESTS_PER_MINUTE: int = 20
+    RATE_LIMIT_BURST: int = 5
+    LLM_TOKENS_PER_MINUTE: int = 20_000
+    LLM_PROMPT_OVERHEAD_TOKENS: int = 1500
+
+    # === Idempotency keys ===
+    IDEMPOTENCY_ENABLED: bool = True
+    IDEMPOTENCY_PATHS: List[str] = ["/api/chat/message", "/api/calendar/events"]
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 3600
+    IDEMPOTENCY_MAX_KEYS: int = 10_000
+    # сколько повтор ждёт ответа на тот же ключ, который ещё выполняется
+    IDEMPOTENCY_WAIT_SECONDS: float = 35.0
+
+    # === Async chat jobs (POST /api/chat/message?mode=async) ===
+    CHAT_JOBS_WORKERS: int = 4
+    CHAT_JOBS_MAX_QUEUED: int = 1000
+    CHAT_JOBS_MAX_PER_USER: int = 10
+    CHAT_JOBS_RESULT_TTL_SECONDS: int = 900
+    CHAT_JOBS_MAX_RESULTS: int = 10_000
+    CHAT_JOBS_LEASE_SECONDS: int = 180
+    # tcp://host:port локального брокера (python -m app.core.job_queue); None — очередь в процессе
+    CHAT_JOBS_BROKER_URL: Optional[str] = None
+
+    # === Conversation memory ===
+    MEMORY_HISTORY_MESSAGES: int = 10
+    MEMORY_MAX_CHATS: int = 5_000
+    MEMORY_MAX_BYTES: int = 16 * 1024 * 1024
+    MEMORY_TTL_SECONDS: int = 300
+    # Скользящий пересказ: сообщения старше хвоста из MEMORY_RECENT_MESSAGES
+    # сворачиваются в одно резюме, как только их набирается MEMORY_SUMMARY_MIN_NEW
+    MEMORY_SUMMARY_ENABLED: bool = True
+    MEMORY_RECENT_MESSAGES: int = 4
+    MEMORY_SUMMARY_MIN_NEW: int = 6
+    MEMORY_SUMMARY_MAX_INPUT: int = 40
+    MEMORY_SUMMARY_MAX_TOKENS: int = 300
+    # Долгая память: локальный BM25-индекс по всей истории чата, лучшие
+    # совпадения с сообщением пользователя добавляются в промпт
+    RECALL_ENABLED: bool = True
+    RECALL_TOP_K: int = 3
+    RECALL_MIN_SCORE: float = 1.5
+    RECALL_SNIPPET_CHARS: int = 240
+    RECALL_MAX_CHATS: int = 1_000
+    RECALL_MAX_BYTES: int = 64 * 1024 * 1024
+    # Сколько новых сообщений индексируется за один ход (первая сборка длинной истории идёт частями)
+    RECALL_BUILD_BATCH: int = 2_000
+    # Индекс сохраняется в chat_recall_indexes, как только в нём столько несохранённых сообщений
+    RECALL_SAVE_EVERY: int = 50
+
+    # === Chat persistence (write-behind) ===
+    # Сообщения ходов копятся в памяти и пишутся пачками; выключено — каждый ход пишется сразу
+    CHAT_WRITE_BEHIND_ENABLED: bool = False
+    CHAT_WRITE_BEHIND_BATCH_SIZE: int = 200
+    CHAT_WRITE_BEHIND_FLUSH_SECONDS: float = 0.5
+    CHAT_WRITE_BEHIND_MAX_BUFFER: int = 5_000
+    # Куда при остановке сбрасываются ходы, которые не удалось записать в БД
+    CHAT_WRITE_BEHIND_SPILL_PATH: str = "chat_write_behind.jsonl"
+    # Ход, который БД отвергает столько раз подряд (при живой БД), откладывается в карантин
+    CHAT_WRITE_BEHIND_MAX_ATTEMPTS: int = 3
+    CHAT_WRITE_BEHIND_QUARANTINE_PATH: str = "chat_write_behind.rejected.jsonl"
+
+    # === Chat history ===
+    CHAT_ID_CACHE_SIZE: int = 100_000
+    # GET /api/chat/me отдаёт только последние сообщения, старые — страницами через /me/messages
+    CHAT_WINDOW_SIZE: int = 50
+    CHAT_WINDOW_MAX: int = 200
+
+    # === Chat retention (cold storage) ===
+    # Сообщения старше срока (users.chat_retention_days или этот по умолчанию; 0 — хранить всё)
+    # после свёртки в пересказ переезжают сжатыми помесячными блоками в chat_message_archives
+    CHAT_RETENTION_DAYS: int = 180
+    # Последние сообщения чата остаются в chat_messages при любом сроке
+    CHAT_RETENTION_KEEP_MESSAGES: int = 200
+    # Сколько сообщений одного чата переносится за транзакцию
+    CHAT_RETENTION_BATCH: int = 5_000
+    # Сколько вызовов модели за проход может уйти на пересказ накопившегося хвоста одного чата
+    # (по MEMORY_SUMMARY_MAX_INPUT сообщений); остальное — в следующий проход
+    CHAT_RETENTION_SUMMARY_ROUNDS: int = 25
+    # Период фонового прохода в каждом воркере; 0 — только `python -m app.services.chat_retention`
+    CHAT_RETENTION_INTERVAL_SECONDS: int = 0
+    # Сколько распакованных блоков держать в памяти для листания старой истории
+    CHAT_ARCHIVE_CACHE_BATCHES: int = 32
+
+    # === Chat history search ===
+    # Ранжируются только самые свежие совпадения: стоимость запроса не растёт с длиной истории
+    CHAT_SEARCH_MAX_CANDIDATES: int = 2000
+    CHAT_SEARCH_MAX_LIMIT: int = 50
+
+    # === LLM client ===
+    LLM_MAX_IN_FLIGHT: int = 32
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 5.0
+    LLM_DEADLINE_SECONDS: float = 30.0
+    LLM_MAX_RETRIES: int = 2
+    LLM_BACKOFF_BASE_SECONDS: float = 0.5
+    LLM_BACKOFF_MAX_SECONDS: float = 8.0
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
+    # Хеджирование: если основной деплоймент не ответил (первым токеном) за
+    # p90 своей задержки, тот же запрос уходит во второй; берём первый ответ.
+    # Включается, когда задан LLM_HEDGE_ENDPOINT_URL.
+    LLM_HEDGE_ENDPOINT_URL: Optional[str] = None
+    LLM_HEDGE_API_KEY: Optional[str] = None
+    LLM_HEDGE_DEPLOYMENT_NAME: Optional[str] = None
+    LLM_HEDGE_QUANTILE: float = 0.9
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS: float = 2.0
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 0.2
+    LLM_LATENCY_WINDOW: int = 200
+
+    # === LLM usage metering and quotas ===
+    USAGE_FLUSH_BATCH_SIZE: int = 100
+    USAGE_FLUSH_SECONDS: float = 5.0
+    USAGE_MAX_BUFFER: int = 10_000
+    # prompt + completion токенов на пользователя за сутки (UTC); None — без квоты
+    LLM_DAILY_TOKEN_QUOTA: Optional[int] = None
+    # с этой доли квоты основную модель заменяет маленькая (SMALL_DEPLOYMENT_NAME)
+    LLM_QUOTA_DOWNGRADE_RATIO: float = 0.8
+    LLM_QUOTA_CACHE_SECONDS: float = 60.0
+    ADMIN_EMAILS: List[str] = []
+    # /api/metrics: с токеном — Bearer METRICS_TOKEN (для Prometheus), без него — только админы
+    METRICS_TOKEN: Optional[str] = None
+
+    # === Model cascade ===
+    # Простые ходы — на маленький деплоймент (на том же ENDPOINT_URL); не задан — каскад выключен
+    SMALL_DEPLOYMENT_NAME: Optional[str] = None
+    SMALL_MODEL_MAX_TOKENS: int = 200
+    CASCADE_MAX_SIMPLE_WORDS: int = 20
+
+    # === Prompt context ===
+    CALENDAR_CONTEXT_MAX_DAYS: int = 14
+    PROMPT_TOKEN_BUDGET: int = 4000
+
+    # === Calendar tools (function calling) ===
+    # Сколько раз за ход модель может вызвать инструменты, прежде чем обязана ответить текстом
+    CALENDAR_TOOLS_MAX_ROUNDS: int = 3
+
+    # === Local fast path for typical calendar requests ===
+    FAST_PATH_ENABLED: bool = True
+
+    # === Azure Speech tokens (GET /api/speech/token) ===
+    # {region} подставляется; для тестов — адрес локальной заглушки STS
+    SPEECH_STS_URL: str = "https://{region}.api.cognitive.microsoft.com/sts/v1.0/issueToken"
+    SPEECH_STS_TIMEOUT_SECONDS: float = 5.0
+    # Токен Azure живёт 10 минут: отдаём его не дольше TTL, а после REFRESH
+    # обновляем в фоне, продолжая отдавать текущий
+    SPEECH_TOKEN_TTL_SECONDS: int = 540
+    SPEECH_TOKEN_REFRESH_SECONDS: int = 420
 
     # === Frontend ===
     FRONTEND_URL: str = "http://localhost:5173"
@@ -1,5 +1,9 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.exc import OperationalError
 from app.core.config import settings
 import logging
@@ -22,4 +26,28 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close() 
+
+
+T = TypeVar("T")
+
+# Меньше пула соединений SQLAlchemy (5 + 10 overflow), чтобы фоновым запросам
+# всегда оставались соединения для обычных
+_db_threads = ThreadPoolExecutor(max_workers=settings.DB_THREAD_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_in_session(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Runs `fn(db, *args)` in the DB thread pool with its own short-lived
+    session, so independent sync queries can run concurrently without
+    blocking the event loop. Sessions are not thread-safe: never pass
+    objects bound to the request session into `fn`.
+    """
+    def job() -> T:
+        db: Session = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    return await asyncio.get_running_loop().run_in_executor(_db_threads, job)
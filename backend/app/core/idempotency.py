@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.rate_limit import bearer_user_key
+from app.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("idempotency_requests_total", "Requests with an Idempotency-Key, by outcome")
+
+# Результат claim(): ключ наш / уже есть ответ / ещё выполняется / тело запроса другое
+CLAIMED, DONE, BUSY, MISMATCH = "claimed", "done", "busy", "mismatch"
+
+# Такие ответы не запоминаем: повтор с тем же ключом должен выполниться заново
+_RETRYABLE = frozenset({401, 403, 408, 425, 429})
+
+# Сколько живёт метка «выполняется» в Redis, если воркер упал, не сняв её
+_PENDING_TTL = 120
+_MAX_KEY_LENGTH = 255
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+    def dumps(self) -> dict:
+        return {
+            "status": self.status,
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in self.headers],
+            "body": base64.b64encode(self.body).decode(),
+        }
+
+    @classmethod
+    def loads(cls, data: dict) -> "StoredResponse":
+        return cls(
+            status=data["status"],
+            headers=[(k.encode("latin-1"), v.encode("latin-1")) for k, v in data["headers"]],
+            body=base64.b64decode(data["body"]),
+        )
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    expires: float
+    response: Optional[StoredResponse] = None
+    settled: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class InProcessStore:
+    """
+    Idempotency keys of this worker: in-flight requests and their responses.
+
+    Bounded LRU of `max_keys` entries, each kept for `ttl` seconds. Requests
+    waiting on an in-flight key are woken as soon as it completes or is
+    released.
+    """
+
+    def __init__(self, max_keys: int, ttl: float) -> None:
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    async def claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires < now:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self._entries[key] = _Entry(fingerprint, now + self.ttl)
+            while len(self._entries) > self.max_keys:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.settled.set()
+            return CLAIMED, None
+        self._entries.move_to_end(key)
+        if entry.fingerprint != fingerprint:
+            return MISMATCH, None
+        if entry.response is not None:
+            return DONE, entry.response
+        return BUSY, None
+
+    async def wait(self, key: str, timeout: float) -> None:
+        entry = self._entries.get(key)
+        if entry is None or entry.response is not None:
+            return
+        try:
+            await asyncio.wait_for(entry.settled.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def complete(self, key: str, fingerprint: str, response: StoredResponse) -> None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.response = response
+        entry.expires = time.monotonic() + self.ttl
+        entry.settled.set()
+
+    async def release(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.settled.set()
+
+
+class RedisStore:
+    """
+    Same keys shared by all workers. The claim is a SET NX of a pending
+    marker; waiters poll until it turns into a stored response or disappears.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, client, ttl: float, prefix: str = "idem") -> None:
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    async def claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        pending = json.dumps({"fp": fingerprint})
+        while True:
+            if await self.client.set(self._key(key), pending, nx=True, ex=_PENDING_TTL):
+                return CLAIMED, None
+            raw = await self.client.get(self._key(key))
+            if raw is None:
+                # метка истекла между SET и GET — пробуем ещё раз
+                continue
+            data = json.loads(raw)
+            if data["fp"] != fingerprint:
+                return MISMATCH, None
+            if "response" in data:
+                return DONE, StoredResponse.loads(data["response"])
+            return BUSY, None
+
+    async def wait(self, key: str, timeout: float) -> None:
+        await asyncio.sleep(min(self.poll_interval, timeout))
+
+    async def complete(self, key: str, fingerprint: str, response: StoredResponse) -> None:
+        value = json.dumps({"fp": fingerprint, "response": response.dumps()})
+        await self.client.set(self._key(key), value, ex=self.ttl)
+
+    async def release(self, key: str) -> None:
+        await self.client.delete(self._key(key))
+
+
+async def _read_body(receive) -> Tuple[bytes, list]:
+    """Reads the whole request body; returns it and the messages to replay to the app."""
+    chunks, messages = [], []
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks), messages
+
+
+class IdempotencyMiddleware:
+    """
+    Pure ASGI middleware: `Idempotency-Key` support for the POST endpoints in
+    IDEMPOTENCY_PATHS.
+
+    The first request with a key runs as usual and its response (any status
+    below 500 except auth failures and 408/425/429) is stored for IDEMPOTENCY_TTL_SECONDS under
+    (user, path, key). A retry with the same key and the same body gets the
+    stored response back with `Idempotent-Replayed: true`. If the original is
+    still running, the retry waits for it up to IDEMPOTENCY_WAIT_SECONDS
+    (then 409 with Retry-After). The same key with a different body is a 422.
+    Failed requests release the key, so the client can retry them.
+
+    Keys are kept per worker, or in Redis for all workers when REDIS_URL is
+    set (falling back to the worker's store when Redis is unavailable).
+    """
+
+    def __init__(self, app, paths: Optional[Sequence[str]] = None) -> None:
+        self.app = app
+        self.paths = frozenset(paths if paths is not None else settings.IDEMPOTENCY_PATHS)
+        self.wait_seconds = settings.IDEMPOTENCY_WAIT_SECONDS
+        self.local = InProcessStore(settings.IDEMPOTENCY_MAX_KEYS, settings.IDEMPOTENCY_TTL_SECONDS)
+        redis = get_redis()
+        self.shared = RedisStore(redis, settings.IDEMPOTENCY_TTL_SECONDS) if redis is not None else None
+
+    async def _claim(self, key: str, fingerprint: str):
+        if self.shared is not None:
+            try:
+                return self.shared, await self.shared.claim(key, fingerprint)
+            except Exception as e:
+                logger.warning("Shared idempotency store unavailable, falling back to local: %s", e)
+        return self.local, await self.local.claim(key, fingerprint)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        raw_key = headers.get(b"idempotency-key")
+        user = bearer_user_key(headers) if raw_key else None
+        if user is None:
+            # без ключа (или без пользователя — его всё равно отклонит авторизация)
+            return await self.app(scope, receive, send)
+        if len(raw_key) > _MAX_KEY_LENGTH:
+            return await _send_json(send, 400, {"detail": "Idempotency-Key is too long"})
+
+        body, messages = await _read_body(receive)
+        # строка запроса тоже часть запроса: ?mode=async и обычный вызов — разные
+        fingerprint = hashlib.sha256(scope.get("query_string", b"") + b"?" + body).hexdigest()
+        key = f"{user}:{scope['path']}:{raw_key.decode('latin-1')}"
+
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            store, (state, stored) = await self._claim(key, fingerprint)
+            if state != BUSY:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.inc("idempotency_requests_total", outcome="busy")
+                return await _send_json(
+                    send, 409, {"detail": "A request with this Idempotency-Key is still in progress"},
+                    retry_after=1,
+                )
+            waited = True
+            await store.wait(key, remaining)
+
+        if state == MISMATCH:
+            metrics.inc("idempotency_requests_total", outcome="mismatch")
+            return await _send_json(
+                send, 422, {"detail": "Idempotency-Key was already used with a different request"},
+            )
+        if state == DONE:
+            metrics.inc("idempotency_requests_total", outcome="waited" if waited else "replayed")
+            await send({
+                "type": "http.response.start",
+                "status": stored.status,
+                "headers": stored.headers + [(b"idempotent-replayed", b"true")],
+            })
+            await send({"type": "http.response.body", "body": stored.body})
+            return
+
+        await self._run(scope, messages, receive, send, store, key, fingerprint)
+
+    async def _run(self, scope, messages, receive, send, store, key: str, fingerprint: str) -> None:
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        status, response_headers, chunks = 500, [], []
+        completed = False
+
+        async def capture(message):
+            nonlocal status, response_headers, completed
+            await send(message)
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False) and status < 500 and status not in _RETRYABLE:
+                    # ответ ушёл целиком — будим повторы, не дожидаясь фоновых задач роута
+                    try:
+                        await store.complete(key, fingerprint, StoredResponse(status, response_headers, b"".join(chunks)))
+                        completed = True
+                    except Exception as e:
+                        logger.warning("Failed to store idempotent response: %s", e)
+
+        try:
+            await self.app(scope, replay, capture)
+        finally:
+            if completed:
+                metrics.inc("idempotency_requests_total", outcome="stored")
+            else:
+                metrics.inc("idempotency_requests_total", outcome="released")
+                try:
+                    await store.release(key)
+                except Exception as e:
+                    logger.warning("Failed to release idempotency key: %s", e)
+
+
+async def _send_json(send, status: int, payload: dict, retry_after: Optional[int] = None) -> None:
+    body = json.dumps(payload).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("chat_jobs_queued", "Async chat jobs waiting for a worker")
+metrics.describe("chat_jobs_total", "Async chat jobs by final status")
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+
+class QueueFullError(Exception):
+    """The queue (or the user's lane) is at its limit; the client should retry later."""
+
+    def __init__(self, per_user: bool) -> None:
+        self.per_user = per_user
+        super().__init__("Too many queued jobs for this user" if per_user else "Job queue is full")
+
+
+@dataclass
+class Job:
+    user_id: int
+    payload: Dict[str, Any]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, ERROR)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        return cls(**data)
+
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+class JobQueue(ABC):
+    """
+    Очередь ходов чата для асинхронного режима.
+
+    Jobs of one user run strictly one after another in submission order
+    (a "lane" per user); different users run in parallel, round-robin.
+    While a job runs, its worker publishes events (the same ones the SSE
+    endpoint streams) that clients can read from any offset.
+    """
+
+    @abstractmethod
+    async def submit(self, job: Job) -> None:
+        """Queues the job; raises QueueFullError when a limit is reached."""
+
+    @abstractmethod
+    async def take(self, timeout: float) -> Optional[Job]:
+        """Next job whose user has nothing running, or None after `timeout` seconds."""
+
+    @abstractmethod
+    async def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def finish(
+        self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+    ) -> None:
+        """Stores the outcome and lets the user's next job start."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    async def events(self, job_id: str, offset: int, timeout: float) -> Tuple[List[Event], bool]:
+        """
+        Events from `offset` on, waiting up to `timeout` seconds for new ones;
+        and whether the job has finished (no more events will come).
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+@dataclass
+class _Slot:
+    job: Job
+    events: List[Event] = field(default_factory=list)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def notify(self) -> None:
+        # будим всех, кто ждал, и заводим новое событие для следующих
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class InProcessJobQueue(JobQueue):
+    """
+    Queue in this process's memory.
+
+    Bounded: at most `max_queued` waiting jobs overall and `max_per_user`
+    per user; finished jobs are kept for `result_ttl` seconds, at most
+    `max_results` of them. A job running longer than `lease_seconds`
+    (its worker died or hung) is failed so the user's lane moves on.
+    """
+
+    def __init__(
+        self,
+        max_queued: int = settings.CHAT_JOBS_MAX_QUEUED,
+        max_per_user: int = settings.CHAT_JOBS_MAX_PER_USER,
+        result_ttl: float = settings.CHAT_JOBS_RESULT_TTL_SECONDS,
+        max_results: int = settings.CHAT_JOBS_MAX_RESULTS,
+        lease_seconds: float = settings.CHAT_JOBS_LEASE_SECONDS,
+    ) -> None:
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self.lease_seconds = lease_seconds
+        self._slots: Dict[str, _Slot] = {}
+        # завершённые задачи в порядке завершения — для вытеснения
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        # user_id → ожидающие задачи этого пользователя
+        self._lanes: Dict[int, Deque[str]] = {}
+        # пользователи, у которых есть ожидающие задачи и ничего не выполняется
+        self._ready: Deque[int] = deque()
+        # user_id → выполняющаяся задача
+        self._running: Dict[int, str] = {}
+        self._queued = 0
+        self._wakeup = asyncio.Event()
+
+    async def submit(self, job: Job) -> None:
+        if self._queued >= self.max_queued:
+            raise QueueFullError(per_user=False)
+        lane = self._lanes.setdefault(job.user_id, deque())
+        if len(lane) + (job.user_id in self._running) >= self.max_per_user:
+            if not lane:
+                del self._lanes[job.user_id]
+            raise QueueFullError(per_user=True)
+        self._slots[job.id] = _Slot(job)
+        lane.append(job.id)
+        self._queued += 1
+        if len(lane) == 1 and job.user_id not in self._running:
+            self._ready.append(job.user_id)
+        metrics.set("chat_jobs_queued", self._queued)
+        self._wakeup.set()
+
+    async def take(self, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            self._expire_leases()
+            if self._ready:
+                user_id = self._ready.popleft()
+                lane = self._lanes[user_id]
+                job = self._slots[lane.popleft()].job
+                if not lane:
+                    del self._lanes[user_id]
+                self._running[user_id] = job.id
+                self._queued -= 1
+                metrics.set("chat_jobs_queued", self._queued)
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._slots[job.id].notify()
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def _expire_leases(self) -> None:
+        now = time.time()
+        for job_id in list(self._running.values()):
+            job = self._slots[job_id].job
+            if now - job.started_at > self.lease_seconds:
+                logger.warning("Chat job %s exceeded its lease, failing it", job_id)
+                self._finish(job_id, None, "Job was interrupted")
+
+    async def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        slot = self._slots.get(job_id)
+        if slot is None or slot.job.finished:
+            return
+        slot.events.append((event, data))
+        slot.notify()
+
+    async def finish(
+        self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+    ) -> None:
+        self._finish(job_id, result, error)
+
+    def _finish(self, job_id: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        slot = self._slots.get(job_id)
+        if slot is None or slot.job.finished:
+            return
+        job = slot.job
+        job.status = ERROR if error is not None else DONE
+        job.result, job.error = result, error
+        job.finished_at = time.time()
+        metrics.inc("chat_jobs_total", status=job.status)
+        slot.notify()
+
+        if self._running.get(job.user_id) == job_id:
+            del self._running[job.user_id]
+            if job.user_id in self._lanes:
+                self._ready.append(job.user_id)
+                self._wakeup.set()
+
+        self._finished[job_id] = job.finished_at
+        cutoff = time.time() - self.result_ttl
+        while self._finished:
+            oldest, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff and len(self._finished) <= self.max_results:
+                break
+            del self._finished[oldest]
+            self._slots.pop(oldest, None)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        slot = self._slots.get(job_id)
+        return slot.job if slot is not None else None
+
+    async def events(self, job_id: str, offset: int, timeout: float) -> Tuple[List[Event], bool]:
+        slot = self._slots.get(job_id)
+        if slot is None:
+            return [], True
+        if len(slot.events) <= offset and not slot.job.finished:
+            try:
+                await asyncio.wait_for(slot.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return slot.events[offset:], slot.job.finished
+
+
+# ───────────────── локальный брокер ─────────────────
+#
+# Протокол: по одной JSON-строке на запрос и на ответ,
+# {"op": <метод JobQueue>, ...аргументы} → {"ok": true, "value": ...} | {"ok": false, ...}.
+
+
+class LocalBroker:
+    """
+    Stand-in for an external message broker: serves an InProcessJobQueue to
+    several app processes over TCP, so they share lanes and results the way
+    they would with a real broker.
+
+        python -m app.core.job_queue --port 7070
+
+    and CHAT_JOBS_BROKER_URL=tcp://127.0.0.1:7070 in every app process.
+    """
+
+    def __init__(self, queue: Optional[InProcessJobQueue] = None) -> None:
+        self.queue = queue or InProcessJobQueue()
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                try:
+                    reply = {"ok": True, "value": await self._dispatch(request)}
+                except QueueFullError as e:
+                    reply = {"ok": False, "error": "full", "per_user": e.per_user}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # клиент отключился или брокер останавливается
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: dict) -> Any:
+        op, q = request["op"], self.queue
+        if op == "submit":
+            return await q.submit(Job.from_dict(request["job"]))
+        if op == "take":
+            job = await q.take(request["timeout"])
+            return job.to_dict() if job is not None else None
+        if op == "publish":
+            return await q.publish(request["job_id"], request["event"], request["data"])
+        if op == "finish":
+            return await q.finish(request["job_id"], request.get("result"), request.get("error"))
+        if op == "get":
+            job = await q.get(request["job_id"])
+            return job.to_dict() if job is not None else None
+        if op == "events":
+            events, finished = await q.events(request["job_id"], request["offset"], request["timeout"])
+            return {"events": events, "finished": finished}
+        raise ValueError(f"unknown op {op!r}")
+
+
+class BrokerJobQueue(JobQueue):
+    """JobQueue client of a LocalBroker; connections are reused from a small pool."""
+
+    def __init__(self, url: str, pool_size: int = 8) -> None:
+        parsed = urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port
+        self.pool_size = pool_size
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def _call(self, op: str, **kwargs) -> Any:
+        conn = self._idle.pop() if self._idle else await asyncio.open_connection(self.host, self.port)
+        reader, writer = conn
+        try:
+            writer.write(json.dumps({"op": op, **kwargs}).encode() + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("broker closed the connection")
+        except BaseException:
+            writer.close()
+            raise
+        if len(self._idle) < self.pool_size:
+            self._idle.append(conn)
+        else:
+            writer.close()
+        reply = json.loads(line)
+        if not reply["ok"]:
+            raise QueueFullError(per_user=reply["per_user"])
+        return reply["value"]
+
+    async def submit(self, job: Job) -> None:
+        await self._call("submit", job=job.to_dict())
+
+    async def take(self, timeout: float) -> Optional[Job]:
+        data = await self._call("take", timeout=timeout)
+        return Job.from_dict(data) if data is not None else None
+
+    async def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        await self._call("publish", job_id=job_id, event=event, data=data)
+
+    async def finish(
+        self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+    ) -> None:
+        await self._call("finish", job_id=job_id, result=result, error=error)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        data = await self._call("get", job_id=job_id)
+        return Job.from_dict(data) if data is not None else None
+
+    async def events(self, job_id: str, offset: int, timeout: float) -> Tuple[List[Event], bool]:
+        data = await self._call("events", job_id=job_id, offset=offset, timeout=timeout)
+        return [tuple(e) for e in data["events"]], data["finished"]
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+def create_job_queue() -> JobQueue:
+    if settings.CHAT_JOBS_BROKER_URL:
+        return BrokerJobQueue(settings.CHAT_JOBS_BROKER_URL)
+    return InProcessJobQueue()
+
+
+async def _serve(host: str, port: int) -> None:
+    server = await LocalBroker().serve(host, port)
+    logger.warning("Local job broker listening on %s:%d", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the chat job broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7070)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(args.host, args.port))
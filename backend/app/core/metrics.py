@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """
+    Минимальный in-process реестр метрик: счётчики, gauge и summary (count/sum/max).
+
+    Exposed in Prometheus text format on GET /api/metrics. Values are per
+    worker; aggregate them in the scraper.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self._gauges: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self._summaries: Dict[str, Dict[LabelKey, list]] = defaultdict(dict)
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[name][_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            stat = self._summaries[name].get(key)
+            if stat is None:
+                self._summaries[name][key] = [1, value, value]
+            else:
+                stat[0] += 1
+                stat[1] += value
+                stat[2] = max(stat[2], value)
+
+    def get(self, name: str, **labels) -> float:
+        """Current counter or gauge value (0 if never set)."""
+        key = _key(labels)
+        with self._lock:
+            if name in self._gauges and key in self._gauges[name]:
+                return self._gauges[name][key]
+            return self._counters.get(name, {}).get(key, 0)
+
+    @staticmethod
+    def _fmt(name: str, key: LabelKey, value: float) -> str:
+        labels = ",".join(f'{k}="{v}"' for k, v in key)
+        return f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}"
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(store.items()):
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines += [self._fmt(name, key, value) for key, value in series.items()]
+            for name, series in sorted(self._summaries.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} summary")
+                for key, (count, total, peak) in series.items():
+                    lines.append(self._fmt(f"{name}_count", key, count))
+                    lines.append(self._fmt(f"{name}_sum", key, total))
+                    lines.append(self._fmt(f"{name}_max", key, peak))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
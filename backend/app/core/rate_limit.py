@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.core.security import decode_token
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BucketSpec:
+    capacity: float
+    rate: float  # tokens per second
+
+
+@dataclass
+class _Bucket:
+    tokens: float
+    updated: float
+
+
+class InProcessLimiter:
+    """
+    Token buckets per (user, bucket spec) in this worker's memory.
+
+    A request takes `costs[i]` from `specs[i]` for every i, or nothing at all.
+    Idle users are evicted LRU-style, so memory stays bounded.
+    """
+
+    def __init__(self, specs: Sequence[BucketSpec], max_keys: int = 50_000) -> None:
+        self.specs = tuple(specs)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list[_Bucket]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, costs: Sequence[float], now: Optional[float] = None) -> float:
+        """Returns 0 when allowed, otherwise seconds to wait before retrying."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                buckets = [_Bucket(spec.capacity, now) for spec in self.specs]
+                self._buckets[key] = buckets
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+
+            wait = 0.0
+            for spec, bucket, cost in zip(self.specs, buckets, costs):
+                bucket.tokens = min(spec.capacity, bucket.tokens + (now - bucket.updated) * spec.rate)
+                bucket.updated = now
+                if bucket.tokens < cost:
+                    wait = max(wait, (cost - bucket.tokens) / spec.rate)
+            if wait:
+                return wait
+            for bucket, cost in zip(buckets, costs):
+                bucket.tokens -= cost
+            return 0.0
+
+
+# Атомарно проверяет и списывает сразу из нескольких bucket'ов.
+# KEYS[i] — bucket, ARGV: now, затем тройки (capacity, rate, cost).
+_REDIS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state, wait = {}, 0
+for i, key in ipairs(KEYS) do
+  local cap = tonumber(ARGV[i * 3 - 1])
+  local rate = tonumber(ARGV[i * 3])
+  local cost = tonumber(ARGV[i * 3 + 1])
+  local v = redis.call('HMGET', key, 't', 'u')
+  local tokens = tonumber(v[1]) or cap
+  local updated = tonumber(v[2]) or now
+  tokens = math.min(cap, tokens + math.max(0, now - updated) * rate)
+  if tokens < cost then wait = math.max(wait, (cost - tokens) / rate) end
+  state[i] = {tokens, cost, cap / rate}
+end
+if wait > 0 then return tostring(wait) end
+for i, key in ipairs(KEYS) do
+  redis.call('HSET', key, 't', state[i][1] - state[i][2], 'u', now)
+  redis.call('EXPIRE', key, math.ceil(state[i][3]) + 1)
+end
+return '0'
+"""
+
+
+def bearer_user_key(headers: dict) -> Optional[str]:
+    """User id from a valid access token in raw ASGI headers, else None."""
+    auth = headers.get(b"authorization", b"")
+    if not auth[:7].lower() == b"bearer ":
+        return None
+    payload = decode_token(auth[7:].decode("latin-1").strip())
+    if not payload or payload.get("type") != "access":
+        return None
+    return payload.get("sub")
+
+
+class RedisLimiter:
+    """Same buckets shared by all workers; one round trip per request."""
+
+    def __init__(self, client, specs: Sequence[BucketSpec], prefix: str = "rl") -> None:
+        self.specs = tuple(specs)
+        self.prefix = prefix
+        self._script = client.register_script(_REDIS_SCRIPT)
+
+    async def acquire(self, key: str, costs: Sequence[float]) -> float:
+        keys = [f"{self.prefix}:{i}:{key}" for i in range(len(self.specs))]
+        args: list = [time.time()]
+        for spec, cost in zip(self.specs, costs):
+            args += [spec.capacity, spec.rate, cost]
+        return float(await self._script(keys=keys, args=args))
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware: per-user request rate and estimated LLM-token budget
+    for the endpoints in RATE_LIMIT_PATHS.
+
+    The user key comes from the bearer token through `decode_token`, which is
+    served from the verified-token cache, so the hot path is a hash, a dict
+    lookup and some float arithmetic. Requests without a valid token are let
+    through — authentication rejects them anyway.
+    """
+
+    def __init__(self, app, paths: Optional[Sequence[str]] = None) -> None:
+        self.app = app
+        self.paths = frozenset(paths if paths is not None else settings.RATE_LIMIT_PATHS)
+        self.llm_cost_base = settings.LLM_PROMPT_OVERHEAD_TOKENS + settings.OPENAI_MAX_TOKENS
+        self.llm_capacity = max(settings.LLM_TOKENS_PER_MINUTE, self.llm_cost_base * 2)
+        specs = (
+            BucketSpec(
+                capacity=max(settings.RATE_LIMIT_BURST, 1),
+                rate=settings.RATE_LIMIT_REQUESTS_PER_MINUTE / 60,
+            ),
+            BucketSpec(
+                capacity=self.llm_capacity,
+                rate=settings.LLM_TOKENS_PER_MINUTE / 60,
+            ),
+        )
+        self.local = InProcessLimiter(specs)
+        redis = get_redis()
+        self.shared = RedisLimiter(redis, specs) if redis is not None else None
+
+    def _estimate_llm_tokens(self, headers: dict) -> int:
+        # ~4 символа на токен; тело запроса не читаем, хватает Content-Length
+        try:
+            body_len = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            body_len = 0
+        # не больше ёмкости bucket'а: иначе огромное тело получало бы 429 вечно,
+        # с Retry-After, который никогда не сбудется
+        return min(self.llm_cost_base + max(body_len, 0) // 4, self.llm_capacity)
+
+    async def _acquire(self, key: str, costs: Tuple[int, int]) -> float:
+        if self.shared is not None:
+            try:
+                return await self.shared.acquire(key, costs)
+            except Exception as e:
+                logger.warning("Shared rate limiter unavailable, falling back to local: %s", e)
+        return self.local.acquire(key, costs)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        key = bearer_user_key(headers)
+        if key is None:
+            return await self.app(scope, receive, send)
+
+        wait = await self._acquire(key, (1, self._estimate_llm_tokens(headers)))
+        if not wait:
+            return await self.app(scope, receive, send)
+
+        body = json.dumps({"detail": "Too many requests, please slow down."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,27 @@
+from typing import Optional
+import logging
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def get_redis():
+    """
+    Shared async Redis client, or None when REDIS_URL is not configured.
+
+    Redis is optional: every caller must keep working with its in-process
+    fallback when this returns None.
+    """
+    global _client
+    if _client is not None or not settings.REDIS_URL:
+        return _client
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        logger.warning("REDIS_URL is set but the redis package is not installed")
+        return None
+    _client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Deque, Mapping, Optional
+
+from app.core.metrics import metrics
+
+metrics.describe("circuit_breaker_state", "Circuit breaker state: 0 closed, 1 open, 2 half-open")
+metrics.describe("circuit_breaker_transitions_total", "Circuit breaker state changes")
+
+_STATE_VALUES = {"closed": 0, "open": 1, "half_open": 2}
+
+
+class CircuitBreaker:
+    """
+    Предохранитель вокруг внешнего сервиса.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    `allow()` returns False for `reset_seconds`. Then it lets a single probe
+    call through (half-open): success closes it, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.set("circuit_breaker_state", 0, breaker=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self._transition("half_open")
+            # half-open: пропускаем ровно одну пробу
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != "closed":
+                self._transition("closed")
+
+    def cancel(self) -> None:
+        """The allowed call never reached the service; frees the half-open probe."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self._state != "open":
+                    self._transition("open")
+
+    def _transition(self, state: str) -> None:
+        self._state = state
+        metrics.set("circuit_breaker_state", _STATE_VALUES[state], breaker=self.name)
+        metrics.inc("circuit_breaker_transitions_total", breaker=self.name, state=state)
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    Exponential backoff with full jitter for retry number `attempt` (0-based).
+    A server-provided Retry-After is a lower bound; a little jitter is added
+    on top so throttled workers do not all come back at the same instant.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, base)
+    return delay
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds from `retry-after-ms` / `retry-after` (delta-seconds or HTTP date)."""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class LatencyWindow:
+    """Последние `size` замеров задержки; квантиль считается по окну."""
+
+    def __init__(self, size: int) -> None:
+        self._values: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        return values[min(int(q * len(values)), len(values) - 1)]
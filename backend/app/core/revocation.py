@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import RevokedToken
+
+
+class BloomFilter:
+    """Compact set-membership filter: no false negatives, rare false positives."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # double hashing: h1 + i*h2 поверх одного blake2b
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RefreshTokenStore:
+    """
+    Отзыв refresh-токенов: таблица `revoked_tokens` + Bloom-фильтр в памяти.
+
+    Проверка сначала идёт по фильтру; в БД ходим только если фильтр ответил
+    «возможно отозван». Фильтр догружает новые записи из БД не чаще раза в
+    REVOCATION_SYNC_SECONDS, так что отзыв, сделанный другим воркером,
+    становится виден здесь с такой задержкой.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._bloom = self._new_bloom()
+        self._count = 0
+        self._last_id = 0
+        self._synced_at = 0.0
+
+    @staticmethod
+    def _new_bloom() -> BloomFilter:
+        return BloomFilter(settings.REVOCATION_BLOOM_CAPACITY, settings.REVOCATION_BLOOM_ERROR_RATE)
+
+    def _sync(self, db: Session) -> None:
+        now = time.monotonic()
+        if now - self._synced_at < settings.REVOCATION_SYNC_SECONDS:
+            return
+        rows = (
+            db.query(RevokedToken.id, RevokedToken.jti)
+            .filter(
+                RevokedToken.id > self._last_id,
+                RevokedToken.expires_at > datetime.utcnow(),
+            )
+            .order_by(RevokedToken.id)
+            .all()
+        )
+        with self._lock:
+            for row_id, jti in rows:
+                self._bloom.add(jti)
+                self._last_id = max(self._last_id, row_id)
+            self._count += len(rows)
+            self._synced_at = now
+        if self._count > settings.REVOCATION_BLOOM_CAPACITY:
+            self._rebuild(db)
+
+    def _rebuild(self, db: Session) -> None:
+        """Переcобирает фильтр только из ещё не истёкших записей."""
+        bloom = self._new_bloom()
+        rows = (
+            db.query(RevokedToken.id, RevokedToken.jti)
+            .filter(RevokedToken.expires_at > datetime.utcnow())
+            .all()
+        )
+        last_id = 0
+        for row_id, jti in rows:
+            bloom.add(jti)
+            last_id = max(last_id, row_id)
+        with self._lock:
+            self._bloom = bloom
+            self._count = len(rows)
+            self._last_id = max(self._last_id, last_id)
+
+    def is_revoked(self, db: Session, jti: str) -> bool:
+        self._sync(db)
+        with self._lock:
+            maybe = jti in self._bloom
+        if not maybe:
+            return False
+        # возможный false positive — подтверждаем по таблице
+        return db.query(RevokedToken.id).filter(RevokedToken.jti == jti).first() is not None
+
+    def revoke(self, db: Session, jti: str, subject: str, expires_at: datetime) -> bool:
+        """Returns False if the token was already revoked (e.g. a replayed refresh)."""
+        db.add(RevokedToken(jti=jti, subject=subject, expires_at=expires_at))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            with self._lock:
+                self._bloom.add(jti)
+            return False
+        with self._lock:
+            self._bloom.add(jti)
+            self._count += 1
+        return True
+
+
+refresh_token_store = RefreshTokenStore()
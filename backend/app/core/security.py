@@ -1,3 +1,8 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 from jose import JWTError, jwt
@@ -9,6 +14,54 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", scopes={})
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+
+class VerifiedTokenCache:
+    """
+    LRU уже проверенных access-токенов: sha256(token) → payload.
+
+    Запись живёт не дольше `exp` самого токена, поэтому кэш никогда не
+    продлевает жизнь токену — он лишь избавляет от повторной проверки подписи.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._data: "OrderedDict[bytes, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            payload = self._data.get(key)
+            if payload is None:
+                return None
+            if payload["exp"] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return dict(payload)
+
+    def put(self, token: str, payload: dict) -> None:
+        if self.max_size <= 0 or "exp" not in payload:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._data[key] = dict(payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+token_cache = VerifiedTokenCache(settings.TOKEN_CACHE_SIZE)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -31,16 +84,22 @@ def create_tokens(user_id: str) -> Tuple[str, str]:
         expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
         token_type="access"
     )
+    # jti нужен, чтобы refresh-токен можно было отозвать (ротация / logout)
     refresh_token = create_token(
-        data={"sub": user_id},
+        data={"sub": user_id, "jti": uuid.uuid4().hex},
         expires_delta=timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
         token_type="refresh"
     )
     return access_token, refresh_token
 
 def decode_token(token: str) -> Optional[dict]:
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
     except JWTError:
-        return None 
\ No newline at end of file
+        return None
+    if payload.get("type") == "access":
+        token_cache.put(token, payload)
+    return payload
@@ -1,8 +1,11 @@
-from fastapi import Depends, HTTPException, status
+import hmac
+
+from fastapi import Depends, Header, HTTPException, status
 from jose import JWTError
 from sqlalchemy.orm import Session
 from typing import Optional
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.core.security import decode_token, oauth2_scheme
 from app.models import User
@@ -33,3 +36,21 @@ def get_current_user(
     if user is None:
         raise credentials_exception
     return user
+
+
+def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """Пользователь из ADMIN_EMAILS; остальным — 403."""
+    if current_user.email.lower() not in {email.lower() for email in settings.ADMIN_EMAILS}:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+def require_metrics_access(authorization: Optional[str] = Header(None)) -> None:
+    """Доступ к /api/metrics по METRICS_TOKEN (Authorization: Bearer <token>) — для скрейпера."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip(), settings.METRICS_TOKEN or ""):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
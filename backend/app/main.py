@@ -1,7 +1,17 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import auth, calendar, chat, ai, user, speech
+from app.routes import auth, calendar, chat, ai, user, speech, admin
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.rate_limit import RateLimitMiddleware
+from app.core.idempotency import IdempotencyMiddleware
+from app.dependencies.user import get_admin_user, require_metrics_access
+from app.services.usage_service import usage_meter
+from app.services.chat_jobs import chat_job_workers
+from app.services.chat_write_buffer import chat_write_buffer
+from app.services.chat_retention import chat_retention
+from app.services.speech_service import speech_tokens
 
 app = FastAPI(
     title="NeChaos API",
@@ -15,6 +25,16 @@ origins = [
     "https://nechaos.netlify.app"
 ]
 
+# Per-user throttling of the LLM-backed endpoints.
+# Добавляется до CORS, чтобы ответ 429 тоже получал CORS-заголовки.
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
+# Повторы с тем же Idempotency-Key получают сохранённый ответ.
+# Снаружи лимитера: повтор не тратит лимит и не получает 429 вместо ответа.
+if settings.IDEMPOTENCY_ENABLED:
+    app.add_middleware(IdempotencyMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -22,6 +42,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Idempotent-Replayed"],
 )
 
 # Include routers
@@ -31,8 +52,62 @@ app.include_router(calendar.router, prefix="/api/calendar", tags=["calendar"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(ai.router, prefix="/api/ai", tags=["ai"])
 app.include_router(speech.router, prefix="/api/speech", tags=["speech"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
+
+
+@app.on_event("startup")
+async def start_chat_writes():
+    await chat_write_buffer.start()
+
+
+@app.on_event("startup")
+async def start_chat_jobs():
+    chat_job_workers.start()
+
+
+@app.on_event("startup")
+async def start_chat_retention():
+    # только при CHAT_RETENTION_INTERVAL_SECONDS > 0, иначе — по крону
+    chat_retention.start()
+
+
+@app.on_event("shutdown")
+async def stop_chat_retention():
+    await chat_retention.stop()
+
+
+@app.on_event("shutdown")
+async def stop_chat_jobs():
+    await chat_job_workers.stop()
+
+
+@app.on_event("shutdown")
+async def flush_chat_writes():
+    # после обработчиков задач: их последние ходы тоже попадают в буфер
+    await chat_write_buffer.close()
+
+
+@app.on_event("shutdown")
+async def close_speech_tokens():
+    await speech_tokens.close()
+
+
+@app.on_event("shutdown")
+async def flush_usage():
+    # учёт токенов пишется пачками — не теряем последнюю
+    await usage_meter.close()
 
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy"}
+
+
+@app.get(
+    "/api/metrics",
+    response_class=PlainTextResponse,
+    include_in_schema=False,
+    dependencies=[Depends(require_metrics_access if settings.METRICS_TOKEN else get_admin_user)],
+)
+async def read_metrics():
+    return metrics.render()
@@ -1,7 +1,9 @@
 # Initialize models package 
 from .user import User
 from .calendar import CalendarEvent
-from .chat import Chat, ChatMessage
+from .chat import Chat, ChatArchive, ChatMessage, ChatRecallIndex, ChatSummary
+from .token import RevokedToken
+from .usage import LLMUsage, LLMUsageDaily
 from .base import BaseModel
 
 __all__ = [
@@ -9,5 +11,11 @@ __all__ = [
     "CalendarEvent",
     "Chat",
     "ChatMessage",
+    "ChatSummary",
+    "ChatRecallIndex",
+    "ChatArchive",
+    "RevokedToken",
+    "LLMUsage",
+    "LLMUsageDaily",
     "BaseModel"
 ] 
\ No newline at end of file
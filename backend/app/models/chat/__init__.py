@@ -1,3 +1,3 @@
-from .models import Chat, ChatMessage
+from .models import Chat, ChatArchive, ChatMessage, ChatRecallIndex, ChatSummary
  
-__all__ = ["Chat", "ChatMessage"] 
\ No newline at end of file
+__all__ = ["Chat", "ChatArchive", "ChatMessage", "ChatRecallIndex", "ChatSummary"] 
\ No newline at end of file
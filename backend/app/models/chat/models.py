@@ -1,7 +1,22 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from sqlalchemy import (
+    Column, Date, Integer, LargeBinary, String, Text, ForeignKey, Index, UniqueConstraint, func, literal_column,
+)
 from sqlalchemy.orm import relationship
 from app.models.base import BaseModel
 
+# Конфигурации полнотекстового поиска: русская и английская морфология
+SEARCH_CONFIGS = ("russian", "english")
+
+
+def search_vector(content):
+    """
+    tsvector of a message for full-text search, ru + en. The GIN index on
+    chat_messages is built on exactly this expression; queries must use it as is.
+    """
+    russian, english = (literal_column(f"'{config}'::regconfig") for config in SEARCH_CONFIGS)
+    return func.to_tsvector(russian, content).op("||")(func.to_tsvector(english, content))
+
+
 class Chat(BaseModel):
     __tablename__ = "chats"
 
@@ -15,10 +30,15 @@ class Chat(BaseModel):
 
     # соседние связи
     owner    = relationship("User", back_populates="main_chat")
+    # История бывает длинной: никогда не грузим её целиком через связь.
+    # Страницы — ChatService.get_chat_messages / get_chat_window; удаление
+    # сообщений делает сама БД (ondelete="CASCADE"), без их загрузки.
     messages = relationship(
         "ChatMessage",
         back_populates="chat",
         cascade="all, delete-orphan",
+        lazy="raise",
+        passive_deletes=True,
     )
 
 
@@ -30,3 +50,68 @@ class ChatMessage(BaseModel):
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"))
 
     chat = relationship("Chat", back_populates="messages")
+
+    __table_args__ = (
+        # история чата: WHERE chat_id = ? ORDER BY id DESC LIMIT N
+        Index("ix_chat_messages_chat_id_id", "chat_id", "id"),
+        # полнотекстовый поиск по истории; только в PostgreSQL, в других БД поиск идёт без индекса
+        Index(
+            "ix_chat_messages_content_search",
+            search_vector(literal_column("content")),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+    )
+
+
+class ChatSummary(BaseModel):
+    """Сжатый пересказ старой части переписки (всё до last_message_id включительно)."""
+    __tablename__ = "chat_summaries"
+
+    chat_id = Column(
+        Integer,
+        ForeignKey("chats.id", ondelete="CASCADE"),
+        unique=True,
+        nullable=False,
+    )
+    content         = Column(Text, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+
+
+class ChatRecallIndex(BaseModel):
+    """Сжатый BM25-индекс сообщений чата (всё до last_message_id включительно), см. recall_service."""
+    __tablename__ = "chat_recall_indexes"
+
+    chat_id = Column(
+        Integer,
+        ForeignKey("chats.id", ondelete="CASCADE"),
+        unique=True,
+        nullable=False,
+    )
+    last_message_id = Column(Integer, nullable=False)
+    data            = Column(LargeBinary, nullable=False)
+
+
+class ChatArchive(BaseModel):
+    """
+    Холодное хранилище: сообщения чата за один месяц, вынесенные из
+    chat_messages политикой хранения (см. chat_retention), одним сжатым блоком.
+    """
+    __tablename__ = "chat_message_archives"
+
+    chat_id = Column(
+        Integer,
+        ForeignKey("chats.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    month            = Column(Date, nullable=False)  # первое число месяца (UTC)
+    first_message_id = Column(Integer, nullable=False)
+    last_message_id  = Column(Integer, nullable=False)
+    message_count    = Column(Integer, nullable=False)
+    codec            = Column(String(8), nullable=False)  # zstd | zlib
+    data             = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("chat_id", "month", name="uq_chat_message_archives_chat_id_month"),
+        # история: блоки чата старше before_id, от новых к старым
+        Index("ix_chat_message_archives_chat_id_last", "chat_id", "last_message_id"),
+    )
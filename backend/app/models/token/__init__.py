@@ -0,0 +1,3 @@
+from .models import RevokedToken
+
+__all__ = ["RevokedToken"]
@@ -0,0 +1,10 @@
+from sqlalchemy import Column, String, DateTime
+from app.models.base import BaseModel
+
+class RevokedToken(BaseModel):
+    """Refresh tokens (by `jti`) that were rotated out or logged out."""
+    __tablename__ = "revoked_tokens"
+
+    jti        = Column(String(64), unique=True, index=True, nullable=False)
+    subject    = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,3 @@
+from .models import LLMUsage, LLMUsageDaily
+
+__all__ = ["LLMUsage", "LLMUsageDaily"]
@@ -0,0 +1,45 @@
+from sqlalchemy import Boolean, Column, Date, ForeignKey, Index, Integer, String, UniqueConstraint
+from app.models.base import BaseModel
+
+
+class LLMUsage(BaseModel):
+    """Один вызов модели: токены и задержка. Только INSERT, пишется пачками (см. usage_service)."""
+    __tablename__ = "llm_usage"
+
+    user_id           = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    persona           = Column(String(32), nullable=False, default="")
+    purpose           = Column(String(32), nullable=False, default="chat")  # chat | summary
+    model             = Column(String(64), nullable=False)
+    deployment        = Column(String(32), nullable=False)
+    prompt_tokens     = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens     = Column(Integer, nullable=False, default=0)
+    latency_ms        = Column(Integer, nullable=False, default=0)
+    streamed          = Column(Boolean, nullable=False, default=False)
+    # usage не пришёл в стриме — токены посчитаны локально
+    estimated         = Column(Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        Index("ix_llm_usage_user_id_created_at", "user_id", "created_at"),
+    )
+
+
+class LLMUsageDaily(BaseModel):
+    """Сумма llm_usage по пользователю, персоне и модели за сутки (UTC)."""
+    __tablename__ = "llm_usage_daily"
+
+    day               = Column(Date, nullable=False)
+    user_id           = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    persona           = Column(String(32), nullable=False, default="")
+    model             = Column(String(64), nullable=False)
+    requests          = Column(Integer, nullable=False, default=0)
+    prompt_tokens     = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens     = Column(Integer, nullable=False, default=0)
+    latency_ms        = Column(Integer, nullable=False, default=0)  # сумма; среднее = latency_ms / requests
+
+    __table_args__ = (
+        UniqueConstraint("day", "user_id", "persona", "model", name="uq_llm_usage_daily_key"),
+        # квота: WHERE user_id = ? AND day = ?
+        Index("ix_llm_usage_daily_user_id_day", "user_id", "day"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean
+from sqlalchemy import Column, String, Boolean, Integer
 from sqlalchemy.orm import relationship
 from app.models.base import BaseModel
 
@@ -14,6 +14,9 @@ class User(BaseModel):
     chat_personality = Column(String, default="assistant")
     is_active = Column(Boolean, default=True)
     preferred_language = Column(String, default="ru", nullable=False)
+    # Через сколько дней сообщения чата уходят в холодное хранилище;
+    # NULL — CHAT_RETENTION_DAYS, 0 — никогда
+    chat_retention_days = Column(Integer, nullable=True)
     
      # 1-к-1: ссылка на единственный чат
     main_chat = relationship(
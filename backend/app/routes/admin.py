@@ -0,0 +1,105 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.dependencies.user import get_admin_user
+from app.models import LLMUsageDaily, User
+from app.schemas.usage import UsageReport, UsageRow, UserUsageDay, UserUsageReport
+from app.services.usage_service import usage_meter
+
+router = APIRouter(dependencies=[Depends(get_admin_user)])
+
+_GROUP_COLUMNS = {
+    "user": LLMUsageDaily.user_id,
+    "persona": LLMUsageDaily.persona,
+    "model": LLMUsageDaily.model,
+}
+
+
+def _totals():
+    return (
+        func.sum(LLMUsageDaily.requests).label("requests"),
+        func.sum(LLMUsageDaily.prompt_tokens).label("prompt_tokens"),
+        func.sum(LLMUsageDaily.completion_tokens).label("completion_tokens"),
+        func.sum(LLMUsageDaily.cached_tokens).label("cached_tokens"),
+        func.sum(LLMUsageDaily.latency_ms).label("latency_ms"),
+    )
+
+
+def _totals_dict(row) -> dict:
+    requests = row.requests or 0
+    return {
+        "requests": requests,
+        "prompt_tokens": row.prompt_tokens or 0,
+        "completion_tokens": row.completion_tokens or 0,
+        "cached_tokens": row.cached_tokens or 0,
+        "avg_latency_ms": (row.latency_ms or 0) // requests if requests else 0,
+    }
+
+
+@router.get("/usage", response_model=UsageReport)
+async def usage_report(
+    day: Optional[date] = Query(None, description="UTC day, today by default"),
+    group_by: str = Query("user", pattern="^(user|persona|model)$"),
+    limit: int = Query(50, gt=0, le=500),
+    db: Session = Depends(get_db),
+) -> UsageReport:
+    """Top token consumers of a day from the llm_usage_daily rollup."""
+    # свежие записи ещё в буфере — сначала дописываем их
+    await usage_meter.flush()
+    day = day or datetime.utcnow().date()
+    column = _GROUP_COLUMNS[group_by]
+    tokens = func.sum(LLMUsageDaily.prompt_tokens + LLMUsageDaily.completion_tokens)
+    rows = (
+        db.query(column.label("key"), *_totals())
+        .filter(LLMUsageDaily.day == day)
+        .group_by(column)
+        .order_by(tokens.desc())
+        .limit(limit)
+        .all()
+    )
+    emails = {}
+    if group_by == "user" and rows:
+        emails = dict(db.query(User.id, User.email).filter(User.id.in_([r.key for r in rows])).all())
+    return UsageReport(
+        day=day,
+        group_by=group_by,
+        quota=settings.LLM_DAILY_TOKEN_QUOTA,
+        rows=[
+            UsageRow(key=str(r.key), email=emails.get(r.key), **_totals_dict(r))
+            for r in rows
+        ],
+    )
+
+
+@router.get("/usage/users/{user_id}", response_model=UserUsageReport)
+async def user_usage(
+    user_id: int,
+    days: int = Query(30, gt=0, le=366),
+    db: Session = Depends(get_db),
+) -> UserUsageReport:
+    """One user's daily usage for the last `days` days and where they stand against the quota."""
+    user = db.get(User, user_id)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    await usage_meter.flush()
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = (
+        db.query(LLMUsageDaily.day, *_totals())
+        .filter(LLMUsageDaily.user_id == user_id, LLMUsageDaily.day >= since)
+        .group_by(LLMUsageDaily.day)
+        .order_by(LLMUsageDaily.day.desc())
+        .all()
+    )
+    return UserUsageReport(
+        user_id=user.id,
+        email=user.email,
+        quota=settings.LLM_DAILY_TOKEN_QUOTA,
+        used_today=await usage_meter.used_today(user_id),
+        days=[UserUsageDay(day=r.day, **_totals_dict(r)) for r in rows],
+    )
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, status
 from sqlalchemy.orm import Session
 from typing import Optional
 from pydantic import BaseModel, validator
@@ -6,13 +6,14 @@ from datetime import datetime
 
 from app.core.database import get_db
 from app.dependencies.user import get_current_user
-from app.models import User, Chat, ChatMessage, CalendarEvent
-from app.services.ai_service import AIService
+from app.models import User, Chat, ChatMessage
+from app.services.ai_service import ai_service
 from app.services.calendar_service import CalendarService
-from app.services.chat_service import ChatService
+from app.services.chat_service import ChatService, persist_turn
+from app.utils.language import detect_language
+from app.utils.timing import StageTimer
 
 router = APIRouter()
-ai_service = AIService()
 
 class AIMessageRequest(BaseModel):
     message: str
@@ -43,6 +44,8 @@ class AIMessageResponse(BaseModel):
 @router.post("/analyze", response_model=AIMessageResponse)
 async def analyze_message(
     request: AIMessageRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -57,69 +60,38 @@ async def analyze_message(
         # Detect language if not specified
         language = request.language
         if not language:
-            language = await ai_service.detect_language(request.message)
+            language = detect_language(request.message, fallback=current_user.preferred_language)
 
-        # Get or create chat
-        chat = None
-        if request.chat_id:
-            chat = chat_service.get_chat(request.chat_id)
-            if not chat:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Chat not found"
-                )
-        else:
-            chat = chat_service.create_chat(request.message[:50] + "...")
-
-        # Save user message
-        chat_service.add_message(chat.id, request.message, "user")
+        # У пользователя ровно один чат (owner_id unique)
+        chat_id = chat_service.get_chat_id()
+        if request.chat_id and request.chat_id != chat_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Chat not found"
+            )
 
         # Analyze message with AI
+        timer = StageTimer()
         analysis = await ai_service.analyze_message(
             message=request.message,
+            chat_id=chat_id,
             personality=personality,
             user_gender=current_user.gender,
             language=language,
-            calendar_service=calendar_service
+            calendar_service=calendar_service,
+            timer=timer,
         )
 
-        # Save AI response
-        chat_service.add_message(chat.id, analysis["message"], "assistant")
-
-        # Create calendar event if detected
-        calendar_event_id = None
-        if analysis["calendar_data"] and analysis["should_create_event"]:
-            try:
-                calendar_data = analysis["calendar_data"]
-                # Validate required fields
-                if not all(key in calendar_data for key in ["title", "startTime"]):
-                    raise ValueError("Missing required calendar data fields")
-
-                # Parse dates
-                start_time = datetime.fromisoformat(calendar_data["startTime"].replace('Z', '+00:00'))
-                end_time = None
-                if "endTime" in calendar_data:
-                    end_time = datetime.fromisoformat(calendar_data["endTime"].replace('Z', '+00:00'))
+        # Save both messages after the response is sent
+        background_tasks.add_task(persist_turn, current_user.id, chat_id, request.message, analysis["message"])
+        response.headers["Server-Timing"] = timer.server_timing()
 
-                event = CalendarEvent(
-                    title=calendar_data["title"],
-                    description=calendar_data.get("description"),
-                    start_time=start_time,
-                    end_time=end_time,
-                    owner_id=current_user.id
-                )
-                db.add(event)
-                db.commit()
-                db.refresh(event)
-                calendar_event_id = event.id
-            except (ValueError, KeyError) as e:
-                print(f"[AI Route] Calendar event creation error: {e}")
-                # Continue without creating event
-                pass
+        # События создаются инструментами модели внутри analyze_message
+        calendar_event_id = int(analysis["event_id"]) if analysis.get("event_id") else None
 
         return {
             "message": analysis["message"],
-            "chat_id": chat.id,
+            "chat_id": chat_id,
             "calendar_event_id": calendar_event_id
         }
 
@@ -3,10 +3,12 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from typing import Optional
+from datetime import datetime
 from jose import JWTError
 
 from app.core.database import get_db
 from app.core.security import verify_password, get_password_hash, create_tokens, decode_token
+from app.core.revocation import refresh_token_store
 from app.models import User
 from app.schemas.auth import UserCreate, Token, UserResponse, RefreshToken
 
@@ -88,20 +90,48 @@ def refresh_access_token(
     except JWTError:
         raise credentials_exc
 
-    if payload.get("type") != "refresh":
+    if payload is None or payload.get("type") != "refresh":
         raise credentials_exc
 
     email: Optional[str] = payload.get("sub")
     if not email:
         raise credentials_exc
 
+    # ротация: старый refresh-токен одноразовый. Токены без jti выпущены до
+    # ротации и отозвать их нельзя — такие не принимаем, нужен повторный вход
+    jti: Optional[str] = payload.get("jti")
+    if not jti or refresh_token_store.is_revoked(db, jti):
+        raise credentials_exc
+
     user = db.query(User).filter_by(email=email).first()
     if not user:
         raise credentials_exc
 
+    if not refresh_token_store.revoke(
+        db, jti, email, datetime.utcfromtimestamp(payload["exp"])
+    ):
+        # параллельный refresh тем же токеном уже успел его отозвать
+        raise credentials_exc
+
     access_token, new_refresh = create_tokens(user.email)
     return Token(
         access_token=access_token,
         refresh_token=new_refresh,
         token_type="bearer",
     )
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(
+    token_in: RefreshToken,
+    db: Session = Depends(get_db),
+):
+    payload = decode_token(token_in.refresh_token)
+    if payload and payload.get("type") == "refresh" and payload.get("jti"):
+        refresh_token_store.revoke(
+            db,
+            payload["jti"],
+            payload.get("sub", ""),
+            datetime.utcfromtimestamp(payload["exp"]),
+        )
+    return None
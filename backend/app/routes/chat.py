@@ -1,107 +1,319 @@
-from typing import List, Optional
+import asyncio
+import json
+import logging
+from typing import List, Optional, Set
 
+from datetime import datetime
 from fastapi import (
     APIRouter,
+    BackgroundTasks,
     Depends,
+    Header,
+    HTTPException,
     Query,
+    Response,
+    status,
 )
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from app.dependencies.chat import get_chat_service
 from app.dependencies.calendar import get_calendar_service
 from app.dependencies.user import get_current_user
 from app.models import User, Chat, ChatMessage
 from app.schemas.ai import AIMessageRequest, AIMessageResponse
-from app.services.ai_service import AIService
-from app.services.chat_service import ChatService
+from app.services.ai_service import ai_service
+from app.services.chat_service import ChatService, persist_turn
 from app.services.calendar_service import CalendarService
-from app.schemas.chat import ChatMessageResponse, ChatResponse
+from app.schemas.chat import (
+    ChatJobAccepted,
+    ChatJobResponse,
+    ChatMessageResponse,
+    ChatResponse,
+    ChatSearchResponse,
+)
+from app.core.job_queue import ERROR, Job, QueueFullError
+from app.services.chat_jobs import chat_jobs
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import get_db, SessionLocal
+from app.utils.timing import StageTimer
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-ai_service = AIService()
 
-@router.post("/message", response_model=AIMessageResponse)
+# записи ходов SSE-стрима: задача не должна зависеть от того, дочитал ли клиент поток
+_persist_tasks: Set[asyncio.Task] = set()
+
+
+def _persist_in_background(user_id: int, chat_id: int, user_text: str, reply: str) -> None:
+    task = asyncio.create_task(asyncio.to_thread(persist_turn, user_id, chat_id, user_text, reply))
+    _persist_tasks.add(task)
+    task.add_done_callback(_persist_tasks.discard)
+
+@router.post(
+    "/message",
+    response_model=AIMessageResponse,
+    responses={status.HTTP_202_ACCEPTED: {"model": ChatJobAccepted}},
+)
 async def send_message(
     req: AIMessageRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    mode: str = Query("sync", pattern="^(sync|async)$"),
     chat_svc: ChatService = Depends(get_chat_service),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    """
+    With `mode=async` the turn is only queued: the response is 202 with a
+    job id, the result comes from GET /jobs/{job_id} or its /stream.
+    """
     print("req in send_message", req)
 
-    chat = chat_svc.get_or_create_chat()
-    print("chat in send_message", chat)
+    if mode == "async":
+        return await _enqueue_turn(req, current_user)
 
-    chat_svc.add_message(
-        chat_id=chat.id,
-        role="user",
-        content=req.message,
-    )
+    timer = StageTimer()
+    with timer.stage("chat"):
+        chat_id = chat_svc.get_chat_id()
+    print("chat in send_message", chat_id)
 
     analysis = await ai_service.analyze_message(
         message=req.message,
-        chat_id=chat.id,
+        chat_id=chat_id,
         personality=current_user.chat_personality,
         user_gender=current_user.gender,
         language=current_user.preferred_language,
         calendar_service=CalendarService(db, current_user),
+        timer=timer,
     )
 
     print("analysis in send_message", analysis)
 
-    ai_reply = {
-        "message":      analysis["message"],
-        "calendar_event_id": analysis.get("calendar_event_id"),
-    }
-
-    print("ai_reply in send_message", ai_reply)
-
-    print("AIMessageResponse in send_message", AIMessageResponse(
-        message=ai_reply["message"], chat_id=chat.id))
-    
     calendar_event_id: Optional[int] = (
         int(analysis["event_id"]) if analysis.get("event_id") else None
     )
-    
-    chat_svc.add_message(chat.id, "assistant", analysis["message"])
-    
+
+    # сообщения пишутся в БД уже после отправки ответа
+    background_tasks.add_task(persist_turn, current_user.id, chat_id, req.message, analysis["message"])
+    response.headers["Server-Timing"] = timer.server_timing()
+    logger.debug("Critical path of send_message: %s", timer.critical_path())
+
     return AIMessageResponse(
         message=analysis["message"],
-        chat_id=chat.id,
+        chat_id=chat_id,
         calendar_event_id=calendar_event_id,  
     )
 
 
+async def _enqueue_turn(req: AIMessageRequest, user: User) -> JSONResponse:
+    job = Job(user_id=user.id, payload={"message": req.message})
+    try:
+        await chat_jobs.submit(job)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS if e.per_user else status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"},
+        )
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=ChatJobAccepted(job_id=job.id, status=job.status).model_dump(),
+        headers={"Location": f"/api/chat/jobs/{job.id}"},
+    )
+
+
+async def _get_own_job(job_id: str, user: User) -> Job:
+    job = await chat_jobs.get(job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=ChatJobResponse)
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+) -> ChatJobResponse:
+    job = await _get_own_job(job_id, current_user)
+    return ChatJobResponse(
+        job_id=job.id,
+        status=job.status,
+        result=job.result,
+        error=job.error,
+        created_at=datetime.fromtimestamp(job.created_at),
+        finished_at=datetime.fromtimestamp(job.finished_at) if job.finished_at else None,
+    )
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    last_event_id: Optional[int] = Header(None, ge=0),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Events of a queued turn as Server-Sent Events, the same as
+    POST /message/stream sends. Every event has an `id`; after a reconnect
+    the stream resumes after Last-Event-ID (or from `offset`).
+    """
+    await _get_own_job(job_id, current_user)
+    start = last_event_id + 1 if last_event_id is not None else offset
+
+    async def events():
+        position, terminal = start, False
+        while True:
+            batch, finished = await chat_jobs.events(job_id, position, timeout=15.0)
+            for event, data in batch:
+                yield _sse(event, data, event_id=position)
+                position += 1
+                terminal = event in ("done", "error")
+            if finished and not batch:
+                if not terminal and position > 0:
+                    # клиент мог переподключиться уже после последнего события:
+                    # смотрим, чем закончился весь журнал задачи, а не только эта выборка
+                    last, _ = await chat_jobs.events(job_id, position - 1, timeout=0)
+                    terminal = bool(last) and last[-1][0] in ("done", "error")
+                job = await chat_jobs.get(job_id)
+                if not terminal and job is not None and job.status == ERROR:
+                    # задача упала, не опубликовав ошибку сама
+                    yield _sse("error", {"message": job.error}, event_id=position)
+                return
+            if not batch:
+                yield ": ping\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/message/stream")
+async def send_message_stream(
+    req: AIMessageRequest,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Same as POST /message, but the reply is streamed as Server-Sent Events:
+    `token` (text delta), `calendar` (result of a calendar action),
+    then `done` (final AIMessageResponse) or `error`.
+    """
+    user_id = current_user.id
+
+    async def events():
+        # Сессия из get_db закрывается до отправки тела ответа,
+        # поэтому генератор работает со своей.
+        db = SessionLocal()
+        try:
+            timer = StageTimer()
+            user = db.get(User, user_id)
+            chat_svc = ChatService(db, user)
+            with timer.stage("chat"):
+                chat_id = chat_svc.get_chat_id()
+
+            async for event, data in ai_service.stream_message(
+                req.message,
+                chat_id=chat_id,
+                personality=user.chat_personality,
+                user_gender=user.gender,
+                language=user.preferred_language,
+                calendar_service=CalendarService(db, user),
+                timer=timer,
+            ):
+                if event not in ("done", "error"):
+                    yield _sse(event, data)
+                    continue
+
+                # запись ставится до последнего события: клиент, закрывший поток
+                # сразу после done, отменяет генератор, но не эту задачу.
+                # Текст ошибки сохраняется так же, как в POST /message
+                _persist_in_background(user_id, chat_id, req.message, data["message"])
+                if event == "error":
+                    yield _sse("error", data)
+                    continue
+                logger.debug("Critical path of send_message_stream: %s", timer.critical_path())
+                yield _sse("done", AIMessageResponse(
+                    message=data["message"],
+                    chat_id=chat_id,
+                    calendar_event_id=int(data["event_id"]) if data.get("event_id") else None,
+                ).model_dump())
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/me/messages", response_model=List[ChatMessageResponse])
 def get_my_messages(
     limit:     int = Query(50, gt=0),
     before_id: Optional[int] = Query(None, gt=0),
     chat_svc:  ChatService = Depends(get_chat_service),
 ) -> List[ChatMessageResponse]:
-    chat = chat_svc.get_or_create_chat()
     return chat_svc.get_chat_messages(
-        chat_id=chat.id,
+        chat_id=chat_svc.get_chat_id(),
         limit=limit,
         before_id=before_id,
     )
 
 
-@router.get("/search", response_model=List[ChatMessageResponse])
+@router.get("/search", response_model=ChatSearchResponse)
 def search_messages(
-    query:   str = Query(..., min_length=1),
-    limit:   int = Query(20, gt=0),
+    query:   str = Query(..., min_length=1, max_length=200),
+    limit:   int = Query(20, gt=0, le=settings.CHAT_SEARCH_MAX_LIMIT),
+    cursor:  Optional[str] = Query(None, description="next_cursor of the previous page"),
     chat_svc: ChatService = Depends(get_chat_service),
-) -> List[ChatMessage]:
+) -> ChatSearchResponse:
+    """
+    Ranked full-text search in the user's chat history.
+
+    Only hot messages are searched: those older than the user's
+    chat_retention_days are moved to the archive by the retention pass and
+    no longer match. `archived_up_to_id` in the response is the newest
+    archived message id (None when nothing is archived), so the client can
+    tell the user that older messages are not covered.
 
-    chat = chat_svc.get_or_create_chat()
-    return chat_svc.search_messages(chat, query=query, limit=limit)
+    Likewise only the CHAT_SEARCH_MAX_CANDIDATES newest matches are ranked
+    and paged; when a query matched more, `ranked_from_id` is the oldest
+    ranked one and older matches appear on no page.
+    """
+    chat_id = chat_svc.get_chat_id()
+    hits, next_cursor, ranked_from_id = chat_svc.search_messages(chat_id, query=query, limit=limit, cursor=cursor)
+    return ChatSearchResponse(
+        hits=hits,
+        next_cursor=next_cursor,
+        archived_up_to_id=chat_svc.archived_up_to(chat_id),
+        ranked_from_id=ranked_from_id,
+    )
 
 
 @router.get("/me", response_model=ChatResponse)
 def get_my_chat(
+    limit:    int = Query(settings.CHAT_WINDOW_SIZE, gt=0, le=settings.CHAT_WINDOW_MAX),
     chat_svc: ChatService = Depends(get_chat_service),
 ) -> ChatResponse:
-
-    return chat_svc.get_or_create_chat()
\ No newline at end of file
+    """
+    The user's chat with its newest `limit` messages. Older ones come from
+    GET /me/messages?before_id={next_before_id}.
+    """
+    chat, messages, next_before_id = chat_svc.get_chat_window(limit)
+    return ChatResponse(
+        id=chat.id,
+        title=chat.title,
+        owner_id=chat.owner_id,
+        created_at=chat.created_at,
+        updated_at=chat.updated_at,
+        messages=[ChatMessageResponse.model_validate(m) for m in messages],
+        next_before_id=next_before_id,
+    )
@@ -1,14 +1,17 @@
-import os, time, requests
 from fastapi import APIRouter, HTTPException, status
 from app.core.config import settings
+from app.services.speech_service import SpeechTokenError, speech_tokens
 
 router = APIRouter()
 
 @router.get("/token")
-def speech_token():
+async def speech_token():
+    """
+    Azure Speech token for the client SDK. Served from memory; the STS is
+    called only on a cold start or when nobody asked for a while.
+    """
     key    = settings.AZURE_SPEECH_KEY
     region = settings.AZURE_SPEECH_REGION
-    print("AZURE_SPEECH_KEY =", os.getenv("AZURE_SPEECH_KEY"))
 
     # 1) проверка переменных окружения
     if not key:
@@ -18,27 +21,13 @@ def speech_token():
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR,
                             "AZURE_SPEECH_REGION env not set")
 
-    url = f"https://{region}.api.cognitive.microsoft.com/sts/v1.0/issueToken"
-
     try:
-        resp = requests.post(
-            url,
-            headers={
-                "Ocp-Apim-Subscription-Key": key,
-                "Content-Length": "0"              # Azure рекомендует
-            },
-            timeout=5
-        )
-    except requests.Timeout:
-        raise HTTPException(status.HTTP_504_GATEWAY_TIMEOUT,
-                            "Azure STS timeout")
-
-    if resp.status_code != 200:
-        raise HTTPException(status.HTTP_502_BAD_GATEWAY,
-                            f"Azure STS error ({resp.status_code})")
+        token = await speech_tokens.get(region)
+    except SpeechTokenError as e:
+        raise HTTPException(e.status_code, e.detail)
 
     return {
-        "token": resp.text,
+        "token": token.value,
         "region": region,
-        "expires_at": int(time.time()) + 540   # ~9 мин
+        "expires_at": token.expires_at,
     }
@@ -5,7 +5,7 @@ from app.core.database import get_db
 from app.dependencies.user import get_current_user
 from app.models import User
 from app.schemas.auth import UserResponse
-from app.schemas.user import UpdatePersonalityRequest
+from app.schemas.user import UpdatePersonalityRequest, UpdateRetentionRequest
 
 router = APIRouter()
 
@@ -30,3 +30,16 @@ async def update_personality(
     db.commit()
     db.refresh(current_user)
     return current_user
+
+
+@router.put("/me/retention", response_model=UserResponse)
+def update_retention(
+    request: UpdateRetentionRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """How many days chat messages stay hot before they move to the archive."""
+    current_user.chat_retention_days = request.days
+    db.commit()
+    db.refresh(current_user)
+    return current_user
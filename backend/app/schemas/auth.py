@@ -17,12 +17,15 @@ class UserBase(BaseModel):
     timezone: Optional[str] = None
     chat_personality: Optional[str] = "assistant"
     preferred_language: Optional[str] = "ru"
+
 class UserCreate(UserBase):
     password: str
 
 class UserResponse(UserBase):
     id: int
     is_active: bool
+    # задаётся только через PUT /api/user/chat-retention
+    chat_retention_days: Optional[int] = None
 
     class Config:
         from_attributes = True
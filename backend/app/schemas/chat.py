@@ -2,6 +2,8 @@ from pydantic import BaseModel
 from datetime import datetime
 from typing import List, Optional
 
+from app.schemas.ai import AIMessageResponse
+
 class ChatMessageBase(BaseModel):
     content: str
     role: str
@@ -18,6 +20,24 @@ class ChatMessageResponse(ChatMessageBase):
     class Config:
         from_attributes = True
 
+class ChatSearchHit(BaseModel):
+    id: int
+    chat_id: int
+    role: str
+    created_at: datetime
+    rank: float
+    # HTML-экранированный фрагмент, совпадения в <mark>…</mark>
+    snippet: str
+
+class ChatSearchResponse(BaseModel):
+    hits: List[ChatSearchHit]
+    next_cursor: Optional[str] = None
+    # сообщения с id <= этого уже в архиве и в поиск не попадают; None — архива нет
+    archived_up_to_id: Optional[int] = None
+    # ранжируются только CHAT_SEARCH_MAX_CANDIDATES самых свежих совпадений:
+    # совпадения старше этого id не попадут ни на одну страницу; None — ранжированы все
+    ranked_from_id: Optional[int] = None
+
 class ChatBase(BaseModel):
     title: str
 
@@ -32,10 +52,26 @@ class ChatResponse(ChatBase):
     owner_id: int
     created_at: datetime
     updated_at: datetime
+    # последние сообщения чата, от старых к новым
     messages: List[ChatMessageResponse]
+    # before_id для GET /me/messages со следующей (более старой) страницей; None — история вся
+    next_before_id: Optional[int] = None
 
     class Config:
         from_attributes = True
 
 class ChatList(BaseModel):
     chats: List[ChatResponse]
+
+class ChatJobAccepted(BaseModel):
+    job_id: str
+    status: str
+
+class ChatJobResponse(BaseModel):
+    job_id: str
+    # queued / running / done / error
+    status: str
+    result: Optional[AIMessageResponse] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,31 @@
+from pydantic import BaseModel
+from datetime import date
+from typing import List, Optional
+
+class UsageTotals(BaseModel):
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    avg_latency_ms: int
+
+class UsageRow(UsageTotals):
+    # user_id / persona / model — в зависимости от group_by
+    key: str
+    email: Optional[str] = None
+
+class UsageReport(BaseModel):
+    day: date
+    group_by: str
+    quota: Optional[int] = None
+    rows: List[UsageRow]
+
+class UserUsageDay(UsageTotals):
+    day: date
+
+class UserUsageReport(BaseModel):
+    user_id: int
+    email: str
+    quota: Optional[int] = None
+    used_today: int
+    days: List[UserUsageDay]
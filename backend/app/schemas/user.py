@@ -1,5 +1,11 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field
 
 
 class UpdatePersonalityRequest(BaseModel):
-    personality: str
\ No newline at end of file
+    personality: str
+
+class UpdateRetentionRequest(BaseModel):
+    # null — срок по умолчанию (CHAT_RETENTION_DAYS), 0 — не архивировать
+    days: Optional[int] = Field(None, ge=0, le=3650)
\ No newline at end of file
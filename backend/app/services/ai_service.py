@@ -1,212 +1,489 @@
 from __future__ import annotations
 
+import asyncio
 import json
-import re
-from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
 from openai import AsyncAzureOpenAI, OpenAIError
-from app.services.openai_service import ask_gpt
+from app.services.openai_service import (
+    AssistantTurn, LLMUnavailableError, QuotaExceededError, ask_gpt, use_usage_meter,
+)
+
+from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.database import run_in_session
+from app.models import User
 from app.services.calendar_service import CalendarService
+from app.services.calendar_tools import CALENDAR_TOOLS, CalendarToolRunner, ToolResult
 from app.services.memory_service import MemoryStore
+from app.services.fast_path import FastPath
+from app.services.model_router import ModelRouter
+from app.services.prompt_service import PromptAssembler
+from app.services.recall_service import ChatRecall, Recalled
+from app.services.summary_service import ConversationSummarizer
+from app.services.usage_service import bind_caller, unbind_caller, usage_meter
+from app.utils.language import LANGUAGE_NAMES, detect_language
+from app.utils.temporal import parse_date_range
+from app.utils.timing import StageTimer
+from app.utils.tokens import count_tokens
+
+
+def _overlaps(ev, start: datetime, end: datetime) -> bool:
+    """Same overlap rule as CalendarService.list_events_between, in memory."""
+    ev_start = ev.start_time if ev.start_time.tzinfo else ev.start_time.replace(tzinfo=timezone.utc)
+    if ev.end_time is None:
+        return ev_start < end
+    ev_end = ev.end_time if ev.end_time.tzinfo else ev.end_time.replace(tzinfo=timezone.utc)
+    return (
+        (start <= ev_start < end)
+        or (start < ev_end <= end)
+        or (ev_start <= start and ev_end >= end)
+    )
+
+
+PERSONAS = {
+    "assistant": (
+        "You are a professional, highly efficient, and concise AI assistant. "
+        "Your tone is formal, objective, and focused on delivering information clearly and directly, "
+        "without unnecessary conversational fillers or emotional expressions. "
+        "Prioritize accuracy and brevity in your responses."
+    ),
+    "coach": (
+        "You are an energetic, inspiring, and motivational coach. "
+        "Your tone is uplifting, dynamic, and action-oriented. "
+        "Encourage and empower the user, using positive affirmations and enthusiastic language. "
+        "Focus on progress, goals, and overcoming challenges. "
+        "Feel free to use exclamation points and encouraging phrases."
+    ),
+    "friend": (
+        "You're the user's best friend. Your tone is casual, informal, and supportive, like a real friend. "
+        "Use everyday language, slang where appropriate, and express genuine care and understanding. "
+        "Feel free to share brief, relatable opinions or observations. "
+        "Focus on empathy, camaraderie, and friendly advice."
+    ),
+    "girlfriend": (
+        "You're a sweet and caring girlfriend. Be emotionally supportive and warm. "
+        "Feel free to add emojis at the start of each bullet to show affection and warmth. "
+        "Your language is gentle, affectionate, and reassuring. "
+        "Show genuine interest in the user's feelings and well-being, offering comfort and understanding."
+    ),
+    "boyfriend": (
+        "You're a protective and caring boyfriend. Make the user feel reassured and loved. "
+        "Feel free to add emojis at the start of each bullet to show care and support. "
+        "Your tone is steady, reliable, and thoughtful. "
+        "Offer practical support and a sense of security, always prioritizing the user's comfort and safety."
+    ),
+}
+
+
+GENDER_HINTS = {
+    "male":   "The user is male; adapt your responses accordingly.",
+    "female": "The user is female; adapt your responses accordingly.",
+    "other":  "Keep responses gender-neutral.",
+}
+
+
+CALENDAR_INSTRUCTIONS = (
+    "Calendar skills:\n"
+    "• Today's date and the `calendar_context` come in a separate system message right before the user's latest message.\n"
+    "• Your primary goal regarding the calendar is to provide the user with **relevant calendar information** or **facilitate event creation/deletion**.\n"
+    "• When the user asks about their schedule, plans, or events, **identify the exact date or date range they are interested in.**\n"
+    "  **If no specific date or period is mentioned but the user asks about 'plans', 'schedule', 'tasks', or 'calendar', default to TODAY.**\n"
+    "  **If they ask about 'weekly plans' or 'plans for the week', default to the CURRENT WEEK (today + next 6 days).**\n"
+    "  **Recognize temporal phrases like 'today', 'tomorrow', 'yesterday', 'this week', 'next week', 'Friday', 'August 1st', etc.** and adjust the context you request accordingly.\n"
+    "• The `calendar_context` provided contains the requested events. It is already filtered, categorized (Past, Current, Upcoming), and includes a date header (e.g., '09 июля, 2025').\n"
+    "  **If `calendar_context` contains events for multiple days (e.g., a week), each day's events will be separated by a '---' line.**\n"
+    "  **Do not add any additional date headers, categorization, or formatting for events; just present the provided `calendar_context` content naturally in your reply.**\n"
+    "• The schedules you see ARE ALREADY in the user's local time zone. Repeat the times exactly as they appear; DO NOT convert or shift them.\n"
+    "• Always present times in **24-hour format** (e.g., 15:00, not 3 PM) and list each event on a new line, preceded by “- ”.\n"
+    "  If the persona is 'girlfriend' or 'boyfriend', you may prepend a fitting emoji to each bullet.\n"
+    "• Suggest free/available time slots.\n"
+    "• Replies must be concise; avoid filler phrases such as “I'm always here” or similar supportive lines.\n"
+    "• Remember you are an AI, not a living being, and cannot perform real-world actions or meetings.\n"
+    "• Calendar actions go through the tools: create_event, delete_event, list_events, find_free_slots.\n"
+    "    1) Call create_event only if the user explicitly asks to ADD/BOOK/SCHEDULE an event. Times are local,\n"
+    "       YYYY-MM-DDTHH:MM; pass end or duration_minutes, and if the user gave neither, ask before calling.\n"
+    "    2) For delete_event pass event_id when you know it (list_events returns ids), otherwise title and date;\n"
+    "       add start to pick a specific event. If several events match and you cannot tell which one, ask first.\n"
+    "    3) Several actions requested in one message → call all the tools in the same reply; they are applied together or not at all.\n"
+    "    4) With create/delete, also write your short reply to the user in the same message.\n"
+    "    5) Use list_events only for dates that are not in `calendar_context`, and find_free_slots to look for free time.\n"
+    "    6) **Never** mention the tools, their names or JSON in your reply.\n"
+)
+
+
+# Ответ, когда модель недоступна (открыт предохранитель, перегрузка, дедлайн).
+# Типовые вопросы о календаре при этом по-прежнему обслуживает FastPath.
+DEGRADED_REPLY = (
+    "Ассистент сейчас перегружен, попробуйте через минуту. "
+    "Простые запросы вроде «что у меня завтра?» работают и сейчас."
+)
+
+
+# Дневная квота токенов исчерпана (LLM_DAILY_TOKEN_QUOTA); FastPath при этом работает.
+QUOTA_REPLY = (
+    "Дневной лимит сообщений ассистенту исчерпан, он обновится завтра. "
+    "Простые запросы вроде «что у меня завтра?» работают и сейчас."
+)
+
+
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+def _round_stage(name: str, round_no: int) -> str:
+    # второй и следующие круги вызова инструментов — отдельные стадии
+    return name if round_no == 0 else f"{name}_{round_no + 1}"
 
 
 class AIService:
     """Wrapper around OpenAI Chat API with calendar awareness."""
 
-    def build_calendar_context(self, calendar_service, target_date_local: Optional[datetime.date] = None, is_weekly_request: bool = False) -> str:
+    def build_calendar_context(
+        self,
+        calendar_service,
+        target_date_local: Optional[date] = None,
+        is_weekly_request: bool = False,
+        lang: Optional[str] = None,
+        end_date_local: Optional[date] = None,
+    ) -> str:
         """
-        Builds a formatted calendar context for the AI, showing events for a specific day or week.
+        Builds a formatted calendar context for the AI, showing events for a specific day or a range of days.
         
         Args:
             calendar_service: An instance of CalendarService.
             target_date_local: The specific date (in user's local timezone) for which to fetch events.
                                If None, defaults to the current local date.
             is_weekly_request: If True, fetches and formats events for the current week (7 days from target_date_local).
+            lang: Language of the headers; defaults to the user's preferred_language.
+            end_date_local: Last day (inclusive) of a multi-day range starting at target_date_local.
         
         Returns:
             A string containing formatted calendar events.
         """
         user_tz = ZoneInfo(calendar_service.user.timezone)
         now_local = datetime.now(user_tz)
+        lang = lang or calendar_service.user.preferred_language
 
         if target_date_local is None:
             target_date_local = now_local.date() # Ensure it's a date object
-
         if is_weekly_request:
-            weekly_context_parts = []
-            start_of_week_date = target_date_local # Start from the target_date for the week
-            end_of_week_date = start_of_week_date + timedelta(days=6) # 7 days total
-
-            current_day_iter = start_of_week_date
-            while current_day_iter <= end_of_week_date:
-                start_of_current_day_local = datetime.combine(current_day_iter, datetime.min.time(), tzinfo=user_tz)
-                end_of_current_day_local = datetime.combine(current_day_iter, datetime.max.time(), tzinfo=user_tz)
-                
-                start_utc = start_of_current_day_local.astimezone(timezone.utc)
-                end_utc = end_of_current_day_local.astimezone(timezone.utc)
-
-                events_for_day = calendar_service.list_events_between(start_utc, end_utc)
-                
-                formatted_day_events = calendar_service.format_events_for_ai(
-                    events_for_day, 
-                    lang=calendar_service.user.preferred_language, 
-                    hide_past=False,
-                    target_date=current_day_iter # Pass the specific date for the header
-                )
-                weekly_context_parts.append(formatted_day_events)
-                current_day_iter += timedelta(days=1)
-            
-            # Combine parts with a distinct separator for the LLM
-            return "\n\n---\n\n".join(weekly_context_parts) + "\n"
-            
-        else: # Single day request
-            start_of_target_day_local = datetime.combine(target_date_local, datetime.min.time(), tzinfo=user_tz)
-            end_of_target_day_local = datetime.combine(target_date_local, datetime.max.time(), tzinfo=user_tz)
-            
-            start_utc = start_of_target_day_local.astimezone(timezone.utc)
-            end_utc = end_of_target_day_local.astimezone(timezone.utc)
-
-            events = calendar_service.list_events_between(start_utc, end_utc)
-
-            formatted_events = calendar_service.format_events_for_ai(
-                events, 
-                lang=calendar_service.user.preferred_language, 
+            end_date_local = target_date_local + timedelta(days=6) # 7 days total
+        if end_date_local is None or end_date_local < target_date_local:
+            end_date_local = target_date_local
+
+        # Один запрос на весь диапазон, дальше раскладываем события по дням
+        range_start_utc = datetime.combine(target_date_local, datetime.min.time(), tzinfo=user_tz).astimezone(timezone.utc)
+        range_end_utc = datetime.combine(end_date_local + timedelta(days=1), datetime.min.time(), tzinfo=user_tz).astimezone(timezone.utc)
+        events = calendar_service.list_events_between(range_start_utc, range_end_utc)
+
+        day_parts = []
+        current_day_iter = target_date_local
+        while current_day_iter <= end_date_local:
+            day_start = datetime.combine(current_day_iter, datetime.min.time(), tzinfo=user_tz).astimezone(timezone.utc)
+            day_end = datetime.combine(current_day_iter + timedelta(days=1), datetime.min.time(), tzinfo=user_tz).astimezone(timezone.utc)
+            events_for_day = [ev for ev in events if _overlaps(ev, day_start, day_end)]
+
+            # format_events_for_ai handles the full header including "no events" or event list
+            day_parts.append(calendar_service.format_events_for_ai(
+                events_for_day, 
+                lang=lang, 
                 hide_past=False,
-                target_date=target_date_local # Pass the specific date for the header
-            )
-            
-            # The format_events_for_ai now handles the full header including "no events" or event list
-            # So, we just return its result directly, followed by a newline for consistency.
-            return formatted_events + "\n"
+                target_date=current_day_iter # Pass the specific date for the header
+            ))
+            current_day_iter += timedelta(days=1)
+
+        # Combine parts with a distinct separator for the LLM
+        return "\n\n---\n\n".join(day_parts) + "\n"
 
     def __init__(self) -> None:
         self.model: str = settings.DEPLOYMENT_NAME
         self.memory = MemoryStore()
+        self.fast_path = FastPath(self.build_calendar_context)
+        # описания инструментов уходят в каждый запрос — их токены вычитаем из бюджета
+        self.prompt_assembler = PromptAssembler(
+            settings.PROMPT_TOKEN_BUDGET - count_tokens(json.dumps(CALENDAR_TOOLS, ensure_ascii=False))
+        )
+        self.summarizer = ConversationSummarizer(self.memory)
+        self.recall = ChatRecall()
+        self.router = ModelRouter()
+        # Статические префиксы промпта — одни и те же строки для всех запросов
+        self._prefixes = self._render_prefixes()
 
-    def _create_system_prompt(
-        self,
-        personality: str,
-        user_gender: str,
-        language: str,
-        today_line: str,
-        calendar_context: str = "",
-    ) -> str:
+    def _create_system_prompt(self, personality: str, user_gender: str, language: str) -> str:
         """
-        Creates the system prompt for the AI model, defining its persona, language,
-        and providing detailed instructions for calendar interaction.
+        Creates the static part of the system prompt: persona, language and
+        calendar instructions. Everything per-request (date, calendar context,
+        history) goes into later messages, so this text is a stable prefix
+        the provider can cache.
         """
-        personas = {
-            "assistant": (
-                "You are a professional, highly efficient, and concise AI assistant. "
-                "Your tone is formal, objective, and focused on delivering information clearly and directly, "
-                "without unnecessary conversational fillers or emotional expressions. "
-                "Prioritize accuracy and brevity in your responses."
-            ),
-            "coach": (
-                "You are an energetic, inspiring, and motivational coach. "
-                "Your tone is uplifting, dynamic, and action-oriented. "
-                "Encourage and empower the user, using positive affirmations and enthusiastic language. "
-                "Focus on progress, goals, and overcoming challenges. "
-                "Feel free to use exclamation points and encouraging phrases."
-            ),
-            "friend": (
-                "You're the user's best friend. Your tone is casual, informal, and supportive, like a real friend. "
-                "Use everyday language, slang where appropriate, and express genuine care and understanding. "
-                "Feel free to share brief, relatable opinions or observations. "
-                "Focus on empathy, camaraderie, and friendly advice."
-            ),
-            "girlfriend": (
-                "You're a sweet and caring girlfriend. Be emotionally supportive and warm. "
-                "Feel free to add emojis at the start of each bullet to show affection and warmth. "
-                "Your language is gentle, affectionate, and reassuring. "
-                "Show genuine interest in the user's feelings and well-being, offering comfort and understanding."
-            ),
-            "boyfriend": (
-                "You're a protective and caring boyfriend. Make the user feel reassured and loved. "
-                "Feel free to add emojis at the start of each bullet to show care and support. "
-                "Your tone is steady, reliable, and thoughtful. "
-                "Offer practical support and a sense of security, always prioritizing the user's comfort and safety."
-            ),
-        }
-
-        gender = {
-            "male":   "The user is male; adapt your responses accordingly.",
-            "female": "The user is female; adapt your responses accordingly.",
-            "other":  "Keep responses gender-neutral.",
-        }
-
-        calendar_instr = (
-            f"{today_line}" # This is crucial for the LLM to know the current date
-            "Calendar skills:\n"
-            "• Your primary goal regarding the calendar is to provide the user with **relevant calendar information** or **facilitate event creation/deletion**.\n"
-            "• When the user asks about their schedule, plans, or events, **identify the exact date or date range they are interested in.**\n"
-            "  **If no specific date or period is mentioned but the user asks about 'plans', 'schedule', 'tasks', or 'calendar', default to TODAY.**\n"
-            "  **If they ask about 'weekly plans' or 'plans for the week', default to the CURRENT WEEK (today + next 6 days).**\n"
-            "  **Recognize temporal phrases like 'today', 'tomorrow', 'yesterday', 'this week', 'next week', 'Friday', 'August 1st', etc.** and adjust the context you request accordingly.\n"
-            "• The `calendar_context` provided contains the requested events. It is already filtered, categorized (Past, Current, Upcoming), and includes a date header (e.g., '09 июля, 2025').\n"
-            "  **If `calendar_context` contains events for multiple days (e.g., a week), each day's events will be separated by a '---' line.**\n"
-            "  **Do not add any additional date headers, categorization, or formatting for events; just present the provided `calendar_context` content naturally in your reply.**\n"
-            "• Only return <calendar_data> if the user explicitly asks to ADD/BOOK/SCHEDULE an event.\n"
-            "• The schedules you see ARE ALREADY in the user's local time zone. Repeat the times exactly as they appear; DO NOT convert or shift them.\n"
-            "• Always present times in **24-hour format** (e.g., 15:00, not 3 PM) and list each event on a new line, preceded by “- ”.\n"
-            "  If the persona is 'girlfriend' or 'boyfriend', you may prepend a fitting emoji to each bullet.\n"
-            "• Suggest free/available time slots.\n"
-            "• Replies must be concise; avoid filler phrases such as “I'm always here” or similar supportive lines.\n"
-            "• Remember you are an AI, not a living being, and cannot perform real-world actions or meetings.\n"
-            "• Create events **or delete events**:\n"
-            "    1) For creation, return JSON with keys: title, start, end (optional), duration (optional, e.g., \"2 days\", \"3h\").\n"
-            "       Wrap exactly like <calendar_data>{ ... }</calendar_data>\n"
-            "    2) For deletion, return JSON with keys: title, date (YYYY-MM-DD).\n"
-            "       Wrap exactly like <calendar_delete>{ ... }</calendar_delete>\n"
-            "    2b) To delete a *specific* event on that date, add either:\n"
-            "        • \"start\": ISO-datetime of the event’s start (e.g., \"2025-07-09T11:00\") **or**\n"
-            "        • \"event_id\": numeric id of the event (preferred if shown).\n"
-            "    2c) If neither \"start\" nor \"event_id\" is provided and multiple matches exist,\n"
-            "        ask the user to clarify which one to delete before returning <calendar_delete>.\n"
-            "    3) After a blank line, write the friendly reply. **Never** mention the tags or JSON.\n"
-        )
-        
         parts = [
-            personas.get(personality, personas["assistant"]),
-            gender.get(user_gender, gender["other"]),
+            PERSONAS.get(personality, PERSONAS["assistant"]),
+            GENDER_HINTS.get(user_gender, GENDER_HINTS["other"]),
             f"Respond in {language}.",
-            calendar_instr,
+            CALENDAR_INSTRUCTIONS,
         ]
-        if calendar_context:
-            # We want to send the full context to the LLM for better understanding.
-            # If token limits become an issue, we'd need a more advanced summarization strategy.
-            parts.append(calendar_context) 
         return "\n".join(parts)
 
-    def _parse_duration(self, duration_str: str) -> timedelta:
+    def _render_prefixes(self) -> Dict[Tuple[str, str, str], str]:
+        """Pre-renders the system prompt for every (persona, gender, language)."""
+        return {
+            (personality, user_gender, language): sys.intern(
+                self._create_system_prompt(personality, user_gender, language)
+            )
+            for personality in PERSONAS
+            for user_gender in GENDER_HINTS
+            for language in LANGUAGE_NAMES.values()
+        }
+
+    def system_prefix(self, personality: str, user_gender: str, language: str) -> str:
+        if personality not in PERSONAS:
+            personality = "assistant"
+        if user_gender not in GENDER_HINTS:
+            user_gender = "other"
+        prefix = self._prefixes.get((personality, user_gender, language))
+        if prefix is None:
+            prefix = self._create_system_prompt(personality, user_gender, language)
+        return prefix
+
+    def _calendar_context_in_session(
+        self,
+        db: Session,
+        user_id: int,
+        target_date_local: date,
+        end_date_local: Optional[date],
+    ) -> str:
+        """build_calendar_context on a worker-thread session (see run_in_session)."""
+        return self.build_calendar_context(
+            CalendarService(db, db.get(User, user_id)),
+            target_date_local=target_date_local,
+            end_date_local=end_date_local,
+        )
+
+    def _fast_path_in_session(
+        self, db: Session, user_id: int, message: str, lang: str, personality: str,
+    ) -> Optional[Dict[str, Any]]:
+        """fast_path.answer on a worker-thread session (see run_in_session)."""
+        return self.fast_path.answer(
+            message, lang=lang, personality=personality, calendar_service=CalendarService(db, db.get(User, user_id)),
+        )
+
+    async def _build_messages(
+        self,
+        message: str,
+        *,
+        chat_id: int,
+        personality: str,
+        user_gender: str,
+        language: str,
+        calendar_service: Optional[CalendarService],
+        timer: StageTimer,
+    ) -> List[dict]:
         """
-        Parses a duration string (e.g., "2 days", "3h", "1d 5h") into a timedelta object.
+        Builds the full message list (system prompt with calendar context + history)
+        for a single chat turn.
+
+        Calendar context, history, the running summary and recalled older
+        messages do not depend on each other: they are fetched concurrently, the sync queries in the DB
+        thread pool with their own sessions, so the turn waits for the
+        slowest of them rather than their sum.
         """
-        total_duration = timedelta(0)
+        with timer.stage("local"):
+            # Язык определяем локально; `language` (предпочтительный язык
+            # пользователя) — только если само сообщение слишком неоднозначно
+            lang = LANGUAGE_NAMES[detect_language(message, fallback=language)]
 
-        # Days
-        days_match = re.search(
-            r'(\d+)\s*(?:d|день|дня|дней)', duration_str, re.IGNORECASE)
-        if days_match:
-            total_duration += timedelta(days=int(days_match.group(1)))
+            user_tz = calendar_service.tz if calendar_service else timezone.utc
+            now_local = datetime.now(user_tz)
+            today_line = f"Today is {now_local:%Y-%m-%d} in the user's timezone.\n"
+
+            # Диапазон дат, о котором спрашивает пользователь («в пятницу», «15 августа»,
+            # «next week», …), разбираем локально; если его нет — показываем сегодня.
+            date_range = parse_date_range(
+                message, now_local.date(), max_days=settings.CALENDAR_CONTEXT_MAX_DAYS
+            )
+            system = self.system_prefix(personality, user_gender, lang)
+
+        async def load_calendar() -> str:
+            if calendar_service is None:
+                return ""
+            with timer.stage("calendar"):
+                return await run_in_session(
+                    self._calendar_context_in_session,
+                    calendar_service.user.id,
+                    date_range.start if date_range else now_local.date(),
+                    date_range.end if date_range else None,
+                )
 
-        # Hours
-        hours_match = re.search(
-            r'(\d+)\s*(?:h|час|часа|часов)', duration_str, re.IGNORECASE)
-        if hours_match:
-            total_duration += timedelta(hours=int(hours_match.group(1)))
+        async def load_history() -> List[dict]:
+            with timer.stage("history"):
+                return await self.memory.get(chat_id, current_message=message)
+
+        async def load_summary():
+            with timer.stage("summary"):
+                return await self.summarizer.aget(chat_id)
+
+        async def load_recall() -> List[Recalled]:
+            with timer.stage("recall"):
+                try:
+                    return await self.recall.search(chat_id, message)
+                except Exception as e:
+                    # без долгой памяти ответ всё равно можно дать
+                    print("[AIService] Recall failed:", e)
+                    return []
+
+        calendar_context, history, summary, recalled = await asyncio.gather(
+            load_calendar(), load_history(), load_summary(), load_recall()
+        )
 
-        # Minutes (Optional, add if needed)
-        minutes_match = re.search(
-            r'(\d+)\s*(?:m|мин|минут|минуты)', duration_str, re.IGNORECASE)
-        if minutes_match:
-            total_duration += timedelta(minutes=int(minutes_match.group(1)))
+        with timer.stage("prompt"):
+            # то, что уже свёрнуто в пересказ, вместо сообщений идёт одним блоком
+            history = [
+                {"role": m["role"], "content": m["content"]}
+                for m in self.summarizer.apply(summary, history)
+            ]
+            # Персона/инструкции и сообщение пользователя — всегда целиком,
+            # история и календарь подрезаются под PROMPT_TOKEN_BUDGET
+            return self.prompt_assembler.assemble(
+                system=system,
+                summary=summary.content if summary else "",
+                recall="".join(f"- {r.created_at:%Y-%m-%d} {r.role}: {r.content}\n" for r in recalled),
+                today_line=today_line,
+                calendar_context=calendar_context,
+                history=history,
+                user_message=message,
+            ).messages
+
+    async def _remember_turn(self, chat_id: int, message: str, reply: str) -> None:
+        await self.memory.add(chat_id, "user", message)
+        await self.memory.add(chat_id, "assistant", reply)
+        # пересказ — в фоне, ответ его не ждёт
+        self.summarizer.note_turn(chat_id)
+
+    @staticmethod
+    def _error_result(message: str) -> Dict[str, Any]:
+        return {
+            "message": message,
+            "calendar_data": None,
+            "should_create_event": False,
+            "event_id": None,
+            "was_deleted": False,
+        }
 
-        return total_duration
+    async def _try_fast_path(
+        self,
+        message: str,
+        *,
+        chat_id: int,
+        personality: str,
+        language: str,
+        calendar_service: Optional[CalendarService],
+    ) -> Optional[Dict[str, Any]]:
+        """Typical calendar requests answered without the model (see services/fast_path.py)."""
+        if calendar_service is None or not settings.FAST_PATH_ENABLED:
+            return None
+        try:
+            # запросы к календарю и создание события — в пуле потоков БД
+            answer = await run_in_session(
+                self._fast_path_in_session,
+                calendar_service.user.id,
+                message,
+                detect_language(message, fallback=language),
+                personality,
+            )
+        except Exception as e:
+            print("[AIService] Fast path error:", e)
+            return None
+        if answer is None:
+            return None
+        await self._remember_turn(chat_id, message, answer["message"])
+        return answer
+
+    async def _ask_small_model(
+        self,
+        message: str,
+        messages: List[dict],
+        language: str,
+        calendar_service: Optional[CalendarService],
+    ) -> Optional[str]:
+        """
+        Model cascade (see services/model_router.py): a simple turn is first
+        sent to the small deployment. Returns its answer, or None when the
+        turn has to go to the main model — complex turn, cascade disabled,
+        or the small model's answer failed validation.
+        """
+        today = datetime.now(calendar_service.tz).date() if calendar_service else date.today()
+        route = self.router.route(message, today)
+        if route.tier != "small":
+            return None
+        try:
+            text = await ask_gpt(
+                messages=messages,
+                model=route.model,
+                temperature=settings.OPENAI_TEMPERATURE,
+                max_tokens=route.max_tokens,
+            )
+        except OpenAIError as e:
+            print("[AIService] Small model failed, escalating:", e)
+            self.router.escalated("error")
+            return None
+        problem = self.router.validate(text, route, detect_language(message, fallback=language))
+        if problem is not None:
+            self.router.escalated(problem)
+            return None
+        return text
+
+    @staticmethod
+    def _tool_params(calendar_service: Optional[CalendarService], round_no: int) -> Dict[str, Any]:
+        if calendar_service is None:
+            return {}
+        # последний круг — только текст, чтобы ход гарантированно закончился ответом
+        last = round_no == settings.CALENDAR_TOOLS_MAX_ROUNDS - 1
+        return {"tools": CALENDAR_TOOLS, "tool_choice": "none" if last else "auto"}
+
+    async def _ask_with_tools(
+        self,
+        messages: List[dict],
+        lang: str,
+        calendar_service: Optional[CalendarService],
+        timer: StageTimer,
+    ) -> Tuple[str, List[ToolResult], Optional[str]]:
+        """
+        Main-model call with calendar tools. Returns (reply text, tool results,
+        user-facing error). Write tools (create/delete) end the turn: their
+        reply is written alongside the calls, so no second round trip is
+        needed. Only read tools (list/find free slots) send their results back
+        for one more round, at most CALENDAR_TOOLS_MAX_ROUNDS in total.
+        """
+        conversation = list(messages)
+        results: List[ToolResult] = []
+        for round_no in range(settings.CALENDAR_TOOLS_MAX_ROUNDS):
+            with timer.stage(_round_stage("llm", round_no)):
+                turn = await ask_gpt(
+                    messages=conversation,
+                    model=self.model,
+                    temperature=settings.OPENAI_TEMPERATURE,
+                    max_tokens=settings.OPENAI_MAX_TOKENS,
+                    **self._tool_params(calendar_service, round_no),
+                )
+            if not isinstance(turn, AssistantTurn):
+                return turn or "", results, None
+            if not turn.tool_calls:
+                return turn.content, results, None
+            with timer.stage(_round_stage("tools", round_no)):
+                batch = CalendarToolRunner(calendar_service).run(turn.tool_calls)
+            results += batch.results
+            if batch.error:
+                return turn.content, results, batch.error
+            if not batch.needs_reply:
+                return turn.content.strip() or batch.confirmation(lang), results, None
+            conversation += [turn.as_message(), *batch.tool_messages()]
+        return "", results, None
 
     async def analyze_message(
         self,
@@ -217,236 +494,87 @@ class AIService:
         user_gender: str = "other",
         language: str = "English",
         calendar_service: Optional[CalendarService] = None,
+        timer: Optional[StageTimer] = None,
     ) -> Dict[str, Any]:
         """
         Analyzes the user's message, interacts with the AI model, and processes calendar actions.
+        Stage durations go to `timer` (see utils/timing.py).
         """
+        timer = timer or StageTimer()
+        # токены этого хода (и фонового пересказа) засчитываются пользователю
+        caller = bind_caller(calendar_service.user.id if calendar_service else None, personality)
         try:
-            # 1) Determine language
-            detected = await self.detect_language(message)
-            lang = detected if detected in (
-                "English", "Russian") else "English"
-
-            # 3) Get current local time and today's string for system prompt
-            user_tz = ZoneInfo(
-                calendar_service.user.timezone) if calendar_service else timezone.utc
-            now_local = datetime.now(user_tz)
-            today_str = now_local.strftime("%Y-%m-%d")
-            today_line = f"Today is {today_str} in the user's timezone.\n"
-
-            # --- CRITICAL CHANGE: Dynamic context building based on LLM's understanding ---
-            # Instead of parsing keywords here, we rely on the LLM to determine the date/period.
-            # We prepare a base system prompt without calendar_context first.
-            # Then we let the LLM generate a response, which might implicitly tell us
-            # what date/period it *thinks* it needs context for, or if it needs to create/delete.
-
-            # Step 1: Initial LLM call to understand intent and date/period
-            # We send history and a general calendar instruction for it to understand context.
-            # We'll then decide *what* calendar_context to inject for the final LLM call.
-
-            # Preliminary AI call to allow LLM to decide on date/period
-            # This is a simplification. A more robust way uses function calling.
-            # For now, we'll give the LLM the prompt and let it respond.
-            # If the response contains indicators for a specific date/week, we'll use that.
-            # Otherwise, we'll default to today.
-
-            # IMPORTANT: The core idea is to let the LLM decide which day/period the user refers to.
-            # However, your current architecture only allows us to inject the *calendar_context*
-            # *before* the main ask_gpt call.
-            # So, we cannot have the LLM "tell us" what date it wants context for *during* the call.
-            # We must infer it from the user's message *before* the call.
-
-            # Re-implementing dynamic context to match prompt instructions (for pre-injection)
-            target_date_for_context = now_local.date() # Default to today
-            is_weekly_request = False
-            message_lower = message.lower()
-
-            if "неделю" in message_lower or "на этой неделе" in message_lower or "планы на неделю" in message_lower:
-                is_weekly_request = True
-                # target_date_for_context remains now_local.date() as it's the start of the week
-            elif "завтра" in message_lower:
-                target_date_for_context = (now_local + timedelta(days=1)).date()
-            elif "сегодня" in message_lower:
-                target_date_for_context = now_local.date()
-            # If specific day is requested (e.g., "пятницу", "1 августа"),
-            # this would ideally be handled by a more robust date parser or LLM tool-use.
-            # For now, if no specific keyword for tomorrow/week is found, and it's a "plan" query, it defaults to today.
-            elif any(keyword in message_lower for keyword in ["планы", "расписание", "дела", "календарь"]):
-                 target_date_for_context = now_local.date() # Already defaulted to today, explicit for clarity
-
-            # Build calendar context based on the inferred date/period
-            calendar_context = ""
-            if calendar_service:
-                calendar_context = self.build_calendar_context(
-                    calendar_service, 
-                    target_date_local=target_date_for_context, 
-                    is_weekly_request=is_weekly_request
+            with timer.stage("fast_path"):
+                fast = await self._try_fast_path(
+                    message,
+                    chat_id=chat_id,
+                    personality=personality,
+                    language=language,
+                    calendar_service=calendar_service,
                 )
-                
-            history = self.memory.get(chat_id)[:]
-            history.append({"role": "user", "content": message})
-
-            ai_raw = await ask_gpt(
-                messages=[
-                    {"role": "system", "content": self._create_system_prompt(
-                        personality, user_gender, lang, today_line, calendar_context
-                    )},
-                    *history,
-                ],
-                model=self.model,
-                temperature=settings.OPENAI_TEMPERATURE,
-                max_tokens=settings.OPENAI_MAX_TOKENS,
+            if fast is not None:
+                return {
+                    "message": fast["message"],
+                    "calendar_data": None,
+                    "should_create_event": fast["event_id"] is not None,
+                    "event_id": fast["event_id"],
+                    "was_deleted": False,
+                }
+
+            messages = await self._build_messages(
+                message,
+                chat_id=chat_id,
+                personality=personality,
+                user_gender=user_gender,
+                language=language,
+                calendar_service=calendar_service,
+                timer=timer,
             )
+            with timer.stage("llm_small"):
+                reply = await self._ask_small_model(message, messages, language, calendar_service)
+            results: List[ToolResult] = []
+            error: Optional[str] = None
+            if reply is None:
+                reply, results, error = await self._ask_with_tools(
+                    messages, detect_language(message, fallback=language), calendar_service, timer
+                )
+            clean_text = reply.strip()
+            if error:
+                # изменения этого хода откатаны целиком, ответ модели не показываем —
+                # и не запоминаем: в памяти должно быть то, что увидел пользователь
+                clean_text = error
+
+            with timer.stage("memory"):
+                await self._remember_turn(chat_id, message, clean_text)
 
-            # 7) Parse JSON objects
-            r_create = re.compile(
-                r'<calendar_data>(\{.*?\})</calendar_data>', re.S)
-            r_delete = re.compile(
-                r'<calendar_delete>(\{.*?\})</calendar_delete>', re.S)
-            m_c = r_create.search(ai_raw)
-            m_d = r_delete.search(ai_raw)
-
-            try:
-                calendar_data = json.loads(m_c.group(1)) if m_c else None
-            except json.JSONDecodeError:
-                calendar_data = None
-            try:
-                delete_params = json.loads(m_d.group(1)) if m_d else None
-            except json.JSONDecodeError:
-                delete_params = None
-
-            clean_text = r_delete.sub('', r_create.sub('', ai_raw)).strip()
-
-            self.memory.add(chat_id, "assistant", clean_text)
-
-            # --- Logic for handling duration and calculating end time ---
-            if calendar_data:
-                title = calendar_data.get("title")
-                start_time_str = calendar_data.get("start")
-                duration_str = calendar_data.get("duration")
-                end_time_str = calendar_data.get("end")
-
-                if not title or not start_time_str:
-                    return {
-                        "message": "Для создания события требуется название и время начала.",
-                        "calendar_data": None,
-                        "should_create_event": False,
-                        "event_id": None,
-                        "was_deleted": False,
-                    }
-
-                if duration_str and not end_time_str:
-                    try:
-                        start_dt = datetime.fromisoformat(start_time_str)
-                        duration_delta = self._parse_duration(duration_str)
-
-                        if duration_delta == timedelta(0) and duration_str not in ["0", "0h", "0m"]:
-                            return {
-                                "message": f"Не удалось определить продолжительность '{duration_str}'. Пожалуйста, уточните, сколько времени займет событие или укажите время окончания.",
-                                "calendar_data": None,
-                                "should_create_event": False,
-                                "event_id": None,
-                                "was_deleted": False,
-                            }
-
-                        calendar_data["end"] = (
-                            start_dt + duration_delta).isoformat()
-                    except ValueError as ve:
-                        return {
-                            "message": f"Произошла ошибка при обработке времени начала или продолжительности: {ve}. Пожалуйста, проверьте формат.",
-                            "calendar_data": None,
-                            "should_create_event": False,
-                            "event_id": None,
-                            "was_deleted": False,
-                        }
-                    except Exception as e:
-                        print(f"Error calculating end time: {e}")
-                        return {
-                            "message": "Произошла ошибка при расчете времени окончания. Пожалуйста, попробуйте еще раз или укажите точное время окончания.",
-                            "calendar_data": None,
-                            "should_create_event": False,
-                            "event_id": None,
-                            "was_deleted": False,
-                        }
-                elif not end_time_str and not duration_str:
-                    return {
-                        "message": "Пожалуйста, уточните продолжительность события или время окончания.",
-                        "calendar_data": None,
-                        "should_create_event": False,
-                        "event_id": None,
-                        "was_deleted": False,
-                    }
-
-            should_save = calendar_data and all(
-                k in calendar_data for k in ("title", "start", "end"))
-
-            # 9) Apply to DB
-            event_id = None
-            was_deleted = False
-
-            if calendar_service:
-                # — Create
-                if calendar_data and should_save:
-                    try:
-                        ev = calendar_service.create_event(calendar_data)
-                        event_id = str(ev.id)
-                    except ValueError as err:
-                        return {
-                            "message": f"Не могу добавить событие: {err}",
-                            "calendar_data": None,
-                            "should_create_event": False,
-                            "event_id": None,
-                            "was_deleted": False,
-                        }
-                # — Delete
-                if delete_params:
-                    try:
-                        # Prioritize deletion by event_id if provided by LLM
-                        if "event_id" in delete_params:
-                            event_id_to_delete = int(delete_params["event_id"])
-                            was_deleted = calendar_service.delete_event_by_id(event_id_to_delete)
-                        elif "start" in delete_params:
-                            # If 'start' is provided, try more precise deletion
-                            was_deleted = calendar_service.delete_event_by_title_date_start(delete_params)
-                        else:
-                            # Fallback to deletion by title and date (first match)
-                            was_deleted = calendar_service.delete_event_by_title_and_date(delete_params)
-                        
-                        if not was_deleted:
-                            return {
-                                "message": "Не удалось найти событие для удаления. Пожалуйста, уточните название, дату или время начала.",
-                                "calendar_data": None,
-                                "should_create_event": False,
-                                "event_id": None,
-                                "was_deleted": False,
-                            }
-
-                    except ValueError as err:
-                        return {
-                            "message": f"Не могу удалить событие: {err}",
-                            "calendar_data": None,
-                            "should_create_event": False,
-                            "event_id": None,
-                            "was_deleted": False,
-                        }
-                    except Exception as e:
-                        print(f"Error during delete operation: {e}")
-                        return {
-                            "message": "Произошла ошибка при попытке удаления события. Пожалуйста, попробуйте еще раз.",
-                            "calendar_data": None,
-                            "should_create_event": False,
-                            "event_id": None,
-                            "was_deleted": False,
-                        }
+            if error:
+                return self._error_result(error)
 
+            calendar_data = next((r.payload["event"] for r in results if r.event_id), None)
+            event_ids = [r.event_id for r in results if r.event_id]
             return {
                 "message": clean_text,
                 "calendar_data": calendar_data,
-                "should_create_event": bool(calendar_data and should_save),
-                "event_id": event_id,
-                "was_deleted": was_deleted,
+                "should_create_event": bool(event_ids),
+                "event_id": event_ids[-1] if event_ids else None,
+                "was_deleted": any(r.was_deleted for r in results),
+                "actions": [r.as_event() for r in results],
             }
 
+        except QuotaExceededError:
+            return {
+                "message": QUOTA_REPLY,
+                "calendar_data": None,
+                "should_create_event": False,
+            }
+        except LLMUnavailableError as e:
+            # модель перегружена/недоступна — отвечаем сразу, не дожидаясь таймаутов
+            print("[AIService] LLM unavailable:", e.reason)
+            return {
+                "message": DEGRADED_REPLY,
+                "calendar_data": None,
+                "should_create_event": False,
+            }
         except OpenAIError as e:
             print("[AIService] OpenAI API error:", e)
             return {
@@ -461,22 +589,150 @@ class AIService:
                 "calendar_data": None,
                 "should_create_event": False,
             }
+        finally:
+            unbind_caller(caller)
 
-    async def detect_language(self, text: str) -> str:
+    async def stream_message(
+        self,
+        message: str,
+        *,
+        chat_id: int,
+        personality: str = "assistant",
+        user_gender: str = "other",
+        language: str = "English",
+        calendar_service: Optional[CalendarService] = None,
+        timer: Optional[StageTimer] = None,
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
         """
-        Detects the language of the given text using the AI model.
+        Streaming variant of `analyze_message`.
+
+        Yields ("token", {"text"}) for visible text as it arrives, ("calendar", {...})
+        for every tool call once the model's calls have run, and finally
+        ("done", {...}) with the same keys `analyze_message` returns, or ("error", {...}).
         """
+        timer = timer or StageTimer()
+        # Без reset: тело SSE-ответа выполняется в отдельной задаче запроса, привязка живёт ровно до её конца
+        bind_caller(calendar_service.user.id if calendar_service else None, personality)
+        parts: List[str] = []
+        event_id: Optional[str] = None
+        was_deleted = False
+        error: Optional[str] = None
+
         try:
-            lang = await ask_gpt(
-                messages=[
-                    {"role": "system", "content":
-                     "Detect the language of the following text and respond with just the language name in English."},
-                    {"role": "user", "content": text},
-                ],
-                max_tokens=10,
-                temperature=0
+            with timer.stage("fast_path"):
+                fast = await self._try_fast_path(
+                    message,
+                    chat_id=chat_id,
+                    personality=personality,
+                    language=language,
+                    calendar_service=calendar_service,
+                )
+            if fast is not None:
+                yield "token", {"text": fast["message"]}
+                if fast["event_id"] is not None:
+                    yield "calendar", {"action": "create", "event_id": fast["event_id"], "error": None}
+                yield "done", {"message": fast["message"], "event_id": fast["event_id"], "was_deleted": False}
+                return
+
+            messages = await self._build_messages(
+                message,
+                chat_id=chat_id,
+                personality=personality,
+                user_gender=user_gender,
+                language=language,
+                calendar_service=calendar_service,
+                timer=timer,
             )
-            return lang.strip()
+            lang = detect_language(message, fallback=language)
+            # ответ маленькой модели короткий — его проверяем целиком и отдаём одним куском
+            with timer.stage("llm_small"):
+                small_reply = await self._ask_small_model(message, messages, language, calendar_service)
+            conversation = list(messages)
+            for round_no in range(settings.CALENDAR_TOOLS_MAX_ROUNDS):
+                llm_started = time.perf_counter()
+                if small_reply is not None:
+                    stream = _single_chunk(small_reply)
+                else:
+                    # ask_gpt возвращает поток, когда пришёл первый токен
+                    stream = await ask_gpt(
+                        messages=conversation,
+                        model=self.model,
+                        temperature=settings.OPENAI_TEMPERATURE,
+                        max_tokens=settings.OPENAI_MAX_TOKENS,
+                        stream=True,
+                        **self._tool_params(calendar_service, round_no),
+                    )
+                    timer.record(_round_stage("llm_first_token", round_no), llm_started, time.perf_counter())
+                round_parts: List[str] = []
+                calls = []
+                async for delta in stream:
+                    if isinstance(delta, list):
+                        # вызовы инструментов приходят одним списком в конце потока
+                        calls = delta
+                        continue
+                    # как и в analyze_message, ведущие пробелы/переводы строк не показываем
+                    if not parts:
+                        delta = delta.lstrip()
+                        if not delta:
+                            continue
+                    parts.append(delta)
+                    round_parts.append(delta)
+                    yield "token", {"text": delta}
+                timer.record(_round_stage("llm", round_no), llm_started, time.perf_counter())
+                if not calls:
+                    break
+
+                with timer.stage(_round_stage("tools", round_no)):
+                    batch = CalendarToolRunner(calendar_service).run(calls)
+                for result in batch.results:
+                    yield "calendar", result.as_event()
+                event_id = batch.event_id or event_id
+                was_deleted = was_deleted or batch.was_deleted
+                if batch.error:
+                    error = batch.error
+                    break
+                if not batch.needs_reply:
+                    if not parts:
+                        confirmation = batch.confirmation(lang)
+                        if confirmation:
+                            parts.append(confirmation)
+                            yield "token", {"text": confirmation}
+                    break
+                conversation += [
+                    AssistantTurn("".join(round_parts), calls).as_message(),
+                    *batch.tool_messages(),
+                ]
+
+        except QuotaExceededError:
+            yield "error", {"message": QUOTA_REPLY}
+            return
+        except LLMUnavailableError as e:
+            print("[AIService] LLM unavailable:", e.reason)
+            yield "error", {"message": DEGRADED_REPLY}
+            return
+        except OpenAIError as e:
+            print("[AIService] OpenAI API error:", e)
+            yield "error", {"message": "Проблемы с доступом к AI-сервису."}
+            return
+        except Exception as e:
+            print("[AIService] Unexpected error:", e)
+            yield "error", {"message": "Что-то пошло не так, попробуйте ещё раз."}
+            return
+
+        # ошибка календарного действия заменяет ответ, как в analyze_message
+        clean_text = error or "".join(parts).strip()
+        with timer.stage("memory"):
+            await self._remember_turn(chat_id, message, clean_text)
+
+        yield "done", {
+            "message": clean_text,
+            "event_id": event_id,
+            "was_deleted": was_deleted,
+        }
+
+
+# учёт токенов и квоты — для всех вызовов модели в приложении
+use_usage_meter(usage_meter)
 
-        except:
-            return "English"
\ No newline at end of file
+# Один экземпляр на процесс: роуты /api/ai и /api/chat делят одну память
+ai_service = AIService()
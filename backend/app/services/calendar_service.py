@@ -1,6 +1,6 @@
 from __future__ import annotations
 from datetime import datetime, timedelta, time, timezone
-from typing import List, Mapping, Tuple
+from typing import List, Mapping, Optional, Tuple
 from zoneinfo import ZoneInfo
 
 from sqlalchemy.orm import Session
@@ -11,7 +11,12 @@ from dateutil.parser import isoparse
 from app.models import CalendarEvent, User
 from app.utils.time import to_utc, to_local, validate_and_convert_times
 from app.core.errors import ConflictError, PastTimeError
+from app.utils.language import normalize_language_code
 
+KK_MONTHS = (
+    "қаңтар", "ақпан", "наурыз", "сәуір", "мамыр", "маусым",
+    "шілде", "тамыз", "қыркүйек", "қазан", "қараша", "желтоқсан",
+)
 
 
 class CalendarService:
@@ -73,8 +78,10 @@ class CalendarService:
         for ev in events:
             # ИСПРАВЛЕНИЕ: ev.start_time и ev.end_time уже в UTC из БД.
             # to_utc здесь избыточен и может привести к ошибкам, если datetime уже осознанный (tz-aware).
-            s = ev.start_time
+            # колонки без tzinfo (хранится UTC) — приводим к aware, иначе сравнение с utc_start падает
+            s = ev.start_time if ev.start_time.tzinfo else ev.start_time.replace(tzinfo=timezone.utc)
             e = ev.end_time or (ev.start_time + timedelta(hours=1)) # Если end_time None, задаем дефолтную длительность (1 час)
+            e = e if e.tzinfo else e.replace(tzinfo=timezone.utc)
             s = max(s, utc_start) # Убедимся, что занятый интервал не начинается раньше запрошенного окна
             if not merged or s > merged[-1][1]:
                 # Добавляем новый интервал, если он не пересекается с последним объединенным
@@ -138,10 +145,12 @@ class CalendarService:
         hide_past: bool = False,
         target_date: Optional[datetime.date] = None # Добавлен новый аргумент
     ) -> str:
+        lang = normalize_language_code(lang)
         i18n = {
             "ru": {"no": "— нет событий —", "past": "Уже прошло:", "cur": "Идёт сейчас:", "upc": "Ещё впереди:"}, # Добавил "cur"
             "en": {"no": "— no events —", "past": "Already done:", "cur": "Currently ongoing:", "upc": "Coming up:"}, # Добавил "cur"
-        }[lang[:2]]
+            "kk": {"no": "— оқиғалар жоқ —", "past": "Өтіп кетті:", "cur": "Қазір жүріп жатыр:", "upc": "Алда:"},
+        }[lang]
 
         now = datetime.now(self.tz) # Текущее время в локальном часовом поясе пользователя
 
@@ -151,6 +160,8 @@ class CalendarService:
             # Пример: "09 июля, 2025" (с правильными падежами для месяцев)
             date_header = display_date.strftime("%d %B, %Y").replace(
                 "январь", "января").replace("февраль", "февраля").replace("март", "марта").replace("апрель", "апреля").replace("май", "мая").replace("июнь", "июня").replace("июль", "июля").replace("август", "августа").replace("сентябрь", "сентября").replace("октябрь", "октября").replace("ноябрь", "ноября").replace("декабрь", "декабря")
+        elif lang == "kk":
+            date_header = f"{display_date.day:02d} {KK_MONTHS[display_date.month - 1]}, {display_date.year}"
         else: # English
             date_header = display_date.strftime("%B %d, %Y")
 
@@ -220,7 +231,12 @@ class CalendarService:
         return "\n".join(lines)
 
     # ───────────────── СОЗДАНИЕ ─────────────────
-    def create_event(self, data: Mapping[str, str]) -> CalendarEvent:
+    def create_event(self, data: Mapping[str, str], *, commit: bool = True) -> CalendarEvent:
+        """
+        С commit=False событие только flush-ится (id уже есть, следующие проверки
+        конфликтов его видят); транзакцию закрывает вызывающий — так несколько
+        действий одного хода применяются вместе (см. services/calendar_tools.py).
+        """
         title = data.get("title")
         start_raw = data.get("start")
         end_raw = data.get("end") # end_raw теперь может быть None, если LLM передала duration
@@ -270,23 +286,68 @@ class CalendarService:
         )
         try:
             self.db.add(ev)
-            self.db.commit()
-            self.db.refresh(ev)
+            if commit:
+                self.db.commit()
+                self.db.refresh(ev)
+            else:
+                self.db.flush()
             return ev
         except SQLAlchemyError:
             self.db.rollback()
             raise # Перевыбрасываем исключение после отката транзакции
 
     # ───────────────── УДАЛЕНИЕ ─────────────────
-    def delete_event_by_title_and_date(self, params: Mapping[str, str]) -> bool:
+    def _day_bounds_utc(self, date_raw: str) -> Tuple[datetime, datetime]:
+        loc_midnight = datetime.fromisoformat(date_raw[:10]).replace(tzinfo=self.tz)
+        utc_start = loc_midnight.astimezone(timezone.utc)
+        return utc_start, utc_start + timedelta(days=1)
+
+    def _delete(self, ev: Optional[CalendarEvent], commit: bool) -> bool:
+        if ev is None:
+            return False
+        self.db.delete(ev)
+        if commit:
+            self.db.commit()
+        else:
+            self.db.flush()
+        return True
+
+    def delete_event_by_id(self, event_id: int, *, commit: bool = True) -> bool:
+        ev = (
+            self.db.query(CalendarEvent)
+            .filter(CalendarEvent.owner_id == self.user.id, CalendarEvent.id == event_id)
+            .first()
+        )
+        return self._delete(ev, commit)
+
+    def delete_event_by_title_date_start(self, params: Mapping[str, str], *, commit: bool = True) -> bool:
+        """Точное удаление: событие с таким названием, начинающееся ровно в `start` (локальное время)."""
+        title = (params.get("title") or "").strip()
+        start_raw = params.get("start")
+        if not start_raw:
+            raise ValueError("'start' is required")
+
+        start = isoparse(start_raw)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=self.tz)
+        start_utc = start.astimezone(timezone.utc)
+
+        query = self.db.query(CalendarEvent).filter(
+            CalendarEvent.owner_id == self.user.id,
+            CalendarEvent.start_time >= start_utc,
+            CalendarEvent.start_time < start_utc + timedelta(minutes=1),
+        )
+        if title:
+            query = query.filter(CalendarEvent.title.ilike(f"%{title}%"))
+        return self._delete(query.first(), commit)
+
+    def delete_event_by_title_and_date(self, params: Mapping[str, str], *, commit: bool = True) -> bool:
         title = params.get("title", "").strip()
         date_raw = params.get("date")
         if not title or not date_raw:
             raise ValueError("Both 'title' and 'date' are required")
 
-        loc_midnight = datetime.fromisoformat(date_raw).replace(tzinfo=self.tz)
-        utc_start = loc_midnight.astimezone(timezone.utc)
-        utc_end   = utc_start + timedelta(days=1)
+        utc_start, utc_end = self._day_bounds_utc(date_raw)
 
         ev = (
             self.db.query(CalendarEvent)
@@ -298,11 +359,7 @@ class CalendarService:
             )
             .first()
         )
-        if ev:
-            self.db.delete(ev)
-            self.db.commit()
-            return True
-        return False
+        return self._delete(ev, commit)
 
 
     def list_events_between(self, start: datetime, end: datetime):
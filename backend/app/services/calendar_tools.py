@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from dateutil.parser import isoparse
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.core.config import settings
+from app.core.errors import ConflictError, PastTimeError
+from app.core.metrics import metrics
+from app.services.calendar_service import CalendarService
+from app.services.openai_service import ToolCall
+
+metrics.describe("calendar_tool_calls_total", "Calendar tool calls from the model, by tool and outcome")
+metrics.describe("calendar_tool_batches_total", "Calendar tool batches (one model turn), committed or rolled back")
+
+_LOCAL_DATETIME = "Local time in the user's timezone, YYYY-MM-DDTHH:MM"
+_DATE = "Local date, YYYY-MM-DD"
+
+# Схемы для function calling (Chat Completions `tools`)
+CALENDAR_TOOLS: List[dict] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "create_event",
+            "description": "Add an event to the user's calendar. Only when the user explicitly asks to add/book/schedule something.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string", "description": "Short event title"},
+                    "start": {"type": "string", "description": _LOCAL_DATETIME},
+                    "end": {"type": "string", "description": _LOCAL_DATETIME + "; give end or duration_minutes"},
+                    "duration_minutes": {"type": "integer", "minimum": 1},
+                    "description": {"type": "string"},
+                },
+                "required": ["title", "start"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "delete_event",
+            "description": (
+                "Delete one event. Pass event_id when known; otherwise title and date, "
+                "plus start to pick a specific event when several share the title."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "event_id": {"type": "integer"},
+                    "title": {"type": "string"},
+                    "date": {"type": "string", "description": _DATE},
+                    "start": {"type": "string", "description": _LOCAL_DATETIME},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "list_events",
+            "description": "List events (with ids) for dates not covered by calendar_context.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "start_date": {"type": "string", "description": _DATE},
+                    "end_date": {"type": "string", "description": _DATE + ", inclusive"},
+                },
+                "required": ["start_date"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_free_slots",
+            "description": "Find free time windows in the user's calendar.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date_from": {"type": "string", "description": _DATE},
+                    "days": {"type": "integer", "minimum": 1, "maximum": 14},
+                    "min_minutes": {"type": "integer", "minimum": 5},
+                    "workday_start": {"type": "string", "description": "HH:MM"},
+                    "workday_end": {"type": "string", "description": "HH:MM"},
+                },
+                "required": ["date_from"],
+            },
+        },
+    },
+]
+
+# Инструменты, результат которых модель должна увидеть, чтобы ответить
+READ_TOOLS = frozenset(("list_events", "find_free_slots"))
+_ACTIONS = {
+    "create_event": "create",
+    "delete_event": "delete",
+    "list_events": "list",
+    "find_free_slots": "free_slots",
+}
+_MAX_SLOTS = 20
+
+# Подтверждение, если модель вызвала инструменты, но текста не написала
+_CONFIRMATIONS = {
+    "ru": {"create": "Добавлено: «{title}» — {date}, {start}–{end}.", "delete": "Событие удалено."},
+    "en": {"create": "Added “{title}” on {date} at {start}–{end}.", "delete": "The event has been deleted."},
+    "kk": {"create": "«{title}» {date} күні {start}–{end} аралығына қосылды.", "delete": "Оқиға жойылды."},
+}
+
+
+class ToolArgumentError(ValueError):
+    """The model's arguments for a tool are missing or malformed."""
+
+
+@dataclass
+class ToolResult:
+    call: ToolCall
+    action: str
+    # что уходит модели сообщением role="tool"
+    payload: Dict[str, Any] = field(default_factory=dict)
+    event_id: Optional[str] = None
+    was_deleted: bool = False
+    error: Optional[str] = None
+    skipped: bool = False
+
+    def as_event(self) -> Dict[str, Any]:
+        """The `calendar` SSE event / analyze_message action entry."""
+        event: Dict[str, Any] = {"action": self.action, "error": self.error}
+        if self.action == "create":
+            event["event_id"] = self.event_id
+        elif self.action == "delete":
+            event["was_deleted"] = self.was_deleted
+        if self.skipped:
+            event["skipped"] = True
+        return event
+
+
+@dataclass
+class ToolBatch:
+    results: List[ToolResult]
+    # ошибка для пользователя; все изменения этого хода откатаны
+    error: Optional[str] = None
+
+    @property
+    def needs_reply(self) -> bool:
+        """True when the model has to see read results before it can answer."""
+        return self.error is None and any(r.call.name in READ_TOOLS for r in self.results)
+
+    @property
+    def event_id(self) -> Optional[str]:
+        ids = [r.event_id for r in self.results if r.event_id]
+        return ids[-1] if ids else None
+
+    @property
+    def was_deleted(self) -> bool:
+        return any(r.was_deleted for r in self.results)
+
+    def tool_messages(self) -> List[dict]:
+        return [
+            {
+                "role": "tool",
+                "tool_call_id": r.call.id,
+                "content": json.dumps(r.payload, ensure_ascii=False),
+            }
+            for r in self.results
+        ]
+
+    def confirmation(self, lang: str) -> str:
+        texts = _CONFIRMATIONS.get(lang, _CONFIRMATIONS["en"])
+        lines = []
+        for r in self.results:
+            if r.action == "create" and r.event_id:
+                ev = r.payload["event"]
+                lines.append(texts["create"].format(
+                    title=ev["title"], date=ev["start"][:10], start=ev["start"][11:16], end=ev["end"][11:16],
+                ))
+            elif r.action == "delete" and r.was_deleted:
+                lines.append(texts["delete"])
+        return "\n".join(lines)
+
+
+class CalendarToolRunner:
+    """
+    Выполняет вызовы инструментов одного ответа модели.
+
+    All calls of one turn share a single transaction: writes are only
+    flushed, reads see them, and the batch is committed once at the end.
+    The first failing call rolls everything back and the remaining calls
+    are skipped, so a turn never leaves half of its actions applied.
+    """
+
+    def __init__(self, calendar_service: CalendarService) -> None:
+        self.calendar = calendar_service
+        self.db = calendar_service.db
+
+    def run(self, calls: List[ToolCall]) -> ToolBatch:
+        results: List[ToolResult] = []
+        error: Optional[str] = None
+        wrote = False
+        for call in calls:
+            result = ToolResult(call, _ACTIONS.get(call.name, call.name))
+            results.append(result)
+            if error is not None:
+                result.skipped = True
+                result.payload = {"error": "skipped: an earlier action in this turn failed"}
+                metrics.inc("calendar_tool_calls_total", tool=call.name, outcome="skipped")
+                continue
+            try:
+                self._dispatch(call, result)
+                wrote = wrote or call.name not in READ_TOOLS
+                metrics.inc("calendar_tool_calls_total", tool=call.name, outcome="ok")
+            except Exception as e:
+                error = result.error = self._user_error(result.action, e)
+                result.payload = {"error": str(e) or type(e).__name__}
+                metrics.inc("calendar_tool_calls_total", tool=call.name, outcome="error")
+                if not isinstance(e, (ConflictError, PastTimeError, LookupError, ValueError)):
+                    print("[CalendarTools] Unexpected error:", e)
+
+        if error is not None:
+            self.db.rollback()
+            for r in results:
+                r.event_id, r.was_deleted = None, False
+            metrics.inc("calendar_tool_batches_total", outcome="rolled_back")
+        elif wrote:
+            try:
+                self.db.commit()
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                print("[CalendarTools] Commit failed:", e)
+                for r in results:
+                    r.event_id, r.was_deleted = None, False
+                metrics.inc("calendar_tool_batches_total", outcome="rolled_back")
+                return ToolBatch(results, "Не удалось сохранить изменения в календаре, попробуйте ещё раз.")
+            metrics.inc("calendar_tool_batches_total", outcome="committed")
+        return ToolBatch(results, error)
+
+    # ───────────────── инструменты ─────────────────
+    def _dispatch(self, call: ToolCall, result: ToolResult) -> None:
+        args = _parse_arguments(call)
+        if call.name == "create_event":
+            self._create(args, result)
+        elif call.name == "delete_event":
+            self._delete(args, result)
+        elif call.name == "list_events":
+            self._list(args, result)
+        elif call.name == "find_free_slots":
+            self._free_slots(args, result)
+        else:
+            raise ToolArgumentError(f"unknown tool {call.name}")
+
+    def _create(self, args: Dict[str, Any], result: ToolResult) -> None:
+        title = _required_str(args, "title")
+        start = _parse_local(_required_str(args, "start"), "start", self.calendar.tz)
+        if args.get("end"):
+            end = _parse_local(str(args["end"]), "end", self.calendar.tz)
+        elif args.get("duration_minutes"):
+            end = start + timedelta(minutes=_int(args, "duration_minutes"))
+        else:
+            raise ToolArgumentError("end or duration_minutes is required")
+        if end <= start:
+            raise ToolArgumentError("end must be after start")
+
+        ev = self.calendar.create_event(
+            {
+                "title": title,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "description": args.get("description"),
+            },
+            commit=False,
+        )
+        result.event_id = str(ev.id)
+        result.payload = {"ok": True, "event": self._event_dict(ev)}
+
+    def _delete(self, args: Dict[str, Any], result: ToolResult) -> None:
+        if args.get("event_id") is not None:
+            deleted = self.calendar.delete_event_by_id(_int(args, "event_id"), commit=False)
+        elif args.get("start"):
+            deleted = self.calendar.delete_event_by_title_date_start(args, commit=False)
+        else:
+            _required_str(args, "title")
+            _required_str(args, "date")
+            deleted = self.calendar.delete_event_by_title_and_date(args, commit=False)
+        if not deleted:
+            raise LookupError("event not found")
+        result.was_deleted = True
+        result.payload = {"ok": True, "deleted": True}
+
+    def _list(self, args: Dict[str, Any], result: ToolResult) -> None:
+        first = _parse_date(_required_str(args, "start_date"), "start_date")
+        last = _parse_date(str(args.get("end_date") or first.isoformat()), "end_date")
+        last = min(max(last, first), first + timedelta(days=settings.CALENDAR_CONTEXT_MAX_DAYS - 1))
+        tz = self.calendar.tz
+        events = self.calendar.list_events_between(
+            datetime.combine(first, time.min, tzinfo=tz).astimezone(timezone.utc),
+            datetime.combine(last + timedelta(days=1), time.min, tzinfo=tz).astimezone(timezone.utc),
+        )
+        result.payload = {
+            "start_date": first.isoformat(),
+            "end_date": last.isoformat(),
+            "events": [self._event_dict(ev) for ev in events],
+        }
+
+    def _free_slots(self, args: Dict[str, Any], result: ToolResult) -> None:
+        first = _parse_date(_required_str(args, "date_from"), "date_from")
+        days = min(max(_int(args, "days", 1), 1), settings.CALENDAR_CONTEXT_MAX_DAYS)
+        slots = self.calendar.find_free_slots(
+            datetime.combine(first, time.min, tzinfo=self.calendar.tz),
+            days=days,
+            min_minutes=_int(args, "min_minutes", 30),
+            workday_start=_parse_time(args.get("workday_start"), time(0, 0)),
+            workday_end=_parse_time(args.get("workday_end"), time(23, 59)),
+        )
+        result.payload = {
+            "slots": [
+                {
+                    "start": f"{s['start']:%Y-%m-%dT%H:%M}",
+                    "end": f"{s['end']:%Y-%m-%dT%H:%M}",
+                    "duration_minutes": s["duration_minutes"],
+                }
+                for s in slots[:_MAX_SLOTS]
+            ],
+            "truncated": len(slots) > _MAX_SLOTS,
+        }
+
+    def _event_dict(self, ev) -> Dict[str, Any]:
+        start = self._local(ev.start_time)
+        end = self._local(ev.end_time or ev.start_time + timedelta(hours=1))
+        return {"id": ev.id, "title": ev.title, "start": f"{start:%Y-%m-%dT%H:%M}", "end": f"{end:%Y-%m-%dT%H:%M}"}
+
+    def _local(self, dt: datetime) -> datetime:
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(self.calendar.tz)
+
+    @staticmethod
+    def _user_error(action: str, err: Exception) -> str:
+        if isinstance(err, ConflictError):
+            return f"Не получится: в это время уже стоит «{err.event.title}»."
+        if isinstance(err, PastTimeError):
+            return "Это время уже прошло — выберите время в будущем."
+        if isinstance(err, LookupError):
+            return "Не удалось найти событие для удаления. Пожалуйста, уточните название, дату или время начала."
+        if isinstance(err, ValueError):
+            verb = "добавить" if action == "create" else "удалить" if action == "delete" else "прочитать календарь"
+            return f"Не могу {verb}: {err}"
+        return "Что-то пошло не так, попробуйте ещё раз."
+
+
+# ───────────────── разбор аргументов ─────────────────
+def _parse_arguments(call: ToolCall) -> Dict[str, Any]:
+    try:
+        args = json.loads(call.arguments or "{}")
+    except json.JSONDecodeError:
+        raise ToolArgumentError("arguments are not valid JSON")
+    if not isinstance(args, dict):
+        raise ToolArgumentError("arguments must be an object")
+    return args
+
+
+def _required_str(args: Dict[str, Any], key: str) -> str:
+    value = args.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise ToolArgumentError(f"'{key}' is required")
+    return value.strip()
+
+
+def _int(args: Dict[str, Any], key: str, default: Optional[int] = None) -> int:
+    value = args.get(key, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ToolArgumentError(f"'{key}' must be an integer")
+
+
+def _parse_local(value: str, key: str, tz) -> datetime:
+    try:
+        dt = isoparse(value)
+    except ValueError:
+        raise ToolArgumentError(f"'{key}' must be YYYY-MM-DDTHH:MM")
+    # дальше всё в локальном времени пользователя, без tzinfo
+    return dt.astimezone(tz).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _parse_date(value: str, key: str) -> date:
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        raise ToolArgumentError(f"'{key}' must be YYYY-MM-DD")
+
+
+def _parse_time(value: Optional[str], default: time) -> time:
+    if not value:
+        return default
+    try:
+        return time.fromisoformat(value)
+    except ValueError:
+        raise ToolArgumentError("times must be HH:MM")
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import ChatArchive, ChatMessage
+
+try:
+    import zstandard
+except ImportError:
+    # без пакета архив пишется zlib; уже записанные zstd-блоки без него не прочитать
+    zstandard = None
+
+_ZSTD_LEVEL = 10
+_ZLIB_LEVEL = 9
+
+# (id, role, content, created_at, updated_at) — строка блока
+Row = Tuple[int, str, str, Optional[datetime], Optional[datetime]]
+
+
+def _month(at: Optional[datetime]) -> date:
+    at = at or datetime.utcnow()
+    return date(at.year, at.month, 1)
+
+
+def _iso(at: Optional[datetime]) -> Optional[str]:
+    return at.isoformat() if at is not None else None
+
+
+def _dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def pack(rows: Sequence[Row]) -> Tuple[str, bytes]:
+    """Rows of a batch → (codec, compressed JSON)."""
+    raw = json.dumps(
+        [[i, role, content, _iso(created), _iso(updated)] for i, role, content, created, updated in rows],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, _ZLIB_LEVEL)
+
+
+def unpack(codec: str, data: bytes) -> List[Row]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed, cannot read a zstd chat archive")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        raw = zlib.decompress(data)
+    else:
+        raise ValueError(f"unknown chat archive codec {codec!r}")
+    return [(i, role, content, _dt(created), _dt(updated)) for i, role, content, created, updated in json.loads(raw)]
+
+
+def _message(chat_id: int, row: Row) -> ChatMessage:
+    """A transient (never added to a session) ChatMessage for an archived row."""
+    message_id, role, content, created_at, updated_at = row
+    return ChatMessage(
+        id=message_id, chat_id=chat_id, role=role, content=content,
+        created_at=created_at, updated_at=updated_at,
+    )
+
+
+class ChatArchiveStore:
+    """
+    Чтение и запись холодных блоков chat_message_archives.
+
+    A batch holds one month of a chat's messages as compressed JSON (zstd
+    when the `zstandard` package is installed, zlib otherwise). Readers go
+    through a small LRU of unpacked batches, so paging through an old month
+    unpacks it once.
+    """
+
+    def __init__(self, cache_batches: int = settings.CHAT_ARCHIVE_CACHE_BATCHES) -> None:
+        self.cache_batches = cache_batches
+        # (id блока, last_message_id, message_count) → строки; дозапись меняет ключ
+        self._cache: "OrderedDict[Tuple[int, int, int], List[Row]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ───────────────── запись ─────────────────
+    def append(self, db: Session, chat_id: int, rows: Iterable[Row]) -> int:
+        """
+        Adds rows (in id order) to the chat's monthly batches, merging with
+        a batch already archived for the same month. Does not commit.
+        """
+        stored = 0
+        for month, group in groupby(rows, key=lambda row: _month(row[3])):
+            group = list(group)
+            batch = (
+                db.query(ChatArchive)
+                .filter(ChatArchive.chat_id == chat_id, ChatArchive.month == month)
+                .one_or_none()
+            )
+            if batch is not None:
+                known = {row[0] for row in group}
+                merged = [row for row in unpack(batch.codec, batch.data) if row[0] not in known]
+                group = sorted(merged + group, key=lambda row: row[0])
+            else:
+                batch = ChatArchive(chat_id=chat_id, month=month)
+                db.add(batch)
+            batch.codec, batch.data = pack(group)
+            batch.first_message_id = group[0][0]
+            batch.last_message_id = group[-1][0]
+            batch.message_count = len(group)
+            stored += len(group)
+        return stored
+
+    # ───────────────── чтение ─────────────────
+    def _rows(self, db: Session, batch_id: int, last_message_id: int, message_count: int) -> List[Row]:
+        key = (batch_id, last_message_id, message_count)
+        with self._lock:
+            rows = self._cache.get(key)
+            if rows is not None:
+                self._cache.move_to_end(key)
+                return rows
+        codec, data = db.query(ChatArchive.codec, ChatArchive.data).filter(ChatArchive.id == batch_id).one()
+        rows = unpack(codec, data)
+        with self._lock:
+            self._cache[key] = rows
+            while len(self._cache) > self.cache_batches:
+                self._cache.popitem(last=False)
+        return rows
+
+    def read_before(self, db: Session, chat_id: int, before_id: Optional[int], limit: int) -> List[ChatMessage]:
+        """Archived messages older than `before_id`, newest first, at most `limit`."""
+        q = db.query(ChatArchive.id, ChatArchive.last_message_id, ChatArchive.message_count).filter(
+            ChatArchive.chat_id == chat_id
+        )
+        if before_id is not None:
+            q = q.filter(ChatArchive.first_message_id < before_id)
+        # блоков у чата — по одному на месяц, их заголовки читаем разом
+        batches = q.order_by(ChatArchive.last_message_id.desc()).all()
+
+        found: List[Row] = []
+        for batch_id, last_message_id, message_count in batches:
+            if len(found) >= limit and last_message_id < found[limit - 1][0]:
+                break
+            found += [
+                row for row in self._rows(db, batch_id, last_message_id, message_count)
+                if before_id is None or row[0] < before_id
+            ]
+            found.sort(key=lambda row: row[0], reverse=True)
+        return [_message(chat_id, row) for row in found[:limit]]
+
+    def last_archived_id(self, db: Session, chat_id: int) -> Optional[int]:
+        """Id of the chat's newest archived message, or None if nothing is archived."""
+        return db.query(func.max(ChatArchive.last_message_id)).filter(ChatArchive.chat_id == chat_id).scalar()
+
+    def all_rows(self, db: Session, chat_id: int) -> List[Row]:
+        """Every archived row of the chat, in id order (bypasses the cache)."""
+        batches = (
+            db.query(ChatArchive.codec, ChatArchive.data)
+            .filter(ChatArchive.chat_id == chat_id)
+            .order_by(ChatArchive.first_message_id)
+            .all()
+        )
+        rows = [row for codec, data in batches for row in unpack(codec, data)]
+        # блоки месяцев по id почти не пересекаются, но порядок гарантируем
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def read_ids(self, db: Session, chat_id: int, ids: Sequence[int]) -> Dict[int, ChatMessage]:
+        """Archived messages by id (those not archived are simply absent)."""
+        if not ids:
+            return {}
+        wanted = set(ids)
+        batches = (
+            db.query(
+                ChatArchive.id, ChatArchive.first_message_id, ChatArchive.last_message_id, ChatArchive.message_count,
+            )
+            .filter(
+                ChatArchive.chat_id == chat_id,
+                ChatArchive.first_message_id <= max(wanted),
+                ChatArchive.last_message_id >= min(wanted),
+            )
+            .all()
+        )
+        found: Dict[int, ChatMessage] = {}
+        for batch_id, first_message_id, last_message_id, message_count in batches:
+            if not any(first_message_id <= i <= last_message_id for i in wanted):
+                continue
+            for row in self._rows(db, batch_id, last_message_id, message_count):
+                if row[0] in wanted:
+                    found[row[0]] = _message(chat_id, row)
+        return found
+
+
+chat_archive = ChatArchiveStore()
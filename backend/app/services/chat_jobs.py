@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.job_queue import Job, JobQueue, create_job_queue
+from app.models import User
+from app.schemas.ai import AIMessageResponse
+from app.services.ai_service import ai_service
+from app.services.calendar_service import CalendarService
+from app.services.chat_service import ChatService, persist_turn
+from app.utils.timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Задача отменяется чуть раньше, чем очередь признает аренду просроченной:
+# следующий ход пользователя стартует только после finish этого обработчика
+_LEASE_MARGIN_SECONDS = 1.0
+
+
+class ChatJobWorkers:
+    """
+    Пул обработчиков асинхронных ходов чата.
+
+    CHAT_JOBS_WORKERS tasks take turns from the job queue and run them
+    through `ai_service.stream_message`, publishing its events as they come
+    so clients can stream them by job id. A user's next turn starts only
+    after the previous one is finished and persisted (the queue keeps one
+    lane per user), so it always sees the previous reply in its history.
+
+    A job is cancelled shortly before its lease (CHAT_JOBS_LEASE_SECONDS)
+    runs out, so the queue never starts the user's next turn while this one
+    is still running; a write already in flight is completed first.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        size: int = settings.CHAT_JOBS_WORKERS,
+        lease_seconds: float = settings.CHAT_JOBS_LEASE_SECONDS,
+    ) -> None:
+        self.queue = queue
+        self.size = size
+        self.lease_seconds = lease_seconds
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.size)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.queue.close()
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                # короткий таймаут: очередь заодно проверяет просроченные задачи
+                job = await self.queue.take(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ChatJobWorkers] Queue unavailable: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if job is None:
+                continue
+            # отдельная задача — свой контекст (привязка пользователя для учёта токенов)
+            await asyncio.create_task(self._run(job))
+
+    async def _run(self, job: Job) -> None:
+        result: Optional[dict] = None
+        error: Optional[str] = None
+        # аренда считается от started_at, выставленного очередью
+        remaining = job.started_at + self.lease_seconds - time.time() - _LEASE_MARGIN_SECONDS
+        try:
+            result, error = await asyncio.wait_for(self._process(job), max(remaining, 0))
+        except asyncio.TimeoutError:
+            print(f"[ChatJobWorkers] Job {job.id} ran out of its lease, cancelled")
+            error = "Job was interrupted"
+        except asyncio.CancelledError:
+            error = "Job was interrupted"
+            raise
+        except Exception as e:
+            print(f"[ChatJobWorkers] Job {job.id} failed: {e}")
+            error = "Что-то пошло не так, попробуйте ещё раз."
+        finally:
+            try:
+                await self.queue.finish(job.id, result=result, error=error)
+            except Exception as e:
+                print(f"[ChatJobWorkers] Failed to finish job {job.id}: {e}")
+
+    async def _process(self, job: Job):
+        message = job.payload["message"]
+        db = SessionLocal()
+        try:
+            timer = StageTimer()
+            user = db.get(User, job.user_id)
+            if user is None:
+                return None, "User not found"
+            with timer.stage("chat"):
+                chat_id = ChatService(db, user).get_chat_id()
+
+            async for event, data in ai_service.stream_message(
+                message,
+                chat_id=chat_id,
+                personality=user.chat_personality,
+                user_gender=user.gender,
+                language=user.preferred_language,
+                calendar_service=CalendarService(db, user),
+                timer=timer,
+            ):
+                if event == "error":
+                    # как и в POST /message: ответ-ошибка тоже остаётся в истории
+                    await _persist(user.id, chat_id, message, data["message"])
+                    await self.queue.publish(job.id, event, data)
+                    return None, data["message"]
+                if event != "done":
+                    await self.queue.publish(job.id, event, data)
+                    continue
+
+                result = AIMessageResponse(
+                    message=data["message"],
+                    chat_id=chat_id,
+                    calendar_event_id=int(data["event_id"]) if data.get("event_id") else None,
+                ).model_dump()
+                await self.queue.publish(job.id, "done", result)
+                # следующий ход пользователя стартует только после записи этого
+                await _persist(user.id, chat_id, message, data["message"])
+                logger.debug("Critical path of chat job %s: %s", job.id, timer.critical_path())
+                return result, None
+            return None, "No reply"
+        finally:
+            db.close()
+
+
+async def _persist(user_id: int, chat_id: int, message: str, reply: str) -> None:
+    # поток записи не отменить: при отмене задачи дожидаемся его, иначе ход
+    # записался бы уже после старта следующего хода пользователя
+    write = asyncio.ensure_future(asyncio.to_thread(persist_turn, user_id, chat_id, message, reply))
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        await write
+        raise
+
+
+chat_jobs = create_job_queue()
+chat_job_workers = ChatJobWorkers(chat_jobs)
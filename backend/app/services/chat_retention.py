@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.metrics import metrics
+from app.models import Chat, ChatMessage, User
+from app.services.ai_service import ai_service
+from app.services.chat_archive import ChatArchiveStore, chat_archive
+from app.services.summary_service import ConversationSummarizer
+from app.services.usage_service import bind_caller, set_purpose, unbind_caller
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("chat_retention_archived_total", "Chat messages moved from chat_messages to cold storage")
+metrics.describe("chat_retention_chats_total", "Chats visited by the retention pass, by outcome")
+
+_PAGE = 500
+
+
+class ChatRetention:
+    """
+    Политика хранения переписки: старое — в пересказ и в холодный архив.
+
+    A pass walks all chats. For each one whose owner's policy
+    (users.chat_retention_days, CHAT_RETENTION_DAYS when NULL, 0 = keep
+    everything) leaves messages older than the cut-off, it:
+
+    1. makes sure the running summary (chat_summaries) covers them, folding
+       them in oldest first, MEMORY_SUMMARY_MAX_INPUT per model call and at
+       most CHAT_RETENTION_SUMMARY_ROUNDS calls per pass, when it lags behind;
+    2. moves those the summary covers into monthly compressed batches in
+       chat_message_archives and deletes them from chat_messages, at most
+       CHAT_RETENTION_BATCH per transaction.
+
+    The newest CHAT_RETENTION_KEEP_MESSAGES of a chat always stay hot.
+    History endpoints read the archive on demand (ChatService.get_chat_messages).
+    The chat row is locked with SKIP LOCKED, so passes started by several
+    workers do not move the same messages twice.
+    """
+
+    def __init__(
+        self,
+        summarizer: ConversationSummarizer,
+        archive: ChatArchiveStore = chat_archive,
+        default_days: int = settings.CHAT_RETENTION_DAYS,
+        keep_messages: int = settings.CHAT_RETENTION_KEEP_MESSAGES,
+        batch_size: int = settings.CHAT_RETENTION_BATCH,
+        interval: int = settings.CHAT_RETENTION_INTERVAL_SECONDS,
+        summary_rounds: int = settings.CHAT_RETENTION_SUMMARY_ROUNDS,
+    ) -> None:
+        self.summarizer = summarizer
+        self.archive = archive
+        self.default_days = default_days
+        self.keep_messages = keep_messages
+        self.batch_size = batch_size
+        self.interval = interval
+        self.summary_rounds = summary_rounds
+        self._task: Optional[asyncio.Task] = None
+
+    # ───────────────── фоновый проход ─────────────────
+    def start(self) -> None:
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                stats = await self.run_once()
+                logger.info("Chat retention pass: %s", stats)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Chat retention pass failed: %s", e)
+
+    async def run_once(self) -> Dict[str, int]:
+        """One pass over all chats. Returns counts of chats and archived messages."""
+        stats = {"chats": 0, "compacted": 0, "archived": 0}
+        after = 0
+        while True:
+            page = await run_in_session(self._chats_page, after)
+            if not page:
+                return stats
+            after = page[-1][0]
+            for chat_id, owner_id, days in page:
+                stats["chats"] += 1
+                try:
+                    moved = await self.compact(chat_id, days, owner_id)
+                except Exception as e:
+                    metrics.inc("chat_retention_chats_total", outcome="error")
+                    logger.warning("Retention of chat %s failed: %s", chat_id, e)
+                    continue
+                if moved:
+                    stats["compacted"] += 1
+                    stats["archived"] += moved
+
+    def _chats_page(self, db: Session, after: int) -> List[Tuple[int, int, int]]:
+        rows = (
+            db.query(Chat.id, Chat.owner_id, User.chat_retention_days)
+            .join(User, User.id == Chat.owner_id)
+            .filter(Chat.id > after)
+            .order_by(Chat.id)
+            .limit(_PAGE)
+            .all()
+        )
+        return [
+            (chat_id, owner_id, self.default_days if days is None else days)
+            for chat_id, owner_id, days in rows
+        ]
+
+    # ───────────────── один чат ─────────────────
+    async def compact(self, chat_id: int, days: int, owner_id: Optional[int] = None) -> int:
+        """Archives the chat's messages older than `days`; returns how many were moved."""
+        if days <= 0:
+            metrics.inc("chat_retention_chats_total", outcome="kept")
+            return 0
+        boundary = await run_in_session(self._boundary, chat_id, days)
+        if boundary is None:
+            metrics.inc("chat_retention_chats_total", outcome="nothing_due")
+            return 0
+
+        if self.summarizer.enabled:
+            # в архив уходит только то, что уже есть в пересказе
+            summary = await run_in_session(self.summarizer.get, chat_id)
+            if summary is None or summary.last_message_id < boundary:
+                # токены пересказа засчитываются владельцу чата
+                caller = bind_caller(owner_id)
+                set_purpose("summary")
+                try:
+                    # по max_input сообщений за вызов, от старых к новым: в архив
+                    # не уходит ничего, чего нет в тексте пересказа
+                    for _ in range(self.summary_rounds):
+                        if await self.summarizer.summarize(chat_id, through=boundary) != "updated":
+                            break
+                        summary = await run_in_session(self.summarizer.get, chat_id)
+                        if summary.last_message_id >= boundary:
+                            break
+                finally:
+                    unbind_caller(caller)
+                summary = await run_in_session(self.summarizer.get, chat_id)
+            if summary is None:
+                metrics.inc("chat_retention_chats_total", outcome="no_summary")
+                return 0
+            boundary = min(boundary, summary.last_message_id)
+
+        moved = 0
+        while True:
+            count = await run_in_session(self._move, chat_id, boundary)
+            moved += count
+            if count < self.batch_size:
+                break
+        metrics.inc("chat_retention_chats_total", outcome="archived" if moved else "nothing_due")
+        return moved
+
+    def _boundary(self, db: Session, chat_id: int, days: int) -> Optional[int]:
+        """Id of the newest message due for the archive, or None."""
+        keep_from = (
+            db.query(ChatMessage.id)
+            .filter(ChatMessage.chat_id == chat_id)
+            .order_by(ChatMessage.id.desc())
+            .offset(max(self.keep_messages - 1, 0))
+            .limit(1)
+            .scalar()
+        )
+        if keep_from is None:
+            return None
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        return (
+            db.query(func.max(ChatMessage.id))
+            .filter(
+                ChatMessage.chat_id == chat_id,
+                ChatMessage.id < keep_from,
+                ChatMessage.created_at < cutoff,
+            )
+            .scalar()
+        )
+
+    def _move(self, db: Session, chat_id: int, boundary: int) -> int:
+        """Moves up to batch_size messages with id <= boundary into the archive, in one transaction."""
+        locked = (
+            db.query(Chat.id)
+            .filter(Chat.id == chat_id)
+            .with_for_update(skip_locked=True)
+            .scalar()
+        )
+        if locked is None:
+            # чат сейчас переносит другой воркер
+            return 0
+        rows = (
+            db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at, ChatMessage.updated_at)
+            .filter(ChatMessage.chat_id == chat_id, ChatMessage.id <= boundary)
+            .order_by(ChatMessage.id)
+            .limit(self.batch_size)
+            .all()
+        )
+        if not rows:
+            db.rollback()
+            return 0
+        try:
+            self.archive.append(db, chat_id, [tuple(row) for row in rows])
+            (
+                db.query(ChatMessage)
+                .filter(ChatMessage.chat_id == chat_id, ChatMessage.id <= rows[-1].id)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        metrics.inc("chat_retention_archived_total", len(rows))
+        return len(rows)
+
+
+# пересказы — тем же экземпляром, что и в ходах чата (общий кэш)
+chat_retention = ChatRetention(ai_service.summarizer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old chat messages into the compressed archive")
+    parser.add_argument("--chat-id", type=int, help="only this chat")
+    parser.add_argument("--days", type=int, help="with --chat-id: retention in days instead of the owner's policy")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def main() -> None:
+        if args.chat_id is None:
+            print(await chat_retention.run_once())
+            return
+        days = args.days if args.days is not None else chat_retention.default_days
+        print({"archived": await chat_retention.compact(args.chat_id, days)})
+
+    asyncio.run(main())
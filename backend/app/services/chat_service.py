@@ -1,14 +1,87 @@
 # app/services/chat_service.py
 from __future__ import annotations
 
+import base64
+import binascii
+import html
+import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from fastapi import HTTPException, status
+from sqlalchemy import Float, case, cast, func, insert, literal, literal_column, select, tuple_, union_all, update
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
+from app.core.config import settings
+from app.core.database import SessionLocal
 from app.models import Chat, ChatMessage, User
+from app.models.chat.models import SEARCH_CONFIGS, search_vector
+from app.services.chat_archive import chat_archive
+from app.services.chat_write_buffer import Turn, chat_write_buffer
+from app.utils.timing import StageTimer
+
+
+# Маркеры подсветки в ts_headline: управляющие символы не встречаются в тексте,
+# поэтому сниппет можно безопасно экранировать и только потом вставить <mark>
+_MARK_START, _MARK_END = "\x02", "\x03"
+_HEADLINE_OPTIONS = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=30, MinWords=10, MaxFragments=2"
+_SNIPPET_CHARS = 160
+_LIKE_SPECIAL = re.compile(r"[%_\\]")
+
+
+def _render_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+def _encode_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}:{message_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(rank), int(message_id)
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+class ChatIdCache:
+    """
+    user_id → id его чата.
+
+    A user has exactly one chat (chats.owner_id is unique) and it never
+    moves to another owner, so an entry never goes stale; the cache is only
+    bounded (LRU). A hit replaces the per-request ownership lookup.
+    """
+
+    def __init__(self, max_size: int = settings.CHAT_ID_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self._ids: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            chat_id = self._ids.get(user_id)
+            if chat_id is not None:
+                self._ids.move_to_end(user_id)
+            return chat_id
+
+    def put(self, user_id: int, chat_id: int) -> None:
+        with self._lock:
+            self._ids[user_id] = chat_id
+            self._ids.move_to_end(user_id)
+            if len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._ids.pop(user_id, None)
+
+
+chat_ids = ChatIdCache()
 
 
 class ChatService:
@@ -52,12 +125,22 @@ class ChatService:
             raise
 
         self.db.refresh(chat)
+        chat_ids.put(self.user.id, chat.id)
         return chat
 
     def get_or_create_chat(self, title: str = "Personal chat") -> Chat:
         chat = self._base_chat_q().first()
+        if chat is not None:
+            chat_ids.put(self.user.id, chat.id)
         return chat or self.create_chat(title)
 
+    def get_chat_id(self) -> int:
+        """Id of the user's chat (created on first use); no query once cached."""
+        chat_id = chat_ids.get(self.user.id)
+        if chat_id is None:
+            chat_id = self.get_or_create_chat().id
+        return chat_id
+
     def add_message(self, chat_id: int, role: str, content: str) -> ChatMessage:
         chat = (
             self._base_chat_q()
@@ -86,28 +169,241 @@ class ChatService:
         self.db.refresh(message)
         return message
 
+    def add_turn(self, chat_id: int, user_text: str, reply: str) -> List[int]:
+        """Saves a whole turn (both messages + chat.updated_at) in one transaction."""
+        return save_turn(self.db, self.user.id, chat_id, user_text, reply)
+
     def get_chat_messages(
         self,
         chat_id: int,
         limit: int = 50,
         before_id: Optional[int] = None,
-    ):
-        q = (
-            self.db.query(ChatMessage)
-            .join(Chat, Chat.id == ChatMessage.chat_id)
-            .filter(
-                Chat.owner_id == self.user.id,
-                ChatMessage.chat_id == chat_id,
-            )
-        )
+    ) -> List[ChatMessage]:
+        """
+        Newest messages first, `limit` per page, older than `before_id`.
+
+        Ownership is checked against the cached chat id, so the query is a
+        plain range scan of ix_chat_messages_chat_id_id (chat_id = ?,
+        id < ? ORDER BY id DESC) — the same cost on any page. Pages past the
+        oldest hot message continue into the chat's cold archive
+        (see chat_retention).
+        """
+        if chat_id != self.get_chat_id():
+            return []
 
+        q = self.db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id)
         if before_id is not None:
             q = q.filter(ChatMessage.id < before_id)
 
-        messages = (
-            q.order_by(ChatMessage.created_at.desc())
+        messages = q.order_by(ChatMessage.id.desc()).limit(limit).all()
+        if len(messages) < limit:
+            # всё, что старше горячих сообщений, — в архиве
+            messages += chat_archive.read_before(
+                self.db, chat_id, messages[-1].id if messages else before_id, limit - len(messages),
+            )
+        return messages
+
+    def get_chat_window(self, limit: int = settings.CHAT_WINDOW_SIZE) -> Tuple[Chat, List[ChatMessage], Optional[int]]:
+        """
+        The user's chat with only its newest `limit` messages (oldest first),
+        fetched in one query, and the before_id of the next older page for
+        GET /me/messages (None when the whole history fits).
+        """
+        chat = self.get_or_create_chat()
+        # один лишний ряд — чтобы узнать, есть ли что-то старше окна
+        rows = self.get_chat_messages(chat.id, limit=limit + 1)
+        next_before_id = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_before_id = rows[-1].id
+        rows.reverse()
+        return chat, rows, next_before_id
+
+    def search_messages(
+        self,
+        chat_id: int,
+        query: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str], Optional[int]]:
+        """
+        Full-text search in the chat's history (ru + en morphology).
+
+        Returns a page of hits, best first — dicts with id, chat_id, role,
+        created_at, rank and snippet (HTML-escaped text with matches in
+        <mark>) — the cursor of the next page, or None, and `ranked_from_id`.
+        Pagination is keyset over (rank, id), so deep pages cost the same as
+        the first.
+
+        Only the CHAT_SEARCH_MAX_CANDIDATES most recent matches are ranked:
+        the GIN index finds the matches, ranking and highlighting never touch
+        the rest of a long history. When there were more, `ranked_from_id` is
+        the oldest ranked match — older ones are on no page; otherwise None.
+
+        Messages moved to the cold archive (see chat_retention) are not
+        searched; `archived_up_to` tells how far that goes.
+        """
+        if chat_id != self.get_chat_id():
+            raise HTTPException(status_code=404, detail="Chat not found")
+        after = _decode_cursor(cursor) if cursor else None
+        if self.db.get_bind().dialect.name == "postgresql":
+            rows, ranked_from_id = self._search_fulltext(chat_id, query, limit + 1, after)
+        else:
+            rows, ranked_from_id = self._search_plain(chat_id, query, limit + 1, after), None
+
+        hits = [
+            {
+                "id": message_id,
+                "chat_id": chat_id,
+                "role": role,
+                "created_at": created_at,
+                "rank": rank,
+                "snippet": _render_snippet(snippet),
+            }
+            for message_id, role, created_at, rank, snippet in rows[:limit]
+        ]
+        next_cursor = _encode_cursor(hits[-1]["rank"], hits[-1]["id"]) if len(rows) > limit else None
+        return hits, next_cursor, ranked_from_id
+
+    def archived_up_to(self, chat_id: int) -> Optional[int]:
+        """Id of the newest archived message of the chat — search does not see it or anything older."""
+        if chat_id != self.get_chat_id():
+            return None
+        return chat_archive.last_archived_id(self.db, chat_id)
+
+    def _search_fulltext(self, chat_id: int, query: str, limit: int, after: Optional[Tuple[float, int]]):
+        russian, english = (literal_column(f"'{config}'::regconfig") for config in SEARCH_CONFIGS)
+        tsquery = func.websearch_to_tsquery(russian, query).op("||")(func.websearch_to_tsquery(english, query))
+        vector = search_vector(ChatMessage.content)
+
+        candidates = (
+            select(
+                ChatMessage.id.label("id"),
+                # ts_rank_cd — real; в double, чтобы курсор сравнивался точно
+                cast(func.ts_rank_cd(vector, tsquery), Float).label("rank"),
+            )
+            .where(ChatMessage.chat_id == chat_id, vector.op("@@")(tsquery))
+            .order_by(ChatMessage.id.desc())
+            .limit(settings.CHAT_SEARCH_MAX_CANDIDATES)
+            .cte("candidates")
+        )
+        page = select(candidates).order_by(candidates.c.rank.desc(), candidates.c.id.desc()).limit(limit)
+        if after is not None:
+            page = page.where(tuple_(candidates.c.rank, candidates.c.id) < tuple_(*after))
+        page = page.subquery("page")
+        # окно кандидатов заполнено целиком — значит, были и более старые совпадения
+        matched = select(func.count()).select_from(candidates).scalar_subquery()
+        oldest = select(func.min(candidates.c.id)).scalar_subquery()
+
+        # подсветка только для строк страницы; конфигурация — по алфавиту текста
+        headline = case(
+            (
+                ChatMessage.content.op("~")("[А-Яа-яЁё]"),
+                func.ts_headline(russian, ChatMessage.content, tsquery, _HEADLINE_OPTIONS),
+            ),
+            else_=func.ts_headline(english, ChatMessage.content, tsquery, _HEADLINE_OPTIONS),
+        )
+        rows = self.db.execute(
+            select(
+                ChatMessage.id, ChatMessage.role, ChatMessage.created_at, page.c.rank, headline.label("snippet"),
+                matched.label("matched"), oldest.label("oldest"),
+            )
+            .join(page, page.c.id == ChatMessage.id)
+            .order_by(page.c.rank.desc(), page.c.id.desc())
+        ).all()
+        ranked_from_id = rows[0].oldest if rows and rows[0].matched >= settings.CHAT_SEARCH_MAX_CANDIDATES else None
+        return [tuple(row[:5]) for row in rows], ranked_from_id
+
+    def _search_plain(self, chat_id: int, query: str, limit: int, after: Optional[Tuple[float, int]]):
+        """Без PostgreSQL (локальная разработка): все слова запроса, свежие первыми."""
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        # «_» входит в \w, а в LIKE это любой символ
+        likes = (_LIKE_SPECIAL.sub(r"\\\g<0>", w) for w in words)
+        q = (
+            select(ChatMessage.id, ChatMessage.role, ChatMessage.created_at, ChatMessage.content,
+                   literal(0.0).label("rank"))
+            .where(ChatMessage.chat_id == chat_id, *(ChatMessage.content.ilike(f"%{w}%", escape="\\") for w in likes))
+            .order_by(ChatMessage.id.desc())
             .limit(limit)
-            .all()
         )
+        if after is not None:
+            q = q.where(ChatMessage.id < after[1])
 
-        return messages
+        pattern = re.compile("|".join(re.escape(w) for w in words), re.IGNORECASE)
+        rows = []
+        for message_id, role, created_at, content, rank in self.db.execute(q).all():
+            first = pattern.search(content)
+            start = max(0, first.start() - _SNIPPET_CHARS // 2) if first else 0
+            snippet = pattern.sub(
+                lambda m: f"{_MARK_START}{m.group(0)}{_MARK_END}", content[start:start + _SNIPPET_CHARS]
+            )
+            rows.append((message_id, role, created_at, rank, snippet))
+        return rows
+
+
+def save_turn(db: Session, owner_id: int, chat_id: int, user_text: str, reply: str) -> List[int]:
+    """
+    Writes both messages of a turn and bumps the chat's updated_at in one
+    transaction; returns the new message ids. Raises 404 when the chat
+    does not belong to `owner_id` (nothing is written then).
+
+    On PostgreSQL it is a single statement, one round trip before COMMIT:
+    the ownership check and the timestamp update are an UPDATE ... RETURNING
+    in a CTE that the INSERT selects the chat id from, so a foreign chat
+    yields no rows. Other databases get the UPDATE and the INSERT separately.
+    """
+    turn = Turn(owner_id, chat_id, user_text, reply)
+    rows = turn.message_rows()
+    columns = ["chat_id", "role", "content", "created_at", "updated_at"]
+    touch = (
+        update(Chat)
+        .where(Chat.id == chat_id, Chat.owner_id == owner_id)
+        .values(updated_at=turn.at)
+    )
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            owned = touch.returning(Chat.id).cte("owned_chat")
+            source = union_all(*[
+                select(owned.c.id, *(literal(row[c]) for c in columns[1:])) for row in rows
+            ])
+            ids = db.execute(
+                insert(ChatMessage).from_select(columns, source).add_cte(owned).returning(ChatMessage.id)
+            ).scalars().all()
+        else:
+            ids = []
+            if db.execute(touch).rowcount:
+                ids = db.execute(insert(ChatMessage).returning(ChatMessage.id), rows).scalars().all()
+        if not ids:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="Chat not found")
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    return sorted(ids)
+
+
+def persist_turn(user_id: int, chat_id: int, user_text: str, reply: str) -> None:
+    """
+    Saves both messages of a chat turn once the response has been sent
+    (FastAPI BackgroundTasks / the end of an SSE stream). Runs in a worker
+    thread with its own session: the request's session is closed by then.
+    The reply is already in the conversation memory, so the next turn does
+    not depend on this write having finished.
+
+    With CHAT_WRITE_BEHIND_ENABLED the turn goes to the write-behind buffer
+    instead and is written with other turns in the next batch.
+    """
+    if settings.CHAT_WRITE_BEHIND_ENABLED and chat_write_buffer.add(Turn(user_id, chat_id, user_text, reply)):
+        return
+    timer = StageTimer()
+    db = SessionLocal()
+    try:
+        with timer.stage("persist"):
+            save_turn(db, user_id, chat_id, user_text, reply)
+    except Exception as e:
+        print(f"[ChatService] Failed to persist turn for chat {chat_id}: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.metrics import metrics
+from app.models import Chat, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("chat_write_buffered", "Chat turns waiting in the write-behind buffer")
+metrics.describe("chat_write_flushes_total", "Write-behind buffer flushes, by outcome")
+metrics.describe("chat_write_spilled_total", "Chat turns saved to the spill file at shutdown")
+metrics.describe("chat_write_quarantined_total", "Chat turns the database kept rejecting, moved to the quarantine file")
+
+
+@dataclass
+class Turn:
+    """Один ход чата: сообщение пользователя и ответ ассистента."""
+
+    owner_id: int
+    chat_id: int
+    user_text: str
+    reply: str
+    at: datetime = field(default_factory=datetime.utcnow)
+    # сколько раз БД отвергла именно этот ход (в spill-файл не пишется)
+    attempts: int = field(default=0, compare=False)
+
+    def message_rows(self) -> List[dict]:
+        # у ответа время на микросекунду позже: порядок не зависит от сортировки по id
+        reply_at = self.at + timedelta(microseconds=1)
+        return [
+            {"chat_id": self.chat_id, "role": "user", "content": self.user_text,
+             "created_at": self.at, "updated_at": self.at},
+            {"chat_id": self.chat_id, "role": "assistant", "content": self.reply,
+             "created_at": reply_at, "updated_at": reply_at},
+        ]
+
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "owner_id": self.owner_id, "chat_id": self.chat_id,
+            "user_text": self.user_text, "reply": self.reply, "at": self.at.isoformat(),
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line: str) -> "Turn":
+        data = json.loads(line)
+        data["at"] = datetime.fromisoformat(data["at"])
+        return cls(**data)
+
+
+class ChatWriteBuffer:
+    """
+    Write-behind буфер для сообщений чата.
+
+    `add` only appends the turn to memory; a background task writes the
+    buffer every CHAT_WRITE_BEHIND_FLUSH_SECONDS, or as soon as it holds
+    CHAT_WRITE_BEHIND_BATCH_SIZE turns: one multi-row INSERT of all
+    messages and one UPDATE of chats.updated_at per chat, in one
+    transaction. When a batch fails while the database is reachable, it is
+    bisected so the good turns are written; a turn rejected
+    CHAT_WRITE_BEHIND_MAX_ATTEMPTS times is moved to
+    CHAT_WRITE_BEHIND_QUARANTINE_PATH instead of blocking every flush.
+    Whatever was not written goes back to the front of the buffer and is
+    retried on the next tick.
+
+    Nothing is dropped: when the buffer is full (or not running) `add`
+    returns False and the caller writes the turn itself. On shutdown the
+    buffer is flushed; turns that still cannot be written are appended to
+    CHAT_WRITE_BEHIND_SPILL_PATH and written at the next start.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+        flush_seconds: float = settings.CHAT_WRITE_BEHIND_FLUSH_SECONDS,
+        max_buffer: int = settings.CHAT_WRITE_BEHIND_MAX_BUFFER,
+        spill_path: str = settings.CHAT_WRITE_BEHIND_SPILL_PATH,
+        max_attempts: int = settings.CHAT_WRITE_BEHIND_MAX_ATTEMPTS,
+        quarantine_path: str = settings.CHAT_WRITE_BEHIND_QUARANTINE_PATH,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        self.max_attempts = max(max_attempts, 1)
+        self.quarantine_path = quarantine_path
+        self._buffer: Deque[Turn] = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Application startup: writes what the last shutdown spilled and, with
+        CHAT_WRITE_BEHIND_ENABLED, starts the flusher.
+        """
+        await self._replay_spill()
+        if self._flusher is not None or not settings.CHAT_WRITE_BEHIND_ENABLED:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = self._loop.create_task(self._flush_periodically())
+
+    def add(self, turn: Turn) -> bool:
+        """
+        Queues the turn (safe to call from any thread). Returns False when
+        the buffer is not running or full — then the caller must write it.
+        """
+        if self._loop is None:
+            return False
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                return False
+            self._buffer.append(turn)
+            size = len(self._buffer)
+        metrics.set("chat_write_buffered", size)
+        if size >= self.batch_size:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return True
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """Writes everything buffered so far; False if some turns could not be written (they stay buffered)."""
+        async with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return True
+                try:
+                    left = await self._write_batch(batch)
+                finally:
+                    metrics.set("chat_write_buffered", len(self._buffer))
+                if left:
+                    metrics.inc("chat_write_flushes_total", outcome="error")
+                    with self._lock:
+                        self._buffer.extendleft(reversed(left))
+                    metrics.set("chat_write_buffered", len(self._buffer))
+                    return False
+                metrics.inc("chat_write_flushes_total", outcome="ok")
+
+    async def _write_batch(self, batch: List[Turn]) -> List[Turn]:
+        """Writes what it can of `batch`; returns the turns to retry later (all of them if the DB is down)."""
+        try:
+            await run_in_session(self._write, batch)
+            return []
+        except Exception as e:
+            logger.warning("Failed to write %d chat turns: %s", len(batch), e)
+            error = e
+        try:
+            await run_in_session(self._ping)
+        except Exception:
+            return batch  # БД недоступна — делить пачку бесполезно
+        # БД жива, значит, дело в данных: ищем плохие ходы делением пополам
+        return await self._bisect(batch, error)
+
+    async def _bisect(self, batch: List[Turn], error: Exception) -> List[Turn]:
+        if len(batch) == 1:
+            turn = batch[0]
+            turn.attempts += 1
+            if turn.attempts < self.max_attempts:
+                return batch
+            self._quarantine(turn, error)
+            return []
+        left: List[Turn] = []
+        mid = len(batch) // 2
+        for part in (batch[:mid], batch[mid:]):
+            try:
+                await run_in_session(self._write, part)
+            except Exception as e:
+                left += await self._bisect(part, e)
+        return left
+
+    async def close(self, attempts: int = 3) -> None:
+        """Application shutdown: stops taking turns, flushes, spills what could not be written."""
+        if self._flusher is None:
+            return
+        self._loop = None  # новые ходы пишут вызывающие сами
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        for attempt in range(attempts):
+            if await self.flush():
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        with self._lock:
+            left, self._buffer = list(self._buffer), deque()
+        self._spill(left)
+
+    @staticmethod
+    def _ping(db: Session) -> None:
+        db.execute(text("SELECT 1"))
+
+    @staticmethod
+    def _write(db: Session, batch: List[Turn]) -> None:
+        # ходы только в чаты их владельцев (и в ещё существующие)
+        owners = dict(db.execute(
+            select(Chat.id, Chat.owner_id).where(Chat.id.in_({t.chat_id for t in batch}))
+        ).all())
+        turns = [t for t in batch if owners.get(t.chat_id) == t.owner_id]
+        if len(turns) < len(batch):
+            logger.warning("Dropping %d chat turns for missing or foreign chats", len(batch) - len(turns))
+        if not turns:
+            return
+        db.execute(insert(ChatMessage), [row for t in turns for row in t.message_rows()])
+        touched: Dict[int, datetime] = {}
+        for t in turns:
+            touched[t.chat_id] = max(t.at, touched.get(t.chat_id, t.at))
+        db.execute(update(Chat), [{"id": chat_id, "updated_at": at} for chat_id, at in touched.items()])
+        db.commit()
+
+    def _spill(self, turns: List[Turn]) -> None:
+        if not turns:
+            return
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.writelines(t.to_json() + "\n" for t in turns)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error("Lost %d chat turns: cannot write spill file %s: %s", len(turns), self.spill_path, e)
+            return
+        metrics.inc("chat_write_spilled_total", len(turns))
+        logger.warning("Spilled %d unwritten chat turns to %s", len(turns), self.spill_path)
+
+    def _quarantine(self, turn: Turn, error: Exception) -> None:
+        metrics.inc("chat_write_quarantined_total")
+        try:
+            with open(self.quarantine_path, "a", encoding="utf-8") as f:
+                f.write(turn.to_json() + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logger.error("Lost chat turn for chat %s: cannot write quarantine file %s: %s",
+                         turn.chat_id, self.quarantine_path, e)
+            return
+        logger.error("Quarantined chat turn for chat %s after %d failed writes (%s) to %s",
+                     turn.chat_id, turn.attempts, error, self.quarantine_path)
+
+    def _rewrite_spill(self, turns: List[Turn]) -> None:
+        if not turns:
+            os.remove(self.spill_path)
+            return
+        tmp = self.spill_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(t.to_json() + "\n" for t in turns)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.spill_path)
+
+    async def _replay_spill(self) -> None:
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            turns = [Turn.from_json(line) for line in f if line.strip()]
+        total = len(turns)
+        while turns:
+            batch, rest = turns[:self.batch_size], turns[self.batch_size:]
+            # плохой ход уходит в карантин не позже max_attempts-й попытки;
+            # если что-то осталось — БД недоступна
+            for _ in range(self.max_attempts):
+                batch = await self._write_batch(batch)
+                if not batch:
+                    break
+            # в файле остаётся только незаписанное: следующий запуск не повторит
+            # уже записанные пачки
+            turns = batch + rest
+            try:
+                self._rewrite_spill(turns)
+            except OSError as e:
+                logger.error("Cannot rewrite spill file %s: %s", self.spill_path, e)
+                return
+            if batch:
+                logger.error("Failed to replay %d spilled chat turns from %s; will retry at next start",
+                             len(turns), self.spill_path)
+                return
+        logger.warning("Replayed %d spilled chat turns", total)
+
+
+# Один буфер на процесс: роуты пишут ходы, приложение запускает и останавливает
+chat_write_buffer = ChatWriteBuffer()
@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+
+from app.core.config import settings
+from app.core.errors import ConflictError
+from app.services.calendar_service import CalendarService
+from app.utils.temporal import parse_date_range, strip_spans
+
+# ───────────────── распознавание ─────────────────
+
+# Разрешённые «служебные» слова вопроса о планах. Если в сообщении есть что-то
+# ещё — это уже не типовой запрос, и его разбирает модель.
+_QUERY_FILLER = frozenset((
+    # en
+    "what", "whats", "what's", "do", "i", "have", "for", "on", "my", "me", "show", "plans", "plan",
+    "schedule", "events", "agenda", "is", "are", "any", "anything", "the", "this", "calendar",
+    "please", "pls", "planned", "there", "so", "far", "hey", "hi", "and",
+    # ru
+    "что", "у", "меня", "на", "покажи", "мои", "мне", "планы", "расписание", "дела", "события",
+    "какие", "какое", "есть", "эту", "этой", "календарь", "пожалуйста", "а", "запланировано",
+    "в", "что-нибудь", "что-то", "скажи", "привет",
+    # kk
+    "менде", "не", "бар", "жоспар", "жоспарым", "жоспарлар", "жоспарларым", "жоспарларымды",
+    "көрсет", "көрсетші", "кесте", "кестем", "кестемді", "қандай", "маған", "осы", "бұл",
+    "арналған", "шы", "ма", "ме", "іс", "істер", "сәлем",
+))
+_QUERY_MARKERS = frozenset((
+    "what", "whats", "what's", "show", "plans", "schedule", "agenda", "events", "anything", "calendar",
+    "что", "покажи", "планы", "расписание", "дела", "события", "какие", "запланировано", "календарь",
+    "не", "жоспар", "жоспарым", "жоспарлар", "жоспарларым", "жоспарларымды", "көрсет", "көрсетші",
+    "кесте", "кестем", "кестемді", "қандай", "істер",
+))
+
+_CREATE_VERBS = frozenset((
+    "add", "schedule", "book", "create", "put",
+    "добавь", "запиши", "запланируй", "создай", "поставь", "внеси",
+    "қос", "қосып", "қосшы", "жаз", "жазып", "жазшы", "жоспарла",
+))
+_POLITE = frozenset(("please", "pls", "пожалуйста", "өтінемін"))
+_CREATE_FILLER = frozenset((
+    "at", "on", "for", "to", "my", "calendar", "please", "pls", "a", "an", "from", "until", "till",
+    "в", "на", "с", "до", "мне", "пожалуйста", "календарь", "сағат", "сағатта", "күнтізбеге",
+    "маған", "өтінемін",
+))
+
+# Заголовок берётся из команды, а там он в винительном падеже («добавь встречу»).
+# Возвращаем именительный там, где это делается однозначно, иначе — к модели.
+_KK_CREATE_VERBS = frozenset(("қос", "қосып", "қосшы", "жаз", "жазып", "жазшы", "жоспарла"))
+_KK_ACCUSATIVE = ("ны", "ні", "ды", "ді", "ты", "ті")
+_RU_PREPOSITIONS = frozenset((
+    "с", "со", "к", "ко", "в", "во", "на", "по", "у", "о", "об", "обо", "для", "за", "про", "из",
+    "от", "до", "без", "под", "над", "перед", "при", "после", "между",
+))
+# несклоняемые — уже в именительном
+_RU_INDECLINABLE = frozenset((
+    "шоу", "рагу", "кенгуру", "табу", "меню", "интервью", "рандеву", "ревю", "фондю", "барбекю",
+    "кешью", "дежавю", "кунг-фу", "ушу", "ток-шоу",
+))
+_RU_VOWELS = frozenset("аеёиоуыэюяьъ")
+_CYRILLIC_WORD_RE = re.compile(r"^[а-яё-]+$")
+
+_TIME_RANGE_RE = re.compile(
+    r"(?:\b(?:at|from|с|в|сағат)\s+)?(\d{1,2})[:.](\d{2})\s*(?:-|–|—|\bto\b|\bдо\b|\buntil\b)\s*(\d{1,2})[:.](\d{2})(?:-?(?:ге|ке|қа|ға|де|те|да|та))?"
+)
+_TIME_RE = re.compile(r"(?:\b(?:at|в|во|сағат)\s+)?(?<![.\d])\b(\d{1,2})[:.](\d{2})(?![.\d])(?:-?(?:де|те|да|та|ге|ке|қа|ға))?\b")
+_DURATION_RE = re.compile(
+    r"\b(?:for|на)?\s*(\d+)\s*(hours?|hrs?|h|minutes?|mins?|m|час(?:а|ов)?|ч|минут(?:ы)?|мин|сағат(?:қа)?|минут(?:қа)?)\b"
+)
+
+_WORD_RE = re.compile(r"[\w'’-]+", re.UNICODE)
+
+
+@dataclass
+class Intent:
+    kind: str                 # "day" | "range" | "create"
+    day: date
+    end: Optional[date] = None
+    title: Optional[str] = None
+    start: Optional[time] = None
+    minutes: Optional[int] = None
+
+
+def _words(text: str) -> list[str]:
+    return [w.strip("-'’") for w in _WORD_RE.findall(text.lower()) if w.strip("-'’")]
+
+
+def recognize_intent(message: str, today: date) -> Optional[Intent]:
+    """
+    Детерминированный разбор типовых запросов (ru/en/kk):
+    «что у меня завтра/в пятницу», «покажи неделю», «добавь X завтра в 15:00».
+
+    Returns None for anything that does not match exactly — those messages
+    go to the model.
+    """
+    text = message.strip()
+    if not text or len(text) > 120 or "\n" in text:
+        return None
+    lower = text.lower()
+    words = _words(lower)
+    if not words:
+        return None
+
+    # глагол создания — только в начале (ru/en) или в конце (kk) фразы,
+    # иначе «show my schedule» оказалось бы командой «schedule»
+    core = [w for w in words if w not in _POLITE]
+    if core and (core[0] in _CREATE_VERBS or core[-1] in _CREATE_VERBS):
+        return _recognize_create(text, lower, today)
+
+    date_range = parse_date_range(lower, today, max_days=settings.CALENDAR_CONTEXT_MAX_DAYS)
+    if date_range is None:
+        return None
+    rest = _words(strip_spans(lower, date_range.spans))
+    if any(w not in _QUERY_FILLER for w in rest):
+        return None
+    if not any(w in _QUERY_MARKERS for w in rest):
+        return None
+    if date_range.days == 1:
+        return Intent(kind="day", day=date_range.start)
+    return Intent(kind="range", day=date_range.start, end=date_range.end)
+
+
+def _recognize_create(text: str, lower: str, today: date) -> Optional[Intent]:
+    minutes: Optional[int] = None
+    m_range = _TIME_RANGE_RE.search(lower)
+    if m_range:
+        h1, m1, h2, m2 = (int(g) for g in m_range.groups())
+        if not (h1 < 24 and m1 < 60 and h2 < 24 and m2 < 60):
+            return None
+        start = time(h1, m1)
+        minutes = (h2 * 60 + m2) - (h1 * 60 + m1)
+        if minutes <= 0:
+            return None
+        span = m_range.span()
+    else:
+        times = list(_TIME_RE.finditer(lower))
+        if len(times) != 1:
+            return None
+        h, m = int(times[0].group(1)), int(times[0].group(2))
+        if h >= 24 or m >= 60:
+            return None
+        start = time(h, m)
+        span = times[0].span()
+
+    remaining = lower[:span[0]] + " " + lower[span[1]:]
+    m_dur = _DURATION_RE.search(remaining)
+    if m_dur:
+        if minutes is not None:
+            return None
+        amount, unit = int(m_dur.group(1)), m_dur.group(2)
+        minutes = amount if unit[0] in "mм" else amount * 60
+        remaining = remaining[:m_dur.start()] + " " + remaining[m_dur.end():]
+    date_range = parse_date_range(remaining, today)
+    if date_range is None or date_range.days != 1:
+        return None
+    remaining = strip_spans(remaining, date_range.spans)
+    if re.search(r"\d", remaining):
+        # ещё какие-то числа — это уже не наш шаблон
+        return None
+
+    words = _words(remaining)
+    verbs = [w for w in words if w in _CREATE_VERBS]
+    if len(verbs) != 1:
+        return None
+    title_words = [w for w in words if w not in _CREATE_VERBS]
+    while title_words and title_words[0] in _CREATE_FILLER:
+        title_words.pop(0)
+    while title_words and title_words[-1] in _CREATE_FILLER:
+        title_words.pop()
+    if not title_words or len(title_words) > 6:
+        return None
+
+    # заголовок берём из исходного текста, чтобы сохранить регистр
+    original = {w.lower(): w for w in _WORD_RE.findall(text)}
+    title_words = _nominative([original.get(w, w) for w in title_words], kazakh=verbs[0] in _KK_CREATE_VERBS)
+    if title_words is None:
+        return None
+    title = " ".join(title_words)
+    title = title[0].upper() + title[1:]
+    return Intent(
+        kind="create",
+        day=date_range.start,
+        title=title,
+        start=start,
+        minutes=minutes,
+    )
+
+
+def _nominative(words: list[str], kazakh: bool) -> Optional[list[str]]:
+    """
+    Title words from a create command with the object put back into the
+    nominative: «срочную встречу с Иваном» → «срочная встреча с Иваном»,
+    «кездесуді» → «кездесу». None when that cannot be done safely.
+    """
+    words = list(words)
+    if kazakh:
+        # SOV: дополнение — последнее слово перед глаголом
+        last = words[-1]
+        if last.lower().endswith(_KK_ACCUSATIVE):
+            if len(last) < 5:
+                return None
+            words[-1] = last[:-2]
+        return words
+
+    # ru: меняем только вершину — прилагательные и первое существительное до предлога
+    for i, word in enumerate(words):
+        lower = word.lower()
+        if lower in _RU_PREPOSITIONS or lower in _RU_INDECLINABLE or not _CYRILLIC_WORD_RE.match(lower):
+            break
+        if lower.endswith(("ую", "юю")):
+            words[i] = word[:-2] + ("ая" if lower[-2] == "у" else "яя")
+            continue
+        if lower.endswith(("ию", "ью")):
+            words[i] = word[:-1] + "я"
+        elif lower.endswith("у") or lower.endswith("ю"):
+            if len(lower) < 3 or lower[-2] in _RU_VOWELS:
+                return None
+            words[i] = word[:-1] + ("а" if lower[-1] == "у" else "я")
+        break
+    return words
+
+
+# ───────────────── шаблоны ответов ─────────────────
+
+_TEMPLATES = {
+    "ru": {
+        "day": "Вот что у тебя в календаре:",
+        "range": "Твои планы на эти дни:",
+        "created": "Готово: «{title}» — {date}, {start}–{end}.",
+        "conflict": "Не получится: в это время уже стоит «{other}» ({other_start}–{other_end}).",
+    },
+    "en": {
+        "day": "Here is what's on your calendar:",
+        "range": "Your plans for those days:",
+        "created": "Added “{title}” on {date} at {start}–{end}.",
+        "conflict": "That slot is taken: “{other}” ({other_start}–{other_end}) is already there.",
+    },
+    "kk": {
+        "day": "Күнтізбеңізде мыналар бар:",
+        "range": "Осы күндерге жоспарларыңыз:",
+        "created": "«{title}» {date} күні {start}–{end} аралығына қосылды.",
+        "conflict": "Бұл уақыт бос емес: «{other}» ({other_start}–{other_end}) тұр.",
+    },
+}
+
+# Короткие вступления в тоне персонажа; основной текст — из шаблонов выше
+_PERSONA_PREFIX = {
+    "assistant": {"ru": "", "en": "", "kk": ""},
+    "coach": {"ru": "Вперёд! ", "en": "Let's go! ", "kk": "Алға! "},
+    "friend": {"ru": "Держи! ", "en": "Here you go! ", "kk": "Міне! "},
+    "girlfriend": {"ru": "💕 ", "en": "💕 ", "kk": "💕 "},
+    "boyfriend": {"ru": "🤗 ", "en": "🤗 ", "kk": "🤗 "},
+}
+
+
+class FastPath:
+    """Answers recognized intents from the calendar and templates, without the LLM."""
+
+    def __init__(self, build_calendar_context) -> None:
+        # AIService.build_calendar_context — тот же текст, что видит модель
+        self._build_calendar_context = build_calendar_context
+
+    def answer(
+        self,
+        message: str,
+        *,
+        lang: str,
+        personality: str,
+        calendar_service: CalendarService,
+    ) -> Optional[dict]:
+        """
+        Returns {"message", "event_id"} when the message was handled locally,
+        or None if it has to go to the model.
+        """
+        now_local = datetime.now(calendar_service.tz)
+        intent = recognize_intent(message, now_local.date())
+        if intent is None:
+            return None
+
+        texts = _TEMPLATES[lang]
+        prefix = _PERSONA_PREFIX.get(personality, _PERSONA_PREFIX["assistant"])[lang]
+
+        if intent.kind in ("day", "range"):
+            context = self._build_calendar_context(
+                calendar_service,
+                target_date_local=intent.day,
+                end_date_local=intent.end,
+                lang=lang,
+            )
+            return {"message": f"{prefix}{texts[intent.kind]}\n\n{context.strip()}", "event_id": None}
+
+        start_local = datetime.combine(intent.day, intent.start, tzinfo=calendar_service.tz)
+        if start_local <= now_local or intent.minutes is None:
+            # время уже прошло или длительность не названа — модель переспросит,
+            # как требуют правила промпта и инструмент create_event
+            return None
+        end_local = start_local + timedelta(minutes=intent.minutes)
+
+        try:
+            ev = calendar_service.create_event({
+                "title": intent.title,
+                "start": start_local.replace(tzinfo=None).isoformat(),
+                "end": end_local.replace(tzinfo=None).isoformat(),
+            })
+        except ConflictError as err:
+            other = err.event
+            other_end = other.end_time or other.start_time + timedelta(hours=1)
+            return {
+                "message": prefix + texts["conflict"].format(
+                    other=other.title,
+                    other_start=f"{_as_local(other.start_time, calendar_service):%H:%M}",
+                    other_end=f"{_as_local(other_end, calendar_service):%H:%M}",
+                ),
+                "event_id": None,
+            }
+        except ValueError:
+            return None
+
+        return {
+            "message": prefix + texts["created"].format(
+                title=intent.title,
+                date=f"{intent.day:%d.%m.%Y}",
+                start=f"{start_local:%H:%M}",
+                end=f"{end_local:%H:%M}",
+            ),
+            "event_id": str(ev.id),
+        }
+
+
+def _as_local(dt: datetime, calendar_service: CalendarService) -> datetime:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(calendar_service.tz)
@@ -1,19 +1,213 @@
-from collections import defaultdict
-from typing import List, Dict
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.redis_client import get_redis
+from app.models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("messages", "size", "loaded_at")
+
+    def __init__(self, messages: List[dict], loaded_at: float) -> None:
+        self.messages = messages
+        self.size = sum(_message_size(m) for m in messages)
+        self.loaded_at = loaded_at
+
+
+def _message_size(message: dict) -> int:
+    return len(message["content"].encode()) + 64
+
 
 class MemoryStore:
     """
     chat_id → список последних N сообщений вида
-    {"role": "user" | "assistant", "content": "..."}
+    {"role": "user" | "assistant", "content": "...", "id": 123}
+
+    `id` есть только у сообщений, поднятых из БД; добавленные через add()
+    его не имеют — они заведомо новее любого пересказа (см. ConversationSummarizer).
+
+    Источник истины — таблица chat_messages. Поверх неё:
+    * локальный LRU, ограниченный по числу чатов и по байтам, с TTL —
+      так память воркера не растёт с числом активных пользователей;
+    * при заданном REDIS_URL — общий для всех воркеров список в Redis
+      (тогда локальный кэш не используется, чтобы воркеры не расходились).
+
+    On a miss the last N messages are hydrated from chat_messages with one
+    query over the (chat_id, id) index.
     """
-    def __init__(self, max_messages: int = 10) -> None:
-        self._data: Dict[int, List[dict]] = defaultdict(list)
+
+    def __init__(
+        self,
+        max_messages: int = settings.MEMORY_HISTORY_MESSAGES,
+        max_chats: int = settings.MEMORY_MAX_CHATS,
+        max_bytes: int = settings.MEMORY_MAX_BYTES,
+        ttl_seconds: int = settings.MEMORY_TTL_SECONDS,
+    ) -> None:
         self.max_messages = max_messages
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    # ───────────────── загрузка из БД ─────────────────
+    def _load_from_db(self, db: Session, chat_id: int, exclude_last_user: Optional[str]) -> List[dict]:
+        rows = (
+            db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+            .filter(ChatMessage.chat_id == chat_id)
+            .order_by(ChatMessage.id.desc())
+            .limit(self.max_messages + 1)
+            .all()
+        )
+        messages = [
+            {"role": role, "content": content, "id": message_id}
+            for message_id, role, content in reversed(rows)
+        ]
+        # текущее сообщение пользователя роуты сохраняют до вызова модели —
+        # в истории его быть не должно, оно добавляется отдельно
+        if (
+            exclude_last_user is not None
+            and messages
+            and messages[-1]["role"] == "user"
+            and messages[-1]["content"] == exclude_last_user
+        ):
+            messages.pop()
+        return messages[-self.max_messages:]
+
+    # ───────────────── локальный LRU ─────────────────
+    def _local_get(self, chat_id: int) -> Optional[List[dict]]:
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > self.ttl_seconds:
+                self._drop(chat_id)
+                return None
+            self._data.move_to_end(chat_id)
+            return list(entry.messages)
+
+    def _local_put(self, chat_id: int, messages: List[dict]) -> None:
+        entry = _Entry(messages[-self.max_messages:], time.monotonic())
+        with self._lock:
+            self._drop(chat_id)
+            self._data[chat_id] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def _local_append(self, chat_id: int, message: dict) -> None:
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is None:
+                # не загружен — при следующем get всё равно поднимем из БД
+                return
+            entry.messages.append(message)
+            entry.size += _message_size(message)
+            self._bytes += _message_size(message)
+            while len(entry.messages) > self.max_messages:
+                removed = _message_size(entry.messages.pop(0))
+                entry.size -= removed
+                self._bytes -= removed
+            self._data.move_to_end(chat_id)
+            self._evict()
+
+    def _drop(self, chat_id: int) -> None:
+        entry = self._data.pop(chat_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._data and (len(self._data) > self.max_chats or self._bytes > self.max_bytes):
+            _, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+
+    # ───────────────── публичный API ─────────────────
+    async def get(self, chat_id: int, db: Optional[Session] = None, current_message: Optional[str] = None) -> List[dict]:
+        """
+        History for `chat_id` (a copy). `current_message` is the user message
+        being answered; if it is already persisted it is left out. On a miss
+        it is loaded through `db`, or without one in the DB thread pool.
+        """
+        redis = get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.lrange(self._key(chat_id), 0, -1)
+                if raw:
+                    return [json.loads(item) for item in raw]
+            except Exception as e:
+                logger.warning("Shared memory unavailable, using database: %s", e)
+                redis = None
+        else:
+            cached = self._local_get(chat_id)
+            if cached is not None:
+                return cached
+
+        if db is not None:
+            messages = self._load_from_db(db, chat_id, current_message)
+        else:
+            # без сессии запроса — своей сессией в пуле потоков, не блокируя event loop
+            messages = await run_in_session(self._load_from_db, chat_id, current_message)
+
+        if redis is not None:
+            try:
+                key = self._key(chat_id)
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.delete(key)
+                    if messages:
+                        pipe.rpush(key, *[json.dumps(m, ensure_ascii=False) for m in messages])
+                    pipe.expire(key, self.ttl_seconds)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("Failed to populate shared memory: %s", e)
+        else:
+            self._local_put(chat_id, messages)
+        return list(messages)
+
+    async def add(self, chat_id: int, role: str, content: str) -> None:
+        message = {"role": role, "content": content}
+        redis = get_redis()
+        if redis is None:
+            self._local_append(chat_id, message)
+            return
+        try:
+            key = self._key(chat_id)
+            async with redis.pipeline(transaction=True) as pipe:
+                # RPUSHX: если истории в Redis нет, её поднимут из БД при следующем get
+                pipe.rpushx(key, json.dumps(message, ensure_ascii=False))
+                pipe.ltrim(key, -self.max_messages, -1)
+                pipe.expire(key, self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Failed to append to shared memory: %s", e)
 
-    def add(self, chat_id: int, role: str, content: str) -> None:
-        self._data[chat_id].append({"role": role, "content": content})
+    async def invalidate(self, chat_id: int) -> None:
+        """Forgets the cached history; the next get() reloads it from the database."""
+        redis = get_redis()
+        if redis is None:
+            with self._lock:
+                self._drop(chat_id)
+            return
+        try:
+            await redis.delete(self._key(chat_id))
+        except Exception as e:
+            logger.warning("Failed to invalidate shared memory: %s", e)
 
-        self._data[chat_id] = self._data[chat_id][-self.max_messages :]
+    @staticmethod
+    def _key(chat_id: int) -> str:
+        return f"chatmem:{chat_id}"
 
-    def get(self, chat_id: int) -> List[dict]:
-        return self._data[chat_id]
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"chats": len(self._data), "bytes": self._bytes}
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.utils.language import MIN_CONFIDENCE, detect_language_scored
+from app.utils.temporal import parse_date_range
+from app.utils.tokens import count_tokens
+
+metrics.describe("llm_cascade_total", "Model-generated turns by tier the router picked")
+metrics.describe("llm_cascade_escalations_total", "Small-model answers rejected and re-asked on the main model")
+
+# Основы глаголов действий с календарём (ru/en/kk): такие ходы — только большой модели,
+# инструменты календаря есть только у неё.
+_ACTION_STEMS = (
+    # en
+    "add", "create", "move", "reschedul", "cancel", "delete", "remove", "remind", "postpone",
+    # ru
+    "добав", "запиш", "запис", "заплан", "созда", "постав", "внес", "перен", "удал", "отмен",
+    "напомн", "сдвин", "передвин", "убер", "очист",
+    # kk
+    "қос", "жаз", "жоспарла", "жой", "өшір", "ауыстыр", "еске сал", "кейінге қалдыр",
+)
+# Эти слова бывают и существительными («my schedule», «plans») — глагол, только если стоит первым
+_LEADING_VERBS = frozenset(("schedule", "book", "plan", "set", "put", "shift", "clear", "block"))
+# Поиск окна/сравнение вариантов тоже требует рассуждений
+_REASONING_STEMS = (
+    "free", "available", "slot", "busy", "conflict", "optimi", "prioriti", "organize",
+    "свобод", "окн", "занят", "пересека", "оптимиз", "приорит", "распредел",
+    "бос", "уақыт тап",
+)
+_TIME_RE = re.compile(r"\b\d{1,2}[:.]\d{2}\b|\b\d{1,2}\s*(?:am|pm)\b")
+_CLAUSE_RE = re.compile(r"\b(?:and|then|also|и|потом|затем|а также|ещё|және|содан кейін)\b|[;,]")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class Route:
+    tier: str          # "small" | "large"
+    model: str
+    max_tokens: int
+    reason: str
+
+
+def classify_turn(message: str, today: date) -> str:
+    """
+    Cheap local complexity estimate. Returns "simple" for short turns without
+    calendar actions, explicit times, several dates or several clauses, and
+    otherwise the first feature that made the turn complex ("long",
+    "action", "reasoning", "time", "dates", "clauses").
+    """
+    lower = message.lower()
+    words = _WORD_RE.findall(lower)
+    if len(words) > settings.CASCADE_MAX_SIMPLE_WORDS:
+        return "long"
+    if (
+        any(w.startswith(_ACTION_STEMS) for w in words)
+        or any(" " in s and s in lower for s in _ACTION_STEMS)
+        or (words and words[0] in _LEADING_VERBS)
+    ):
+        return "action"
+    if any(w.startswith(_REASONING_STEMS) for w in words):
+        return "reasoning"
+    if _TIME_RE.search(lower):
+        return "time"
+    date_range = parse_date_range(lower, today)
+    if date_range is not None and (len(date_range.spans) > 1 or date_range.days > 7):
+        return "dates"
+    if len(_CLAUSE_RE.findall(lower)) + max(lower.count("?") - 1, 0) >= 2:
+        return "clauses"
+    return "simple"
+
+
+class ModelRouter:
+    """
+    Каскад моделей: простые ходы — на маленький быстрый деплоймент с жёстким
+    лимитом токенов, всё остальное — на основную модель.
+
+    Disabled (everything goes to the main model) unless SMALL_DEPLOYMENT_NAME
+    is set. `validate` rejects small-model answers that should be re-asked
+    on the main model.
+    """
+
+    def __init__(
+        self,
+        small_model: Optional[str] = settings.SMALL_DEPLOYMENT_NAME,
+        small_max_tokens: int = settings.SMALL_MODEL_MAX_TOKENS,
+    ) -> None:
+        self.small_model = small_model
+        self.small_max_tokens = small_max_tokens
+
+    def route(self, message: str, today: date) -> Route:
+        if not self.small_model:
+            return Route("large", settings.DEPLOYMENT_NAME, settings.OPENAI_MAX_TOKENS, "disabled")
+        reason = classify_turn(message, today)
+        if reason == "simple":
+            route = Route("small", self.small_model, self.small_max_tokens, reason)
+        else:
+            route = Route("large", settings.DEPLOYMENT_NAME, settings.OPENAI_MAX_TOKENS, reason)
+        metrics.inc("llm_cascade_total", tier=route.tier)
+        return route
+
+    def validate(self, text: Optional[str], route: Route, lang: str) -> Optional[str]:
+        """Returns why a small-model answer is not acceptable, or None."""
+        text = (text or "").strip()
+        if not text:
+            return "empty"
+        if count_tokens(text) >= route.max_tokens - 5:
+            return "truncated"
+        detected, confidence = detect_language_scored(text)
+        if detected and detected != lang and confidence >= MIN_CONFIDENCE and len(text.split()) >= 4:
+            return "language"
+        return None
+
+    @staticmethod
+    def escalated(reason: str) -> None:
+        metrics.inc("llm_cascade_escalations_total", reason=reason)
@@ -1,13 +1,181 @@
+import asyncio
 import os
-from openai import AsyncAzureOpenAI
+import time
+from dataclasses import dataclass, field
+from openai import (
+    AsyncAzureOpenAI,
+    APIConnectionError,
+    APIStatusError,
+    OpenAIError,
+)
 from app.core.config import settings
-from typing import Optional, List
+from app.core.metrics import metrics
+from app.core.resilience import CircuitBreaker, LatencyWindow, backoff_delay, parse_retry_after
+from app.utils.tokens import count_message_tokens, count_tokens
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+metrics.describe("llm_usage_tokens_total", "Tokens reported by the API, by kind (prompt/cached/completion)")
+metrics.describe("llm_requests_total", "Chat completions by prompt-cache outcome")
+metrics.describe(
+    "llm_latency_seconds",
+    "Completion latency (time to first token when streaming) by prompt-cache outcome",
+)
+metrics.describe("llm_in_flight", "LLM calls currently holding a concurrency slot")
+metrics.describe("llm_queue_wait_seconds", "Time spent waiting for a concurrency slot")
+metrics.describe("llm_retries_total", "Retried LLM attempts, by reason")
+metrics.describe("llm_failures_total", "LLM calls that failed or were rejected, by reason")
+metrics.describe(
+    "llm_deployment_latency_seconds",
+    "Per-deployment latency of successful attempts (time to first token when streaming)",
+)
+metrics.describe("llm_hedge_delay_seconds", "Current hedge delay of the primary deployment")
+metrics.describe("llm_hedges_total", "Hedged requests: sent, won by the hedge, or failovers")
+
+
+class _NoUsageMeter:
+    """Без учёта: квоты не проверяются, расход не пишется (скрипты и стенды без БД)."""
+
+    async def check(self) -> str:
+        return "ok"
+
+    def record(self, **usage: Any) -> None:
+        pass
+
+
+# Клиент модели не зависит от БД: учёт подключает приложение (см. ai_service)
+_usage_meter: Any = _NoUsageMeter()
+
+
+def use_usage_meter(meter: Any) -> None:
+    """Meters every call with `meter` (`check()` before it, `record(...)` after; see usage_service.UsageMeter)."""
+    global _usage_meter
+    _usage_meter = meter
+
+
+def _make_client(endpoint: str, api_key: str) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        api_version="2025-01-01-preview",
+        # ретраи и таймауты — наши, см. ask_gpt
+        max_retries=0,
+        timeout=settings.LLM_DEADLINE_SECONDS,
+    )
+
+
+class Deployment:
+    """One Azure OpenAI deployment with its own breaker and latency window."""
+
+    def __init__(self, label: str, client: AsyncAzureOpenAI, model: str) -> None:
+        self.label = label
+        self.client = client
+        self.model = model
+        self.breaker = CircuitBreaker(
+            f"llm:{label}",
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            reset_seconds=settings.LLM_BREAKER_RESET_SECONDS,
+        )
+        # отдельно для обычных ответов и для первого токена стрима
+        self.latency = {
+            False: LatencyWindow(settings.LLM_LATENCY_WINDOW),
+            True: LatencyWindow(settings.LLM_LATENCY_WINDOW),
+        }
+
+    def record_latency(self, seconds: float, stream: bool) -> None:
+        self.latency[stream].add(seconds)
+        metrics.observe(
+            "llm_deployment_latency_seconds", seconds,
+            deployment=self.label, stream=str(stream).lower(),
+        )
+
+    def hedge_delay(self, stream: bool) -> float:
+        window = self.latency[stream]
+        if len(window) < settings.LLM_HEDGE_MIN_SAMPLES:
+            delay = settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        else:
+            delay = max(window.quantile(settings.LLM_HEDGE_QUANTILE), settings.LLM_HEDGE_MIN_DELAY_SECONDS)
+        metrics.set("llm_hedge_delay_seconds", delay, stream=str(stream).lower())
+        return delay
 
-client = AsyncAzureOpenAI(
-    azure_endpoint=settings.ENDPOINT_URL,
-    api_key=settings.AZURE_OPENAI_API_KEY,
-    api_version="2025-01-01-preview",
+
+primary = Deployment(
+    "primary",
+    _make_client(settings.ENDPOINT_URL, settings.AZURE_OPENAI_API_KEY),
+    settings.DEPLOYMENT_NAME,
 )
+secondary: Optional[Deployment] = None
+if settings.LLM_HEDGE_ENDPOINT_URL:
+    secondary = Deployment(
+        "secondary",
+        _make_client(
+            settings.LLM_HEDGE_ENDPOINT_URL,
+            settings.LLM_HEDGE_API_KEY or settings.AZURE_OPENAI_API_KEY,
+        ),
+        settings.LLM_HEDGE_DEPLOYMENT_NAME or settings.DEPLOYMENT_NAME,
+    )
+
+# Маленькая модель каскада (services/model_router.py) — на том же ресурсе, но со своим
+# предохранителем и статистикой задержек
+small: Optional[Deployment] = None
+if settings.SMALL_DEPLOYMENT_NAME:
+    small = Deployment("small", primary.client, settings.SMALL_DEPLOYMENT_NAME)
+
+_slots = asyncio.Semaphore(settings.LLM_MAX_IN_FLIGHT)
+_in_flight = 0
+
+
+class LLMUnavailableError(OpenAIError):
+    """
+    The model is not reachable right now: the breaker is open, no concurrency
+    slot freed up in time, or the call ran out of its deadline.
+    """
+
+    def __init__(self, reason: str) -> None:
+        self.reason = reason
+        super().__init__(f"LLM unavailable: {reason}")
+
+
+class QuotaExceededError(OpenAIError):
+    """The caller has used up today's token quota (LLM_DAILY_TOKEN_QUOTA)."""
+
+    def __init__(self) -> None:
+        super().__init__("LLM token quota exceeded")
+
+
+@dataclass
+class ToolCall:
+    id: str
+    name: str
+    arguments: str  # JSON-строка как есть от модели
+
+
+@dataclass
+class AssistantTurn:
+    """Non-streamed answer to a call with `tools`: text and/or tool calls."""
+
+    content: str
+    tool_calls: List[ToolCall] = field(default_factory=list)
+
+    def as_message(self) -> dict:
+        """The assistant message to send back together with the tool results."""
+        message: Dict[str, Any] = {"role": "assistant", "content": self.content or None}
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {"id": c.id, "type": "function", "function": {"name": c.name, "arguments": c.arguments}}
+                for c in self.tool_calls
+            ]
+        return message
+
+
+class _Attempt:
+    """Successful attempt: the response and, for streams, chunks read before the first token."""
+
+    def __init__(self, deployment: Deployment, response, chunks=None, buffered: Optional[list] = None) -> None:
+        self.deployment = deployment
+        self.response = response
+        self.chunks = chunks
+        self.buffered = buffered or []
+
 
 async def ask_gpt(
     messages: list[dict],
@@ -19,9 +187,54 @@ async def ask_gpt(
     presence_penalty: float = 0.0,
     stop: Optional[List[str]] = None,
     stream: bool = False,
+    tools: Optional[List[dict]] = None,
+    tool_choice: Optional[str] = None,
 ):
-    response = await client.chat.completions.create(
-        model=model,
+    """
+    Returns the completion text, or with `stream=True` an async iterator
+    of text deltas as they arrive.
+
+    With `tools` the non-streamed result is an AssistantTurn; a stream yields
+    text deltas and then, if the model called tools, one final List[ToolCall].
+
+    At most LLM_MAX_IN_FLIGHT calls run at once. 429/5xx and connection
+    errors are retried with exponential backoff and jitter (honoring
+    Retry-After) within a LLM_DEADLINE_SECONDS deadline for the whole call.
+    Raises LLMUnavailableError when the breaker is open, no slot frees up in
+    time or the deadline passes.
+
+    Calls to the main model are hedged when a secondary deployment is
+    configured: if the primary has not answered (or sent its first token)
+    within its rolling p90 latency, the same request goes to the secondary,
+    the first answer wins and the other request is cancelled.
+
+    Token usage of every call is metered per user by the meter installed
+    with `use_usage_meter` (the app installs services/usage_service.py's).
+    Before the call the user's daily quota is checked: near the limit the
+    main model is replaced by the small one, past it QuotaExceededError is
+    raised without calling the model.
+    """
+    decision = await _usage_meter.check()
+    if decision == "block":
+        metrics.inc("llm_failures_total", reason="quota")
+        raise QuotaExceededError()
+    if decision == "downgrade" and small is not None and model == primary.model:
+        model = small.model
+        max_tokens = min(max_tokens, settings.SMALL_MODEL_MAX_TOKENS)
+
+    first, hedge = _route(model)
+    if first is None:
+        metrics.inc("llm_failures_total", reason="breaker_open")
+        raise LLMUnavailableError("circuit open")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.LLM_DEADLINE_SECONDS
+    try:
+        await _acquire_slot(deadline)
+    except LLMUnavailableError:
+        first.breaker.cancel()
+        raise
+    params = dict(
         messages=messages,
         temperature=temperature,
         max_tokens=max_tokens,
@@ -29,6 +242,347 @@ async def ask_gpt(
         frequency_penalty=frequency_penalty,
         presence_penalty=presence_penalty,
         stop=stop,
-        stream=stream
+        stream=stream,
+        **({"tools": tools, "tool_choice": tool_choice or "auto"} if tools else {}),
+        # usage приходит последним чанком с пустым choices
+        # (в openai==1.10 ещё нет параметра stream_options)
+        **({"extra_body": {"stream_options": {"include_usage": True}}} if stream else {}),
     )
-    return response.choices[0].message.content
\ No newline at end of file
+    handed_over = False
+    try:
+        started = time.perf_counter()
+        attempt = await _hedged(first, hedge, model, params, deadline)
+        if stream:
+            # слот освободит сам поток, когда дочитается
+            handed_over = True
+            return _iter_deltas(attempt, started, deadline, model, messages)
+        response = attempt.response
+        record_usage(
+            response.usage, time.perf_counter() - started,
+            streamed=False, deployment=attempt.deployment, model=model,
+        )
+        message = response.choices[0].message
+        if tools:
+            return AssistantTurn(
+                content=message.content or "",
+                tool_calls=[
+                    ToolCall(c.id, c.function.name, c.function.arguments)
+                    for c in message.tool_calls or []
+                ],
+            )
+        return message.content
+    finally:
+        if not handed_over:
+            _release_slot()
+
+
+def _route(model: str) -> Tuple[Optional[Deployment], Optional[Deployment]]:
+    """
+    (deployment to call first, deployment to hedge to). Only the main model
+    has a secondary; if the primary's breaker is open the secondary is
+    called directly.
+    """
+    if small is not None and model == small.model:
+        return (small, None) if small.breaker.allow() else (None, None)
+    hedge = secondary if model == primary.model else None
+    if primary.breaker.allow():
+        return primary, hedge
+    if hedge is not None and hedge.breaker.allow():
+        metrics.inc("llm_hedges_total", outcome="failover")
+        return hedge, None
+    return None, None
+
+
+def _model_for(deployment: Deployment, model: str) -> str:
+    # у второго деплоймента может быть своё имя для той же модели
+    return deployment.model if model == primary.model else model
+
+
+async def _hedged(first: Deployment, hedge: Optional[Deployment], model: str, params: Dict[str, Any], deadline: float) -> _Attempt:
+    stream = params["stream"]
+    tasks: Dict[asyncio.Task, Deployment] = {
+        asyncio.create_task(_attempt(first, model, params, deadline)): first,
+    }
+    errors: List[BaseException] = []
+    try:
+        delay = first.hedge_delay(stream) if hedge is not None else None
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and hedge is not None:
+            # под перегрузкой хедж только удвоил бы нагрузку
+            if _in_flight <= settings.LLM_MAX_IN_FLIGHT // 2 and hedge.breaker.allow():
+                metrics.inc("llm_hedges_total", outcome="sent")
+                tasks[asyncio.create_task(_attempt(hedge, model, params, deadline))] = hedge
+            hedge = None
+
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            winner: Optional[_Attempt] = None
+            for task in done:
+                tasks.pop(task)
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    # оба ответили одновременно — второй поток просто закрываем
+                    await _close(task.result())
+            if winner is not None:
+                if winner.deployment is not first:
+                    metrics.inc("llm_hedges_total", outcome="won")
+                return winner
+            # основной упал раньше, чем пришло время хеджа — сразу пробуем второй
+            if not tasks and hedge is not None and _failover_worthy(errors[-1]) and hedge.breaker.allow():
+                metrics.inc("llm_hedges_total", outcome="failover")
+                tasks[asyncio.create_task(_attempt(hedge, model, params, deadline))] = hedge
+                hedge = None
+        raise errors[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            # проигравший снимается: его stream закрывается в _attempt
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _attempt(deployment: Deployment, model: str, params: Dict[str, Any], deadline: float) -> _Attempt:
+    started = time.perf_counter()
+    response = await _create_with_retries(deployment, deadline, model=_model_for(deployment, model), **params)
+    if not params["stream"]:
+        deployment.record_latency(time.perf_counter() - started, stream=False)
+        return _Attempt(deployment, response)
+
+    # для стрима «ответил» = пришёл первый токен (текст или вызов инструмента): дочитываем до него
+    loop = asyncio.get_running_loop()
+    chunks = response.__aiter__()
+    buffered = []
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - loop.time(), 0))
+            except StopAsyncIteration:
+                break
+            buffered.append(chunk)
+            if chunk.choices and (chunk.choices[0].delta.content or chunk.choices[0].delta.tool_calls):
+                break
+    except asyncio.TimeoutError:
+        await response.close()
+        deployment.breaker.record_failure()
+        metrics.inc("llm_failures_total", reason="deadline")
+        raise LLMUnavailableError("deadline exceeded")
+    except BaseException:
+        await response.close()
+        raise
+    deployment.record_latency(time.perf_counter() - started, stream=True)
+    return _Attempt(deployment, response, chunks, buffered)
+
+
+async def _close(attempt: _Attempt) -> None:
+    if attempt.chunks is not None:
+        await attempt.response.close()
+
+
+def _failover_worthy(err: BaseException) -> bool:
+    return isinstance(err, LLMUnavailableError) or (
+        isinstance(err, OpenAIError) and _retry_reason(err) is not None
+    )
+
+
+async def _acquire_slot(deadline: float) -> None:
+    global _in_flight
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    wait = min(settings.LLM_QUEUE_TIMEOUT_SECONDS, deadline - started)
+    try:
+        await asyncio.wait_for(_slots.acquire(), timeout=max(wait, 0))
+    except asyncio.TimeoutError:
+        # все слоты заняты — это перегрузка у нас, а не отказ Azure
+        metrics.inc("llm_failures_total", reason="queue_timeout")
+        raise LLMUnavailableError("too many requests in flight")
+    metrics.observe("llm_queue_wait_seconds", loop.time() - started)
+    _in_flight += 1
+    metrics.set("llm_in_flight", _in_flight)
+
+
+def _release_slot() -> None:
+    global _in_flight
+    _in_flight -= 1
+    metrics.set("llm_in_flight", _in_flight)
+    _slots.release()
+
+
+def _retry_reason(err: Exception) -> Optional[str]:
+    """Reason label if `err` is worth retrying, else None."""
+    if isinstance(err, APIStatusError):
+        if err.status_code == 429:
+            return "429"
+        if err.status_code >= 500:
+            return "5xx"
+        return None
+    if isinstance(err, APIConnectionError):  # включая APITimeoutError
+        return "connection"
+    return None
+
+
+async def _create_with_retries(deployment: Deployment, deadline: float, **params):
+    loop = asyncio.get_running_loop()
+    breaker = deployment.breaker
+    attempt = 0
+    while True:
+        remaining = deadline - loop.time()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            response = await asyncio.wait_for(
+                deployment.client.chat.completions.create(**params), timeout=remaining
+            )
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            metrics.inc("llm_failures_total", reason="deadline")
+            raise LLMUnavailableError("deadline exceeded")
+        except asyncio.CancelledError:
+            breaker.cancel()
+            raise
+        except OpenAIError as err:
+            reason = _retry_reason(err)
+            if reason is None:
+                # 400/401/404, content filter и т.п. — сервис отвечает, повтор не поможет
+                breaker.record_success()
+                metrics.inc("llm_failures_total", reason="client_error")
+                raise
+            retry_after = parse_retry_after(err.response.headers) if isinstance(err, APIStatusError) else None
+            delay = backoff_delay(
+                attempt,
+                settings.LLM_BACKOFF_BASE_SECONDS,
+                settings.LLM_BACKOFF_MAX_SECONDS,
+                retry_after,
+            )
+            if attempt >= settings.LLM_MAX_RETRIES or loop.time() + delay >= deadline:
+                breaker.record_failure()
+                metrics.inc("llm_failures_total", reason=reason)
+                raise
+            metrics.inc("llm_retries_total", reason=reason)
+            attempt += 1
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                breaker.cancel()
+                raise
+            continue
+        breaker.record_success()
+        return response
+
+
+def record_usage(
+    usage,
+    latency: float,
+    *,
+    streamed: bool,
+    deployment: Deployment,
+    model: str,
+    estimated: bool = False,
+) -> None:
+    """Records token usage, including `cached_tokens` from prompt caching, in metrics and per user."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    cache = "hit" if cached else "miss"
+    metrics.inc("llm_usage_tokens_total", usage.prompt_tokens or 0, kind="prompt")
+    metrics.inc("llm_usage_tokens_total", cached, kind="cached")
+    metrics.inc("llm_usage_tokens_total", usage.completion_tokens or 0, kind="completion")
+    metrics.inc("llm_requests_total", cache=cache)
+    metrics.observe("llm_latency_seconds", latency, cache=cache, stream=str(streamed).lower())
+    _usage_meter.record(
+        model=_model_for(deployment, model),
+        deployment=deployment.label,
+        prompt_tokens=usage.prompt_tokens or 0,
+        completion_tokens=usage.completion_tokens or 0,
+        cached_tokens=cached,
+        latency=latency,
+        streamed=streamed,
+        estimated=estimated,
+    )
+
+
+async def _iter_deltas(
+    attempt: _Attempt, started: float, deadline: float, model: str, messages: List[dict],
+) -> AsyncIterator[Any]:
+    loop = asyncio.get_running_loop()
+    first_token_at: Optional[float] = None
+    buffered = list(attempt.buffered)
+    usage_seen = False
+    completion: List[str] = []
+    # вызовы инструментов приходят кусками: index → [id, name, arguments]
+    tool_parts: Dict[int, List[str]] = {}
+    try:
+        while True:
+            if buffered:
+                chunk = buffered.pop(0)
+            else:
+                try:
+                    chunk = await asyncio.wait_for(
+                        attempt.chunks.__anext__(), timeout=max(deadline - loop.time(), 0)
+                    )
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    attempt.deployment.breaker.record_failure()
+                    metrics.inc("llm_failures_total", reason="deadline")
+                    raise LLMUnavailableError("deadline exceeded")
+            # Azure шлёт служебные чанки без choices (результаты content filter)
+            # и финальный чанк с usage
+            if not chunk.choices:
+                usage = getattr(chunk, "usage", None)
+                if isinstance(usage, dict):
+                    usage = _Usage(usage)
+                if usage is not None:
+                    usage_seen = True
+                    record_usage(
+                        usage, (first_token_at or time.perf_counter()) - started,
+                        streamed=True, deployment=attempt.deployment, model=model,
+                    )
+                continue
+            choice_delta = chunk.choices[0].delta
+            for part in choice_delta.tool_calls or []:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                acc = tool_parts.setdefault(part.index, ["", "", ""])
+                acc[0] = part.id or acc[0]
+                if part.function is not None:
+                    acc[1] += part.function.name or ""
+                    acc[2] += part.function.arguments or ""
+            delta = choice_delta.content
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                completion.append(delta)
+                yield delta
+        if tool_parts:
+            yield [ToolCall(*tool_parts[i]) for i in sorted(tool_parts)]
+    finally:
+        await attempt.response.close()
+        _release_slot()
+        if not usage_seen and (completion or tool_parts):
+            # деплоймент не прислал usage (или поток оборван) — считаем сами, чтобы квота не «протекала»
+            completion_tokens = count_tokens("".join(completion)) + sum(
+                count_tokens(part[2]) for part in tool_parts.values()
+            )
+            record_usage(
+                _Usage({"prompt_tokens": count_message_tokens(messages), "completion_tokens": completion_tokens}),
+                (first_token_at or time.perf_counter()) - started,
+                streamed=True, deployment=attempt.deployment, model=model, estimated=True,
+            )
+
+
+class _Usage:
+    """usage чанка стрима: openai==1.10 не знает этого поля и отдаёт его словарём."""
+
+    def __init__(self, data: dict) -> None:
+        self.prompt_tokens = data.get("prompt_tokens")
+        self.completion_tokens = data.get("completion_tokens")
+        self.prompt_tokens_details = _CachedTokens((data.get("prompt_tokens_details") or {}).get("cached_tokens"))
+
+
+class _CachedTokens:
+    def __init__(self, cached_tokens: Optional[int]) -> None:
+        self.cached_tokens = cached_tokens
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.utils.tokens import TOKENS_PER_MESSAGE, TOKENS_PER_REPLY, count_tokens
+
+metrics.describe("llm_prompt_tokens", "Prompt tokens per request after budgeting, by part")
+metrics.describe("llm_prompt_history_trimmed_total", "History messages dropped to fit the prompt budget")
+metrics.describe("llm_prompt_calendar_compressed_total", "Prompts whose calendar context was compressed")
+
+DAY_SEPARATOR = "\n\n---\n\n"
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+RECALL_HEADER = "Earlier messages of this chat that may be relevant:\n"
+
+
+@dataclass
+class AssembledPrompt:
+    messages: List[dict]
+    system_tokens: int
+    summary_tokens: int
+    context_tokens: int
+    calendar_tokens: int
+    history_tokens: int
+    recall_tokens: int
+    user_tokens: int
+    history_dropped: int = 0
+    calendar_compressed: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return (
+            self.system_tokens + self.summary_tokens + self.context_tokens + self.calendar_tokens
+            + self.history_tokens + self.recall_tokens + self.user_tokens
+            + TOKENS_PER_MESSAGE * len(self.messages) + TOKENS_PER_REPLY
+        )
+
+
+def compress_calendar_context(context: str) -> str:
+    """
+    Оставляет от вывода format_events_for_ai только даты и строки «• HH:MM-HH:MM  title»:
+    без строки часового пояса, заголовков «Уже прошло/Ещё впереди» и пустых строк.
+    """
+    days = []
+    for block in context.strip().split(DAY_SEPARATOR):
+        lines = [line for line in block.splitlines() if line.strip()]
+        if not lines:
+            continue
+        header, events = lines[0], [line for line in lines[1:] if line.startswith("•")]
+        days.append("\n".join([header, *events]) if events else f"{header}: —")
+    return "\n".join(days) + "\n"
+
+
+def _truncate_lines(text: str, budget: int) -> str:
+    """Drops trailing lines until `text` fits `budget` tokens."""
+    lines = text.rstrip("\n").splitlines()
+    while lines and count_tokens("\n".join(lines) + "\n…") > budget:
+        lines.pop()
+    return "\n".join(lines) + "\n…" if lines else ""
+
+
+class PromptAssembler:
+    """
+    Собирает system + история + сообщение пользователя в заданный бюджет токенов.
+
+    Layout: static system prefix, the running conversation summary, history,
+    one system message with the date line, recalled older messages and
+    calendar context, then the user message. Everything up to the history is identical between turns of a
+    chat, so provider-side prompt caching can reuse it.
+
+    The prefix, summary, date line and user message are always kept. Recalled
+    messages get at most a quarter of what is left. If the rest does not fit,
+    the oldest history is dropped first, then the calendar context is
+    compressed to titles and times, and finally cut by lines.
+    """
+
+    def __init__(self, budget: int = settings.PROMPT_TOKEN_BUDGET) -> None:
+        self.budget = budget
+
+    def assemble(
+        self,
+        system: str,
+        calendar_context: str,
+        history: List[dict],
+        user_message: str,
+        today_line: str = "",
+        summary: str = "",
+        recall: str = "",
+    ) -> AssembledPrompt:
+        system_tokens = count_tokens(system)
+        if summary:
+            summary = SUMMARY_HEADER + summary
+        summary_tokens = count_tokens(summary)
+        context_tokens = count_tokens(today_line)
+        user_tokens = count_tokens(user_message)
+        calendar = calendar_context
+        calendar_tokens = count_tokens(calendar)
+        history = list(history)
+        history_costs = [count_tokens(m["content"]) + TOKENS_PER_MESSAGE for m in history]
+
+        fixed = (
+            system_tokens + summary_tokens + context_tokens + user_tokens
+            + (4 if summary else 3) * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY
+        )
+        available = self.budget - fixed
+
+        # найденное в старой истории — не больше четверти оставшегося бюджета
+        if recall:
+            recall = RECALL_HEADER + recall
+            room = max(available // 4, 0)
+            if count_tokens(recall) > room:
+                recall = _truncate_lines(recall, room)
+                recall = recall + "\n" if recall else ""
+        recall_tokens = count_tokens(recall)
+        available -= recall_tokens
+
+        compressed = False
+        if calendar and calendar_tokens > available:
+            # даже без истории календарь не влезает
+            calendar = compress_calendar_context(calendar)
+            calendar_tokens = count_tokens(calendar)
+            compressed = True
+            if calendar_tokens > available:
+                calendar = _truncate_lines(calendar, max(available, 0))
+                calendar_tokens = count_tokens(calendar)
+
+        # самые старые сообщения отбрасываются первыми
+        keep, room = 0, available - calendar_tokens
+        for cost in reversed(history_costs):
+            if cost > room:
+                break
+            room -= cost
+            keep += 1
+        dropped = len(history) - keep
+        history, history_costs = history[dropped:], history_costs[dropped:]
+
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        messages += history
+        if today_line or recall or calendar:
+            messages.append({"role": "system", "content": today_line + recall + calendar})
+        messages.append({"role": "user", "content": user_message})
+        prompt = AssembledPrompt(
+            messages=messages,
+            system_tokens=system_tokens,
+            summary_tokens=summary_tokens,
+            context_tokens=context_tokens,
+            calendar_tokens=calendar_tokens,
+            history_tokens=sum(history_costs) - TOKENS_PER_MESSAGE * len(history),
+            recall_tokens=recall_tokens,
+            user_tokens=user_tokens,
+            history_dropped=dropped,
+            calendar_compressed=compressed,
+        )
+        self._record(prompt)
+        return prompt
+
+    @staticmethod
+    def _record(prompt: AssembledPrompt) -> None:
+        metrics.observe("llm_prompt_tokens", prompt.system_tokens, part="system")
+        metrics.observe("llm_prompt_tokens", prompt.summary_tokens, part="summary")
+        metrics.observe("llm_prompt_tokens", prompt.context_tokens, part="date")
+        metrics.observe("llm_prompt_tokens", prompt.calendar_tokens, part="calendar")
+        metrics.observe("llm_prompt_tokens", prompt.history_tokens, part="history")
+        metrics.observe("llm_prompt_tokens", prompt.recall_tokens, part="recall")
+        metrics.observe("llm_prompt_tokens", prompt.user_tokens, part="user")
+        metrics.observe("llm_prompt_tokens", prompt.total_tokens, part="total")
+        if prompt.history_dropped:
+            metrics.inc("llm_prompt_history_trimmed_total", prompt.history_dropped)
+        if prompt.calendar_compressed:
+            metrics.inc("llm_prompt_calendar_compressed_total")
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import re
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.metrics import metrics
+from app.models import ChatMessage, ChatRecallIndex
+from app.services.chat_archive import chat_archive
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("memory_recall_seconds", "Time to rank a chat's history for a message (BM25, in memory)")
+metrics.describe("memory_recall_hits_total", "Past messages added to prompts by long-term recall")
+metrics.describe("memory_recall_saves_total", "Recall indexes persisted to chat_recall_indexes, by outcome")
+
+# Стандартные параметры BM25
+_K1 = 1.2
+_B = 0.75
+# Термы, которые есть больше чем в каждом десятом сообщении, почти ничего не весят,
+# а списки у них самые длинные — при поиске их пропускаем
+_MAX_DF = 0.1
+# Новых кандидатов дают только столько самых редких термов запроса,
+# каждый — из стольких своих последних вхождений
+_MAX_SCANNED = 4
+_SCAN_WINDOW = 1024
+# Сколько лучших кандидатов досчитывается по остальным вхождениям
+_MAX_PROBE = 256
+# Грубый стемминг: «встреча/встречу/встречи», «meeting/meetings» сводятся к префиксу
+_STEM = 6
+_FORMAT = 1
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset("""
+    и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+    вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас
+    нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+    чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+    совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+    наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве три
+    эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+    всю между это мне меня мой моя мои моего моей моих твой твоя твои твоего твоей тебе
+    a an the and or but if then so of to in on at by for with from as is are was were be been being it
+    its this that these those i me my we our you your he she him her they them their what which who
+    whom do does did have has had not no yes can could will would should just about into over up down
+    out there here when where why how all any some more most other such only own same too very s t
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Index terms of a text: lower-cased words without stop words, cut to a common prefix."""
+    terms = []
+    for word in _WORD.findall(text.lower().replace("ё", "е")):
+        if len(word) < 2 or word in _STOPWORDS:
+            continue
+        terms.append(word[:_STEM] if word.isalpha() else word)
+    return terms
+
+
+class _ChatIndex:
+    """
+    BM25-индекс одного чата. Сообщения нумеруются по порядку добавления
+    (ordinal); id сообщений растут, поэтому doc_ids отсортирован и
+    «сообщения старше X» — это префикс массивов. Постинги терма — два
+    параллельных array: ordinals и частоты, без объектов на каждое вхождение.
+    """
+
+    def __init__(self) -> None:
+        self.doc_ids = array("I")
+        self.doc_lens = array("H")
+        self.total_len = 0
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.unsaved = 0
+        self.lock = threading.Lock()
+
+    @property
+    def last_id(self) -> int:
+        return self.doc_ids[-1] if self.doc_ids else 0
+
+    @property
+    def size(self) -> int:
+        """Approximate memory footprint in bytes."""
+        postings = sum(len(ords) for ords, _ in self.postings.values())
+        return 6 * len(self.doc_ids) + 6 * postings + 120 * len(self.postings)
+
+    def add(self, message_id: int, content: str) -> None:
+        terms = tokenize(content)
+        ordinal = len(self.doc_ids)
+        self.doc_ids.append(message_id)
+        self.doc_lens.append(min(len(terms), 0xFFFF))
+        self.total_len += self.doc_lens[-1]
+        for term, tf in Counter(terms).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array("I"), array("H"))
+            posting[0].append(ordinal)
+            posting[1].append(min(tf, 0xFFFF))
+        self.unsaved += 1
+
+    def top(self, terms: List[str], k: int, below_id: Optional[int], min_score: float) -> List[Tuple[float, int]]:
+        """(score, message_id) of the best `k` messages older than `below_id`."""
+        n = len(self.doc_ids)
+        if not n:
+            return []
+        limit = bisect_left(self.doc_ids, below_id) if below_id is not None else n
+        # знаменатель BM25 без tf: norm0 + norm1 * длина сообщения
+        norm0, norm1 = _K1 * (1 - _B), _K1 * _B / (self.total_len / n or 1.0)
+        lens = self.doc_lens
+
+        postings = sorted(
+            (self.postings[t] for t in set(terms) if t in self.postings), key=lambda p: len(p[0])
+        )
+        scores: Dict[int, float] = {}
+        probe: Optional[List[int]] = None
+        # От редких термов к частым. Кандидатов дают только _MAX_SCANNED самых
+        # редких термов, и только из последних _SCAN_WINDOW своих вхождений;
+        # для остального частые термы лишь досчитывают лучших кандидатов
+        # двоичным поиском — так время не растёт с длиной истории.
+        for position, (ords, tfs) in enumerate(postings):
+            df = len(ords)
+            if df > _MAX_DF * n and n >= 20:
+                break
+            weight = math.log(1 + (n - df + 0.5) / (df + 0.5)) * (_K1 + 1)
+            end = bisect_left(ords, limit)
+            start = max(0, end - _SCAN_WINDOW) if position < _MAX_SCANNED else end
+            if start:
+                if probe is None:
+                    probe = heapq.nlargest(_MAX_PROBE, scores, key=scores.__getitem__)
+                first = ords[start] if start < end else limit
+                for ordinal in probe:
+                    if ordinal >= first:
+                        continue
+                    at = bisect_left(ords, ordinal, 0, start)
+                    if at < start and ords[at] == ordinal:
+                        tf = tfs[at]
+                        scores[ordinal] += weight * tf / (tf + norm0 + norm1 * lens[ordinal])
+            for ordinal, tf in zip(islice(ords, start, end), islice(tfs, start, end)):
+                scores[ordinal] = scores.get(ordinal, 0.0) + weight * tf / (tf + norm0 + norm1 * lens[ordinal])
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self.doc_ids[ordinal]) for ordinal, score in best if score >= min_score]
+
+    # ───────────────── хранение ─────────────────
+    def dumps(self) -> bytes:
+        """
+        Compact binary form: a JSON header with the terms and their document
+        frequencies, then the raw arrays, all zlib-compressed.
+        """
+        terms = list(self.postings)
+        header = json.dumps({
+            "v": _FORMAT,
+            "total": self.total_len,
+            "terms": terms,
+            "df": [len(self.postings[t][0]) for t in terms],
+        }, ensure_ascii=False).encode()
+        parts = [struct.pack("<II", len(header), len(self.doc_ids)), header]
+        parts += [_le(self.doc_ids), _le(self.doc_lens)]
+        for term in terms:
+            ords, tfs = self.postings[term]
+            parts += [_le(ords), _le(tfs)]
+        return zlib.compress(b"".join(parts), 6)
+
+    @classmethod
+    def loads(cls, blob: bytes) -> "_ChatIndex":
+        raw = memoryview(zlib.decompress(blob))
+        header_len, n = struct.unpack_from("<II", raw)
+        pos = 8 + header_len
+        header = json.loads(bytes(raw[8:pos]))
+        if header["v"] != _FORMAT:
+            raise ValueError(f"unknown recall index format {header['v']}")
+
+        def take(typecode: str, count: int) -> array:
+            nonlocal pos
+            values = array(typecode)
+            size = values.itemsize * count
+            values.frombytes(raw[pos:pos + size])
+            if values.itemsize > 1 and _BIG_ENDIAN:
+                values.byteswap()
+            pos += size
+            return values
+
+        index = cls()
+        index.doc_ids = take("I", n)
+        index.doc_lens = take("H", n)
+        index.total_len = header["total"]
+        for term, df in zip(header["terms"], header["df"]):
+            index.postings[term] = (take("I", df), take("H", df))
+        return index
+
+
+_BIG_ENDIAN = array("H", [1]).tobytes()[0] == 0
+
+
+def _le(values: array) -> bytes:
+    """Array bytes in little-endian order, whatever the host."""
+    if _BIG_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+@dataclass
+class Recalled:
+    message_id: int
+    role: str
+    content: str
+    created_at: datetime
+    score: float
+
+
+class ChatRecall:
+    """
+    Долгая память чата: BM25 по всей истории, без внешних сервисов.
+
+    Each chat has a compact in-memory index (see `_ChatIndex`), kept in an
+    LRU bounded by chats and bytes. On a miss it is loaded from
+    chat_recall_indexes. Every lookup first indexes the messages that arrived
+    since (id > last indexed id), so the index follows the history without
+    hooks in the write path. A long history is indexed RECALL_BUILD_BATCH
+    messages per turn. Once RECALL_SAVE_EVERY messages are unsaved, the index
+    is written back in the background.
+
+    The newest MEMORY_HISTORY_MESSAGES (+ the current one) are left out:
+    they are already in the prompt as history.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = settings.RECALL_ENABLED,
+        top_k: int = settings.RECALL_TOP_K,
+        min_score: float = settings.RECALL_MIN_SCORE,
+        snippet_chars: int = settings.RECALL_SNIPPET_CHARS,
+        recent_messages: int = settings.MEMORY_HISTORY_MESSAGES + 1,
+        max_chats: int = settings.RECALL_MAX_CHATS,
+        max_bytes: int = settings.RECALL_MAX_BYTES,
+        build_batch: int = settings.RECALL_BUILD_BATCH,
+        save_every: int = settings.RECALL_SAVE_EVERY,
+    ) -> None:
+        self.enabled = enabled
+        self.top_k = top_k
+        self.min_score = min_score
+        self.snippet_chars = snippet_chars
+        self.recent_messages = recent_messages
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.build_batch = build_batch
+        self.save_every = save_every
+        # chat_id → (индекс, его размер на момент учёта)
+        self._indexes: "OrderedDict[int, Tuple[_ChatIndex, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._saving: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    # ───────────────── путь запроса ─────────────────
+    async def search(self, chat_id: int, message: str) -> List[Recalled]:
+        """Past messages of the chat most relevant to `message`, best first."""
+        if not self.enabled:
+            return []
+        terms = tokenize(message)
+        if not terms:
+            return []
+        hits, save = await run_in_session(self._search_in_session, chat_id, terms)
+        if save:
+            self._schedule_save(chat_id)
+        if hits:
+            metrics.inc("memory_recall_hits_total", len(hits))
+        return hits
+
+    def _search_in_session(self, db: Session, chat_id: int, terms: List[str]) -> Tuple[List[Recalled], bool]:
+        index = self._get(db, chat_id)
+        with index.lock:
+            complete = self._catch_up(db, chat_id, index)
+            started = time.perf_counter()
+            if complete:
+                if len(index.doc_ids) <= self.recent_messages:
+                    ranked = []
+                else:
+                    ranked = index.top(
+                        terms, self.top_k, index.doc_ids[-self.recent_messages], self.min_score,
+                    )
+            else:
+                # индекс ещё догоняет длинную историю — всё проиндексированное
+                # заведомо старше сообщений, которые уже идут в промпт
+                ranked = index.top(terms, self.top_k, None, self.min_score)
+            metrics.observe("memory_recall_seconds", time.perf_counter() - started)
+            save = index.unsaved >= self.save_every
+        self._account(chat_id, index)
+        if not ranked:
+            return [], save
+
+        ids = [i for _, i in ranked]
+        rows = {
+            row.id: row
+            for row in db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)
+            .filter(ChatMessage.chat_id == chat_id, ChatMessage.id.in_(ids))
+        }
+        if len(rows) < len(ids):
+            # старые сообщения могли уйти в холодный архив
+            rows.update(chat_archive.read_ids(db, chat_id, [i for i in ids if i not in rows]))
+        hits = [
+            Recalled(message_id, rows[message_id].role, self._snippet(rows[message_id].content),
+                     rows[message_id].created_at, score)
+            for score, message_id in ranked
+            if message_id in rows
+        ]
+        return hits, save
+
+    def _snippet(self, content: str) -> str:
+        content = " ".join(content.split())
+        if len(content) <= self.snippet_chars:
+            return content
+        return content[:self.snippet_chars].rsplit(" ", 1)[0] + "…"
+
+    def _catch_up(self, db: Session, chat_id: int, index: _ChatIndex) -> bool:
+        """Indexes messages newer than the index; False if more are left for later turns."""
+        if not index.doc_ids:
+            # новый индекс: сначала то, что уже ушло в холодный архив
+            for message_id, _, content, _, _ in chat_archive.all_rows(db, chat_id):
+                index.add(message_id, content)
+        rows = (
+            db.query(ChatMessage.id, ChatMessage.content)
+            .filter(ChatMessage.chat_id == chat_id, ChatMessage.id > index.last_id)
+            .order_by(ChatMessage.id)
+            .limit(self.build_batch)
+            .all()
+        )
+        for message_id, content in rows:
+            index.add(message_id, content)
+        return len(rows) < self.build_batch
+
+    # ───────────────── LRU ─────────────────
+    def _get(self, db: Session, chat_id: int) -> _ChatIndex:
+        with self._lock:
+            cached = self._indexes.get(chat_id)
+            if cached is not None:
+                self._indexes.move_to_end(chat_id)
+                return cached[0]
+
+        index = _ChatIndex()
+        blob = db.query(ChatRecallIndex.data).filter(ChatRecallIndex.chat_id == chat_id).scalar()
+        if blob is not None:
+            try:
+                index = _ChatIndex.loads(blob)
+            except Exception as e:
+                # повреждённый или старый формат — соберём заново
+                logger.warning("Discarding recall index of chat %s: %s", chat_id, e)
+
+        with self._lock:
+            # другой поток мог успеть загрузить тот же чат
+            cached = self._indexes.setdefault(chat_id, (index, 0))
+            self._indexes.move_to_end(chat_id)
+            return cached[0]
+
+    def _account(self, chat_id: int, index: _ChatIndex) -> None:
+        size = index.size
+        with self._lock:
+            cached = self._indexes.get(chat_id)
+            if cached is None or cached[0] is not index:
+                return
+            self._bytes += size - cached[1]
+            self._indexes[chat_id] = (index, size)
+            while self._indexes and (len(self._indexes) > self.max_chats or self._bytes > self.max_bytes):
+                # несохранённые сообщения не теряются: их снова проиндексируют из БД
+                _, (_, evicted) = self._indexes.popitem(last=False)
+                self._bytes -= evicted
+
+    # ───────────────── сохранение ─────────────────
+    def _schedule_save(self, chat_id: int) -> None:
+        with self._lock:
+            if chat_id in self._saving:
+                return
+            self._saving.add(chat_id)
+        try:
+            task = asyncio.get_running_loop().create_task(self._run_save(chat_id))
+        except RuntimeError:
+            with self._lock:
+                self._saving.discard(chat_id)
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_save(self, chat_id: int) -> None:
+        try:
+            outcome = await run_in_session(self.save, chat_id)
+            metrics.inc("memory_recall_saves_total", outcome=outcome)
+        except Exception as e:
+            metrics.inc("memory_recall_saves_total", outcome="error")
+            logger.warning("Saving recall index of chat %s failed: %s", chat_id, e)
+        finally:
+            with self._lock:
+                self._saving.discard(chat_id)
+
+    def save(self, db: Session, chat_id: int) -> str:
+        """Writes the chat's index to chat_recall_indexes. Returns "saved" or "skipped"."""
+        with self._lock:
+            cached = self._indexes.get(chat_id)
+        if cached is None:
+            return "skipped"
+        index = cached[0]
+        with index.lock:
+            blob, last_id, unsaved = index.dumps(), index.last_id, index.unsaved
+
+        row = db.query(ChatRecallIndex).filter(ChatRecallIndex.chat_id == chat_id).one_or_none()
+        if row is None:
+            db.add(ChatRecallIndex(chat_id=chat_id, last_message_id=last_id, data=blob))
+        elif row.last_message_id >= last_id:
+            # другой воркер уже сохранил индекс не хуже
+            return "skipped"
+        else:
+            row.last_message_id = last_id
+            row.data = blob
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return "skipped"
+        with index.lock:
+            index.unsaved -= unsaved
+        return "saved"
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"chats": len(self._indexes), "bytes": self._bytes}
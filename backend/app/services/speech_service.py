@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("speech_token_requests_total", "GET /api/speech/token, by cache outcome")
+metrics.describe("speech_sts_requests_total", "Calls to the Azure Speech STS, by outcome")
+metrics.describe("speech_sts_latency_seconds", "Azure Speech STS latency")
+
+# Повтор фонового обновления после ошибки, пока текущий токен ещё годен
+_RETRY_SECONDS = 10.0
+
+
+class SpeechTokenError(Exception):
+    """The STS did not issue a token; `status_code` is what the endpoint should answer."""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class SpeechToken:
+    value: str
+    fetched_at: float  # monotonic
+    expires_at: int    # unix time, для клиента
+
+
+class SpeechTokenProvider:
+    """
+    Токены Azure Speech, общие для всех пользователей региона.
+
+    A token is kept in memory for `ttl` seconds. After `refresh_after`
+    seconds a background task fetches the next one while the current one
+    is still served, so requests almost never wait for the STS. The task
+    keeps refreshing only while the region's token is being asked for.
+    Concurrent misses share one STS call (single flight). Calls go through
+    one pooled async HTTP client.
+    """
+
+    def __init__(
+        self,
+        key: str = settings.AZURE_SPEECH_KEY,
+        url: str = settings.SPEECH_STS_URL,
+        ttl: float = settings.SPEECH_TOKEN_TTL_SECONDS,
+        refresh_after: float = settings.SPEECH_TOKEN_REFRESH_SECONDS,
+        timeout: float = settings.SPEECH_STS_TIMEOUT_SECONDS,
+    ) -> None:
+        self.key = key
+        self.url = url
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.timeout = timeout
+        self._http: Optional[httpx.AsyncClient] = None
+        self._tokens: Dict[str, SpeechToken] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._refreshers: Dict[str, asyncio.Task] = {}
+        # регионы, чей токен запрашивали после последнего обновления
+        self._used: Set[str] = set()
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._http
+
+    async def get(self, region: str) -> SpeechToken:
+        self._used.add(region)
+        token = self._tokens.get(region)
+        if token is not None:
+            age = time.monotonic() - token.fetched_at
+            if age < self.ttl:
+                if age >= self.refresh_after and region not in self._refreshers:
+                    # фоновое обновление не запущено (или отстало) — запускаем, не дожидаясь
+                    self._fetch_once(region)
+                metrics.inc("speech_token_requests_total", outcome="hit")
+                return token
+        metrics.inc("speech_token_requests_total", outcome="miss")
+        # shield: отменённый запрос не отменяет общий для всех вызов STS
+        return await asyncio.shield(self._fetch_once(region))
+
+    def _fetch_once(self, region: str) -> asyncio.Task:
+        task = self._inflight.get(region)
+        if task is None:
+            task = asyncio.create_task(self._fetch(region))
+            self._inflight[region] = task
+            task.add_done_callback(lambda t: self._fetched(region, t))
+        return task
+
+    def _fetched(self, region: str, task: asyncio.Task) -> None:
+        if self._inflight.get(region) is task:
+            del self._inflight[region]
+        if not task.cancelled() and task.exception() is None and region not in self._refreshers:
+            self._refreshers[region] = asyncio.create_task(self._refresh(region))
+
+    async def _fetch(self, region: str) -> SpeechToken:
+        started = time.perf_counter()
+        try:
+            resp = await self._client().post(
+                self.url.format(region=region),
+                headers={"Ocp-Apim-Subscription-Key": self.key},
+            )
+        except httpx.TimeoutException:
+            metrics.inc("speech_sts_requests_total", outcome="timeout")
+            raise SpeechTokenError(504, "Azure STS timeout")
+        except httpx.HTTPError as e:
+            metrics.inc("speech_sts_requests_total", outcome="error")
+            raise SpeechTokenError(502, f"Azure STS unavailable ({type(e).__name__})")
+        metrics.observe("speech_sts_latency_seconds", time.perf_counter() - started)
+        if resp.status_code != 200:
+            metrics.inc("speech_sts_requests_total", outcome="error")
+            raise SpeechTokenError(502, f"Azure STS error ({resp.status_code})")
+
+        metrics.inc("speech_sts_requests_total", outcome="ok")
+        token = SpeechToken(resp.text, time.monotonic(), int(time.time() + self.ttl))
+        self._tokens[region] = token
+        self._used.discard(region)
+        return token
+
+    async def _refresh(self, region: str) -> None:
+        """Refreshes the region's token ahead of expiry while it keeps being asked for."""
+        try:
+            while True:
+                token = self._tokens[region]
+                await asyncio.sleep(max(token.fetched_at + self.refresh_after - time.monotonic(), 0))
+                if region not in self._used:
+                    # за цикл никто не спросил — не ходим в STS зря, следующий запрос получит новый
+                    return
+                try:
+                    await asyncio.shield(self._fetch_once(region))
+                except SpeechTokenError as e:
+                    logger.warning("Background refresh of the %s speech token failed: %s", region, e.detail)
+                    self._used.add(region)
+                    if time.monotonic() - token.fetched_at + _RETRY_SECONDS >= self.ttl:
+                        return
+                    await asyncio.sleep(_RETRY_SECONDS)
+        finally:
+            if self._refreshers.get(region) is asyncio.current_task():
+                del self._refreshers[region]
+
+    async def close(self) -> None:
+        tasks = list(self._refreshers.values()) + list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+speech_tokens = SpeechTokenProvider()
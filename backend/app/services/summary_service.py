@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.metrics import metrics
+from app.models import ChatMessage, ChatSummary
+from app.services.memory_service import MemoryStore
+from app.services.openai_service import ask_gpt
+from app.services.usage_service import set_purpose
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("memory_summaries_total", "Background conversation summaries, by outcome")
+metrics.describe("memory_summary_seconds", "Time to fold old turns into the running summary")
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and their calendar assistant. "
+    "Merge the previous summary with the new messages into one updated summary. "
+    "Keep facts that matter later: the user's preferences, plans, people and places mentioned, "
+    "events that were created or deleted, open questions and promises. "
+    "Drop greetings, small talk and anything the calendar itself already records in full. "
+    "Write in the language of the conversation, as short third-person notes, at most {max_tokens} tokens."
+)
+
+
+@dataclass
+class Summary:
+    content: str
+    last_message_id: int
+
+
+class ConversationSummarizer:
+    """
+    Скользящий пересказ переписки в таблице chat_summaries.
+
+    After each turn `note_turn` counts new messages in memory; once
+    MEMORY_SUMMARY_MIN_NEW of them may have piled up it schedules a
+    background task (never awaited by the request) that folds everything
+    older than the last MEMORY_RECENT_MESSAGES into the summary with one
+    LLM call. The request path only reads the summary — from a small
+    in-process cache, falling back to one lookup by chat_id.
+
+    After a fold the chat's cached history is invalidated: messages appended
+    to the cache carry no id, so only a fresh load from the database tells
+    which of them the summary already covers.
+    """
+
+    def __init__(
+        self,
+        memory: MemoryStore,
+        enabled: bool = settings.MEMORY_SUMMARY_ENABLED,
+        recent_messages: int = settings.MEMORY_RECENT_MESSAGES,
+        min_new: int = settings.MEMORY_SUMMARY_MIN_NEW,
+        max_input: int = settings.MEMORY_SUMMARY_MAX_INPUT,
+        max_tokens: int = settings.MEMORY_SUMMARY_MAX_TOKENS,
+        max_chats: int = settings.MEMORY_MAX_CHATS,
+        ttl_seconds: int = settings.MEMORY_TTL_SECONDS,
+    ) -> None:
+        self.memory = memory
+        self.enabled = enabled
+        self.recent_messages = recent_messages
+        self.min_new = min_new
+        self.max_input = max_input
+        self.max_tokens = max_tokens
+        self.max_chats = max_chats
+        self.ttl_seconds = ttl_seconds
+        # chat_id → (summary | None, loaded_at)
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        # chat_id → сообщений с последней проверки
+        self._pending: Dict[int, int] = {}
+        self._running: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    # ───────────────── чтение (путь запроса) ─────────────────
+    def _cached(self, chat_id: int) -> Optional[tuple]:
+        """(summary | None,) if the cache has a fresh entry for the chat, else None."""
+        with self._lock:
+            cached = self._cache.get(chat_id)
+            if cached is not None and time.monotonic() - cached[1] <= self.ttl_seconds:
+                self._cache.move_to_end(chat_id)
+                return (cached[0],)
+        return None
+
+    def get(self, db: Optional[Session], chat_id: int) -> Optional[Summary]:
+        if not self.enabled:
+            return None
+        cached = self._cached(chat_id)
+        if cached is not None:
+            return cached[0]
+        if db is None:
+            return None
+        row = (
+            db.query(ChatSummary.content, ChatSummary.last_message_id)
+            .filter(ChatSummary.chat_id == chat_id)
+            .one_or_none()
+        )
+        summary = Summary(row.content, row.last_message_id) if row else None
+        self._remember(chat_id, summary)
+        return summary
+
+    async def aget(self, chat_id: int) -> Optional[Summary]:
+        """`get` for the event loop: cache first, a miss is looked up in the DB thread pool."""
+        if not self.enabled:
+            return None
+        cached = self._cached(chat_id)
+        if cached is not None:
+            return cached[0]
+        return await run_in_session(self.get, chat_id)
+
+    def apply(self, summary: Optional[Summary], history: List[dict]) -> List[dict]:
+        """
+        Drops history messages already folded into `summary`. Messages
+        without an id were added after the history was loaded and are kept.
+        """
+        if summary is None:
+            return history
+        return [m for m in history if m.get("id") is None or m["id"] > summary.last_message_id]
+
+    def _remember(self, chat_id: int, summary: Optional[Summary]) -> None:
+        with self._lock:
+            self._cache[chat_id] = (summary, time.monotonic())
+            self._cache.move_to_end(chat_id)
+            while len(self._cache) > self.max_chats:
+                self._cache.popitem(last=False)
+
+    # ───────────────── планирование ─────────────────
+    def note_turn(self, chat_id: int, messages: int = 2) -> None:
+        """Called after a turn is answered; schedules a fold when it may be due."""
+        if not self.enabled:
+            return
+        with self._lock:
+            # чат ещё не встречался — проверяем сразу (после рестарта там может
+            # уже лежать длинная история)
+            pending = self._pending.get(chat_id, self.min_new) + messages
+            if pending < self.min_new or chat_id in self._running:
+                self._pending[chat_id] = pending
+                return
+            self._pending[chat_id] = 0
+            self._running.add(chat_id)
+            if len(self._pending) > self.max_chats:
+                self._pending.pop(next(iter(self._pending)))
+        try:
+            task = asyncio.get_running_loop().create_task(self._run(chat_id))
+        except RuntimeError:
+            with self._lock:
+                self._running.discard(chat_id)
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id: int) -> None:
+        # задача унаследовала пользователя хода; токены пересказа учитываем отдельной строкой
+        set_purpose("summary")
+        started = time.perf_counter()
+        try:
+            outcome = await self.summarize(chat_id)
+            metrics.inc("memory_summaries_total", outcome=outcome)
+            if outcome == "updated":
+                metrics.observe("memory_summary_seconds", time.perf_counter() - started)
+        except Exception as e:
+            metrics.inc("memory_summaries_total", outcome="error")
+            logger.warning("Conversation summary for chat %s failed: %s", chat_id, e)
+        finally:
+            with self._lock:
+                self._running.discard(chat_id)
+
+    # ───────────────── свёртка ─────────────────
+    async def summarize(self, chat_id: int, through: Optional[int] = None) -> str:
+        """
+        Folds messages older than the recent tail into the chat's summary.
+        Returns "updated" or "skipped" (not enough new messages yet, or
+        another worker folded them first). Queries run in the DB thread pool.
+
+        With `through`, folds the oldest not yet folded messages up to that
+        id instead — at most max_input of them, however few. Called round
+        after round, it works through a long backlog without skipping any.
+        """
+        previous, after, fold = await run_in_session(self._load, chat_id, through)
+        if not fold or (through is None and len(fold) < self.min_new):
+            return "skipped"
+
+        content = await self._ask(previous, fold)
+        if not content:
+            return "skipped"
+
+        last_id = fold[-1][0]
+        if not await run_in_session(self._store, chat_id, after, content, last_id):
+            return "skipped"
+        self._remember(chat_id, Summary(content, last_id))
+        await self.memory.invalidate(chat_id)
+        return "updated"
+
+    def _load(self, db: Session, chat_id: int, through: Optional[int] = None) -> Tuple[str, int, List[tuple]]:
+        """(previous summary, its last_message_id, messages to fold as (id, role, content))."""
+        current = (
+            db.query(ChatSummary.content, ChatSummary.last_message_id)
+            .filter(ChatSummary.chat_id == chat_id)
+            .one_or_none()
+        )
+        after = current.last_message_id if current else 0
+        previous = current.content if current else ""
+
+        if through is not None:
+            rows = (
+                db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+                .filter(ChatMessage.chat_id == chat_id, ChatMessage.id > after, ChatMessage.id <= through)
+                .order_by(ChatMessage.id)
+                .limit(self.max_input)
+                .all()
+            )
+            return previous, after, [tuple(row) for row in rows]
+
+        # хвост + не больше max_input сообщений до него; более старые в промпт
+        # и так не попадали, их просто считаем свёрнутыми
+        rows = (
+            db.query(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+            .filter(ChatMessage.chat_id == chat_id, ChatMessage.id > after)
+            .order_by(ChatMessage.id.desc())
+            .limit(self.max_input + self.recent_messages)
+            .all()
+        )
+        rows.reverse()
+        fold = rows[:-self.recent_messages] if self.recent_messages else rows
+        return previous, after, [tuple(row) for row in fold]
+
+    def _store(self, db: Session, chat_id: int, after: int, content: str, last_id: int) -> bool:
+        """Saves the new summary unless another worker moved it past `after` meanwhile."""
+        current = db.query(ChatSummary).filter(ChatSummary.chat_id == chat_id).one_or_none()
+        if (current.last_message_id if current else 0) != after:
+            return False
+        if current is None:
+            db.add(ChatSummary(chat_id=chat_id, content=content, last_message_id=last_id))
+        else:
+            current.content = content
+            current.last_message_id = last_id
+        try:
+            db.commit()
+        except IntegrityError:
+            # другой воркер успел первым — его резюме не хуже
+            db.rollback()
+            return False
+        return True
+
+    async def _ask(self, previous: str, rows) -> str:
+        transcript = "\n".join(f"{role}: {content}" for _id, role, content in rows)
+        user_part = (
+            f"Previous summary:\n{previous or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        reply = await ask_gpt(
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_tokens=self.max_tokens)},
+                {"role": "user", "content": user_part},
+            ],
+            temperature=0.2,
+            max_tokens=self.max_tokens,
+        )
+        return (reply or "").strip()
@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, replace
+from datetime import date, datetime
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import run_in_session
+from app.core.metrics import metrics
+from app.models import LLMUsage, LLMUsageDaily
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("llm_usage_buffered", "Usage records waiting to be written")
+metrics.describe("llm_usage_flushes_total", "Usage buffer flushes, by outcome")
+metrics.describe("llm_usage_dropped_total", "Usage records dropped because the buffer was full")
+metrics.describe("llm_quota_decisions_total", "Quota checks before a model call that did not pass as is")
+
+
+@dataclass(frozen=True)
+class Caller:
+    """Кому засчитывать вызовы модели в текущем контексте."""
+
+    user_id: Optional[int] = None
+    persona: str = ""
+    purpose: str = "chat"
+
+
+_caller: ContextVar[Caller] = ContextVar("llm_caller", default=Caller())
+
+
+def current_caller() -> Caller:
+    return _caller.get()
+
+
+def bind_caller(user_id: Optional[int], persona: str = "") -> Token:
+    """
+    Attributes model calls in this context (and in tasks created from it,
+    e.g. the background summary) to `user_id`. Undo with `unbind_caller`.
+    """
+    return _caller.set(Caller(user_id, persona or ""))
+
+
+def unbind_caller(token: Token) -> None:
+    _caller.reset(token)
+
+
+def set_purpose(purpose: str) -> None:
+    """Marks calls from the current task, e.g. "summary" in a background task."""
+    _caller.set(replace(_caller.get(), purpose=purpose))
+
+
+@dataclass
+class UsageRecord:
+    caller: Caller
+    model: str
+    deployment: str
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    latency_ms: int
+    streamed: bool
+    estimated: bool
+    created_at: datetime
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class UsageMeter:
+    """
+    Учёт токенов по пользователям + дневные квоты.
+
+    `record` only appends to an in-memory buffer; a background task writes
+    the buffer every USAGE_FLUSH_SECONDS (or as soon as it holds
+    USAGE_FLUSH_BATCH_SIZE records) in the DB thread pool: one bulk INSERT
+    into llm_usage and one increment per (day, user, persona, model) of
+    llm_usage_daily, in one transaction. The buffer is bounded; when the
+    database is down the oldest records are dropped, never the request.
+
+    `check` runs before every model call. A user's usage for today is the
+    daily rollup (cached for LLM_QUOTA_CACHE_SECONDS, reloaded after our own
+    flushes) plus what this worker has not written yet.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.USAGE_FLUSH_BATCH_SIZE,
+        flush_seconds: float = settings.USAGE_FLUSH_SECONDS,
+        max_buffer: int = settings.USAGE_MAX_BUFFER,
+        cache_seconds: float = settings.LLM_QUOTA_CACHE_SECONDS,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.cache_seconds = cache_seconds
+        self._buffer: Deque[UsageRecord] = deque()
+        # (user_id, day) → токены, ещё не записанные в БД
+        self._pending: Dict[Tuple[int, date], int] = defaultdict(int)
+        # user_id → (day, токенов в llm_usage_daily, loaded_at)
+        self._daily: Dict[int, Tuple[date, int, float]] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    # ───────────────── запись ─────────────────
+    def record(
+        self,
+        *,
+        model: str,
+        deployment: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int,
+        latency: float,
+        streamed: bool,
+        estimated: bool = False,
+    ) -> None:
+        rec = UsageRecord(
+            caller=current_caller(),
+            model=model,
+            deployment=deployment,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            latency_ms=int(latency * 1000),
+            streamed=streamed,
+            estimated=estimated,
+            created_at=datetime.utcnow(),
+        )
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._forget(self._buffer.popleft())
+                metrics.inc("llm_usage_dropped_total")
+            self._buffer.append(rec)
+            if rec.caller.user_id is not None:
+                self._pending[(rec.caller.user_id, rec.created_at.date())] += rec.tokens
+            size = len(self._buffer)
+        metrics.set("llm_usage_buffered", size)
+        self._start(flush_now=size >= self.batch_size)
+
+    def _forget(self, rec: UsageRecord) -> None:
+        """Removes a record from the pending counters (written or dropped)."""
+        if rec.caller.user_id is None:
+            return
+        key = (rec.caller.user_id, rec.created_at.date())
+        self._pending[key] -= rec.tokens
+        if self._pending[key] <= 0:
+            del self._pending[key]
+
+    def _start(self, flush_now: bool) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_periodically())
+        if flush_now:
+            task = loop.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Writes everything buffered so far; returns the number of records written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            written = 0
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    break
+                try:
+                    await run_in_session(self._write, batch)
+                except Exception as e:
+                    metrics.inc("llm_usage_flushes_total", outcome="error")
+                    logger.warning("Failed to write %d usage records: %s", len(batch), e)
+                    with self._lock:
+                        # вернём в начало очереди; лишнее сверх лимита — старейшее — выбрасываем
+                        self._buffer.extendleft(reversed(batch))
+                        while len(self._buffer) > self.max_buffer:
+                            self._forget(self._buffer.popleft())
+                            metrics.inc("llm_usage_dropped_total")
+                    break
+                metrics.inc("llm_usage_flushes_total", outcome="ok")
+                written += len(batch)
+                with self._lock:
+                    for rec in batch:
+                        self._forget(rec)
+                        # свои записи теперь в llm_usage_daily — перечитаем при следующей проверке
+                        self._daily.pop(rec.caller.user_id, None)
+            metrics.set("llm_usage_buffered", len(self._buffer))
+            return written
+
+    async def close(self) -> None:
+        """Stops the periodic flush and writes what is left (application shutdown)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    @staticmethod
+    def _write(db: Session, batch: List[UsageRecord]) -> None:
+        db.execute(
+            insert(LLMUsage),
+            [
+                {
+                    "user_id": r.caller.user_id,
+                    "persona": r.caller.persona,
+                    "purpose": r.caller.purpose,
+                    "model": r.model,
+                    "deployment": r.deployment,
+                    "prompt_tokens": r.prompt_tokens,
+                    "completion_tokens": r.completion_tokens,
+                    "cached_tokens": r.cached_tokens,
+                    "latency_ms": r.latency_ms,
+                    "streamed": r.streamed,
+                    "estimated": r.estimated,
+                    "created_at": r.created_at,
+                    "updated_at": r.created_at,
+                }
+                for r in batch
+            ],
+        )
+
+        rollups: Dict[Tuple[date, int, str, str], List[int]] = defaultdict(lambda: [0, 0, 0, 0, 0])
+        for r in batch:
+            if r.caller.user_id is None:
+                continue
+            acc = rollups[(r.created_at.date(), r.caller.user_id, r.caller.persona, r.model)]
+            acc[0] += 1
+            acc[1] += r.prompt_tokens
+            acc[2] += r.completion_tokens
+            acc[3] += r.cached_tokens
+            acc[4] += r.latency_ms
+
+        now = datetime.utcnow()
+        for (day, user_id, persona, model), (requests, prompt, completion, cached, latency) in rollups.items():
+            # UPDATE ... SET x = x + :n — без чтения, другие воркеры не теряют свои приращения
+            values = dict(
+                requests=LLMUsageDaily.requests + requests,
+                prompt_tokens=LLMUsageDaily.prompt_tokens + prompt,
+                completion_tokens=LLMUsageDaily.completion_tokens + completion,
+                cached_tokens=LLMUsageDaily.cached_tokens + cached,
+                latency_ms=LLMUsageDaily.latency_ms + latency,
+                updated_at=now,
+            )
+            key = (
+                LLMUsageDaily.day == day,
+                LLMUsageDaily.user_id == user_id,
+                LLMUsageDaily.persona == persona,
+                LLMUsageDaily.model == model,
+            )
+            if db.execute(update(LLMUsageDaily).where(*key).values(**values)).rowcount:
+                continue
+            try:
+                with db.begin_nested():
+                    db.add(LLMUsageDaily(
+                        day=day, user_id=user_id, persona=persona, model=model,
+                        requests=requests, prompt_tokens=prompt, completion_tokens=completion,
+                        cached_tokens=cached, latency_ms=latency, created_at=now, updated_at=now,
+                    ))
+            except IntegrityError:
+                # строку только что вставил другой воркер
+                db.execute(update(LLMUsageDaily).where(*key).values(**values))
+        db.commit()
+
+    # ───────────────── квоты ─────────────────
+    async def used_today(self, user_id: int) -> int:
+        today = datetime.utcnow().date()
+        with self._lock:
+            cached = self._daily.get(user_id)
+            pending = self._pending.get((user_id, today), 0)
+        if cached is None or cached[0] != today or time.monotonic() - cached[2] > self.cache_seconds:
+            total = await run_in_session(self._load_daily, user_id, today)
+            with self._lock:
+                self._daily[user_id] = (today, total, time.monotonic())
+        else:
+            total = cached[1]
+        return total + pending
+
+    @staticmethod
+    def _load_daily(db: Session, user_id: int, day: date) -> int:
+        return db.query(
+            func.coalesce(func.sum(LLMUsageDaily.prompt_tokens + LLMUsageDaily.completion_tokens), 0)
+        ).filter(LLMUsageDaily.user_id == user_id, LLMUsageDaily.day == day).scalar() or 0
+
+    async def check(self) -> str:
+        """
+        Quota decision for the current caller before a model call:
+        "ok", "downgrade" (past LLM_QUOTA_DOWNGRADE_RATIO of the quota) or
+        "block" (quota used up).
+        """
+        quota = settings.LLM_DAILY_TOKEN_QUOTA
+        user_id = current_caller().user_id
+        if not quota or user_id is None:
+            return "ok"
+        try:
+            used = await self.used_today(user_id)
+        except Exception as e:
+            # учёт недоступен — не повод отказывать пользователю
+            logger.warning("Quota check failed for user %s: %s", user_id, e)
+            return "ok"
+        if used >= quota:
+            decision = "block"
+        elif used >= quota * settings.LLM_QUOTA_DOWNGRADE_RATIO:
+            decision = "downgrade"
+        else:
+            return "ok"
+        metrics.inc("llm_quota_decisions_total", decision=decision)
+        return decision
+
+
+# Один счётчик на процесс: ask_gpt пишет, роуты/админка читают
+usage_meter = UsageMeter()
@@ -0,0 +1,112 @@
+from typing import Optional, Tuple
+
+LANGUAGE_NAMES = {
+    "ru": "Russian",
+    "en": "English",
+    "kk": "Kazakh",
+}
+
+# Ниже этого порога доверяем preferred_language пользователя, а не тексту
+MIN_CONFIDENCE = 0.6
+
+_ALIASES = {
+    "kz": "kk",
+    "russian": "ru",
+    "english": "en",
+    "kazakh": "kk",
+}
+
+_KK_LETTERS = frozenset("әғқңөұүһіӘҒҚҢӨҰҮҺІ")
+
+# Частые триграммы (включая границы слов "_"), которые хорошо разделяют
+# русский и казахский текст, написанный без специфичных казахских букв.
+_RU_TRIGRAMS = frozenset((
+    "_по", "_на", "_за", "_пр", "_не", "_чт", "что", "_эт", "это", "_вс", "_мн",
+    "ого", "его", "ать", "ть_", "ся_", "ние", "ени", "ова", "про", "ост", "сть",
+    "ешь", "ите", "ый_", "ий_", "ая_", "ое_", "ые_", "ой_", "ую_", "ём_", "ем_",
+    "ыть", "вст", "тре", "дел", "тра", "вав", "рав", "чер", "ера", "год", "час",
+    "ажи", "доб", "пож", "кал", "ни_", "ьте", "жи_", "ди_", "ля_", "ка_", "ку_",
+))
+_KK_TRIGRAMS = frozenset((
+    "лар", "лер", "дар", "дер", "тар", "тер", "ның", "нің", "дың", "дің", "мен",
+    "бен", "пен", "ға_", "ге_", "қа_", "ке_", "да_", "де_", "та_", "те_", "ды_",
+    "ді_", "ны_", "ні_", "ма_", "ме_", "ба_", "бе_", "па_", "пе_", "сыз", "сіз",
+    "_жа", "_жо", "_жү", "_бү", "_ер", "_ке", "кез", "езд", "зде", "дес", "есу",
+    "шы_", "ші_", "ым_", "ім_", "уі_", "алу", "елу", "_ба", "бар", "_қа", "_ал",
+    "сал", "қос", "жаз",
+))
+
+
+def normalize_language_code(value: Optional[str], default: str = "ru") -> str:
+    """'Russian', 'ru-RU', 'kz', … → 'ru' | 'en' | 'kk'."""
+    if not value:
+        return default
+    value = value.strip().lower()
+    value = _ALIASES.get(value, value)
+    code = _ALIASES.get(value[:2], value[:2])
+    return code if code in LANGUAGE_NAMES else default
+
+
+def _trigram_scores(text: str) -> Tuple[int, int]:
+    ru = kk = 0
+    for word in text.lower().split():
+        word = "".join(ch for ch in word if ch.isalpha())
+        if not word:
+            continue
+        padded = f"_{word}_"
+        for i in range(len(padded) - 2):
+            tri = padded[i:i + 3]
+            if tri in _RU_TRIGRAMS:
+                ru += 1
+            if tri in _KK_TRIGRAMS:
+                kk += 1
+    return ru, kk
+
+
+def detect_language_scored(text: str) -> Tuple[Optional[str], float]:
+    """
+    Определяет язык по диапазонам алфавитов и триграммам.
+
+    Returns (code, confidence) where confidence is in [0, 1]; code is None
+    when the text has no letters at all.
+    """
+    latin = cyrillic = kk_letters = 0
+    for ch in text:
+        if "a" <= ch <= "z" or "A" <= ch <= "Z":
+            latin += 1
+        elif "Ѐ" <= ch <= "ӿ":
+            cyrillic += 1
+            if ch in _KK_LETTERS:
+                kk_letters += 1
+
+    letters = latin + cyrillic
+    if not letters:
+        return None, 0.0
+    # короткие реплики («ok», «да») — слабый сигнал
+    length_factor = min(1.0, letters / 12)
+
+    if latin > cyrillic:
+        return "en", (latin / letters) * max(length_factor, 0.5 if latin >= 4 else 0.0)
+
+    share = cyrillic / letters
+    if kk_letters:
+        return "kk", min(1.0, 0.7 + 0.15 * kk_letters) * share
+
+    ru, kk = _trigram_scores(text)
+    if kk > ru:
+        return "kk", share * length_factor * (kk - ru) / (kk + ru)
+    if ru == kk:
+        # одни «нейтральные» кириллические слова — скорее русский, но неуверенно
+        return "ru", share * length_factor * 0.5
+    return "ru", share * max(length_factor, 0.7) * (0.6 + 0.4 * (ru - kk) / (ru + kk))
+
+
+def detect_language(text: str, fallback: Optional[str] = None) -> str:
+    """
+    Language code of `text`, falling back to `fallback` (usually the user's
+    preferred_language) when detection is not confident enough.
+    """
+    code, confidence = detect_language_scored(text)
+    if code is None or confidence < MIN_CONFIDENCE:
+        return normalize_language_code(fallback, default=code or "ru")
+    return code
@@ -0,0 +1,225 @@
+import re
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Callable, List, Optional, Tuple
+
+# ───────────────── словари ─────────────────
+
+_WEEKDAYS = {
+    # en
+    "monday": 0, "mon": 0, "tuesday": 1, "tue": 1, "tues": 1, "wednesday": 2,
+    "thursday": 3, "thu": 3, "thurs": 3, "friday": 4, "fri": 4, "saturday": 5, "sunday": 6,
+}
+# ru и kk — только настоящие падежные формы: по префиксу «средств», «среднем»
+# и «среди» оказывались средой
+_MASC = ("", "а", "у", "ом", "е", "и", "ов", "ам", "ами", "ах")
+_FEM = ("а", "ы", "е", "у", "ой", "ою", "", "ам", "ами", "ах")
+_RU_WEEKDAYS = (
+    ("понедельник", 0, _MASC), ("вторник", 1, _MASC), ("сред", 2, _FEM), ("четверг", 3, _MASC),
+    ("пятниц", 4, ("а", "ы", "е", "у", "ей", "ею", "", "ам", "ами", "ах")),
+    ("суббот", 5, _FEM),
+    ("воскресен", 6, ("ье", "ья", "ью", "ьем", "ий", "ьям", "ьями", "ьях")),
+)
+_KK_FRONT = ("", "де", "ге", "ні", "нің", "ден", "мен", "сі", "сін", "сінде", "дегі", "лері", "лерде")
+_KK_BACK = ("", "да", "ға", "ны", "ның", "дан", "мен", "сы", "сын", "сында", "дағы", "лары", "ларда")
+_KK_WEEKDAYS = (
+    ("дүйсенбі", 0, _KK_FRONT), ("сейсенбі", 1, _KK_FRONT), ("сәрсенбі", 2, _KK_FRONT),
+    ("бейсенбі", 3, _KK_FRONT), ("жұма", 4, _KK_BACK), ("сенбі", 5, _KK_FRONT),
+    ("жексенбі", 6, _KK_FRONT),
+)
+_WEEKDAYS.update(
+    (stem + ending, wd)
+    for stem, wd, endings in _RU_WEEKDAYS + _KK_WEEKDAYS
+    for ending in endings
+)
+
+_MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+    "января": 1, "февраля": 2, "марта": 3, "апреля": 4, "мая": 5, "июня": 6, "июля": 7,
+    "августа": 8, "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12,
+}
+_MONTH_STEMS = (
+    ("қаңтар", 1), ("ақпан", 2), ("наурыз", 3), ("сәуір", 4), ("мамыр", 5), ("маусым", 6),
+    ("шілде", 7), ("тамыз", 8), ("қыркүйек", 9), ("қазан", 10), ("қараша", 11), ("желтоқсан", 12),
+)
+
+_L = r"[^\W\d_]"  # буква любого алфавита
+
+
+def _weekday(word: str) -> Optional[int]:
+    return _WEEKDAYS.get(word)
+
+
+def _month(word: str) -> Optional[int]:
+    if word in _MONTHS:
+        return _MONTHS[word]
+    for stem, m in _MONTH_STEMS:
+        if word.startswith(stem):
+            return m
+    return None
+
+
+@dataclass
+class DateRange:
+    """Inclusive local date range plus the character spans it was parsed from."""
+    start: date
+    end: date
+    spans: List[Tuple[int, int]] = field(default_factory=list)
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
+
+Resolver = Callable[[re.Match, date], Optional[Tuple[date, date]]]
+
+
+def _single(d: Optional[date]) -> Optional[Tuple[date, date]]:
+    return (d, d) if d else None
+
+
+def _upcoming(today: date, weekday: int, strictly_after: bool) -> date:
+    delta = (weekday - today.weekday()) % 7
+    if delta == 0 and strictly_after:
+        delta = 7
+    return today + timedelta(days=delta)
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _nearest(today: date, month: int, day: int, year: Optional[str]) -> Optional[date]:
+    """«15 августа» без года — ближайшее такое число (не дальше полугода в прошлом)."""
+    if year:
+        return _safe_date(int(year), month, day)
+    d = _safe_date(today.year, month, day)
+    if d and (today - d).days > 183:
+        d = _safe_date(today.year + 1, month, day)
+    return d
+
+
+def _week_range(m: re.Match, today: date) -> Tuple[date, date]:
+    if m.group("next"):
+        monday = today + timedelta(days=7 - today.weekday())
+        return monday, monday + timedelta(days=6)
+    # «эта неделя» — как и в промпте: сегодня + 6 дней
+    return today, today + timedelta(days=6)
+
+
+def _weekend(m: re.Match, today: date) -> Tuple[date, date]:
+    if m.group("next"):
+        saturday = _upcoming(today, 5, strictly_after=True)
+        if today.weekday() < 5:
+            saturday += timedelta(days=7)
+    else:
+        saturday = _upcoming(today, 5, strictly_after=False)
+        if today.weekday() == 6:
+            return today, today
+    return saturday, saturday + timedelta(days=1)
+
+
+def _weekday_range(m: re.Match, today: date) -> Optional[Tuple[date, date]]:
+    wd = _weekday(m.group("wd"))
+    if wd is None:
+        return None
+    return _single(_upcoming(today, wd, strictly_after=bool(m.group("next"))))
+
+
+def _day_month(m: re.Match, today: date) -> Optional[Tuple[date, date]]:
+    month = _month(m.group("month"))
+    if month is None:
+        return None
+    return _single(_nearest(today, month, int(m.group("day")), m.group("year")))
+
+
+def _numeric(m: re.Match, today: date) -> Optional[Tuple[date, date]]:
+    year = int(m.group("year"))
+    if year < 100:
+        year += 2000
+    return _single(_safe_date(year, int(m.group("month")), int(m.group("day"))))
+
+
+def _in_days(m: re.Match, today: date) -> Tuple[date, date]:
+    d = today + timedelta(days=int(m.group("n")))
+    return d, d
+
+
+def _next_days(m: re.Match, today: date) -> Tuple[date, date]:
+    return today, today + timedelta(days=max(int(m.group("n")), 1) - 1)
+
+
+def _offset(days: int) -> Resolver:
+    return lambda m, today: (today + timedelta(days=days),) * 2
+
+
+_NEXT = r"(?P<next>next|следующ\w*|будущ\w*|келесі)"
+_DAY_SUFFIX = r"(?:-?(?:st|nd|rd|th|го|е|ші|шы|і|ы))?"
+
+# Порядок важен: более длинные/специфичные выражения раньше
+_PATTERNS: List[Tuple[re.Pattern, Resolver]] = [
+    (re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b"), _numeric),
+    (re.compile(r"\b(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{2}|\d{4})\b"), _numeric),
+    (re.compile(rf"\b(?P<day>\d{{1,2}}){_DAY_SUFFIX}\s+(?:of\s+)?(?P<month>{_L}+)(?:,?\s+(?P<year>\d{{4}}))?"), _day_month),
+    (re.compile(rf"\b(?P<month>{_L}+)\s+(?P<day>\d{{1,2}}){_DAY_SUFFIX}\b(?!\s*[:.]\d)(?:,?\s+(?P<year>\d{{4}}))?"), _day_month),
+    (re.compile(r"\b(?:in|через)\s+(?P<n>\d{1,2})\s+(?:days?|дн\w*|день)\b"), _in_days),
+    (re.compile(r"\b(?P<n>\d{1,2})\s+күннен\s+кейін\b"), _in_days),
+    (re.compile(r"\b(?:next|ближайш\w*|следующ\w*|алдағы)\s+(?P<n>\d{1,2})\s+(?:days?|дн\w*|день|күн\w*)\b"), _next_days),
+    (re.compile(r"\b(?:day after tomorrow|послезавтра|бүрсігүні)\b"), _offset(2)),
+    (re.compile(r"\b(?:today|tonight|сегодня|бүгін\w*)\b"), _offset(0)),
+    (re.compile(r"\b(?:tomorrow|завтра|ертең\w*)\b"), _offset(1)),
+    (re.compile(r"\b(?:yesterday|вчера|кеше)\b"), _offset(-1)),
+    (re.compile(rf"\b(?:(?:on|this|на|в|эт\w*)\s+)?(?:{_NEXT}\s+)?(?:weekend|выходн\w*|демалыс\w*)\b"), _weekend),
+    (re.compile(rf"\b(?:(?:this|на|в|эт\w*|осы)\s+)?(?:{_NEXT}\s+)?(?:week|недел\w*|апта\w*)\b"), _week_range),
+    (re.compile(rf"\b(?:(?:on|в|во)\s+)?(?:{_NEXT}\s+|(?:this|эт\w*|осы)\s+)?(?P<wd>{_L}+)\b"), _weekday_range),
+]
+
+
+def parse_date_range(text: str, today: date, max_days: Optional[int] = None) -> Optional[DateRange]:
+    """
+    Finds relative and absolute date expressions in `text` (ru/en/kk):
+    «завтра», «в пятницу», «next Tuesday», «15 августа», «2025-08-15»,
+    «на следующей неделе», «через 3 дня», «бүрсігүні», …
+
+    Several expressions are merged into one covering range. Returns None if
+    nothing was found; `max_days` caps the length of the range.
+    """
+    lower = text.lower()
+    taken: List[Tuple[int, int]] = []
+    start: Optional[date] = None
+    end: Optional[date] = None
+
+    for pattern, resolve in _PATTERNS:
+        for m in pattern.finditer(lower):
+            span = m.span()
+            if any(span[0] < e and s < span[1] for s, e in taken):
+                continue
+            resolved = resolve(m, today)
+            if resolved is None:
+                continue
+            taken.append(span)
+            start = resolved[0] if start is None else min(start, resolved[0])
+            end = resolved[1] if end is None else max(end, resolved[1])
+
+    if start is None:
+        return None
+    if max_days and (end - start).days + 1 > max_days:
+        end = start + timedelta(days=max_days - 1)
+    return DateRange(start=start, end=end, spans=sorted(taken))
+
+
+def strip_spans(text: str, spans: List[Tuple[int, int]]) -> str:
+    """Text with the given character spans replaced by spaces."""
+    out, pos = [], 0
+    for s, e in spans:
+        out.append(text[pos:s])
+        out.append(" ")
+        pos = e
+    out.append(text[pos:])
+    return "".join(out)
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+from app.core.metrics import metrics
+
+metrics.describe("chat_stage_seconds", "Duration of each stage of a chat turn")
+
+
+class StageTimer:
+    """
+    Замеры стадий одного хода чата.
+
+    Each stage keeps its start and end offset from the start of the turn,
+    so stages that ran concurrently show up as overlapping intervals and
+    `critical_path` tells which one the turn actually waited for. Durations
+    also go to the `chat_stage_seconds{stage}` metric.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Tuple[float, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, begin, time.perf_counter())
+
+    def record(self, name: str, begin: float, end: float) -> None:
+        self.stages[name] = (begin - self.started, end - self.started)
+        metrics.observe("chat_stage_seconds", end - begin, stage=name)
+
+    def critical_path(self) -> str:
+        """Stages by end time; a stage that ended last among overlapping ones gated the next."""
+        ordered = sorted(self.stages.items(), key=lambda item: item[1][1])
+        return " → ".join(
+            f"{name} {1000 * begin:.0f}-{1000 * end:.0f}ms" for name, (begin, end) in ordered
+        )
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header (shown in browser devtools)."""
+        return ", ".join(
+            f"{name};dur={1000 * (end - begin):.1f}" for name, (begin, end) in self.stages.items()
+        )
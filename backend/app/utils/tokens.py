@@ -0,0 +1,55 @@
+import logging
+import math
+import re
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# gpt-4o / gpt-4.1 используют o200k_base
+ENCODING_NAME = "o200k_base"
+# служебные токены чата на каждое сообщение и на «приём» ответа
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+_encoding = None
+_encoding_failed = False
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        # нет пакета или нет доступа к файлу словаря — считаем приблизительно
+        logger.warning("tiktoken unavailable, using approximate token counts: %s", e)
+        _encoding_failed = True
+    return _encoding
+
+
+def _approximate(text: str) -> int:
+    total = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece.isascii():
+            total += max(1, math.ceil(len(piece) / 4))
+        else:
+            # кириллица/казахский режутся мельче латиницы
+            total += max(1, math.ceil(len(piece) / 2.5))
+    return total
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return _approximate(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: Iterable[dict]) -> int:
+    """Prompt size of a chat completion request, as the API counts it."""
+    return sum(TOKENS_PER_MESSAGE + count_tokens(m.get("content")) for m in messages) + TOKENS_PER_REPLY
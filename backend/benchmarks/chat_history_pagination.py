@@ -0,0 +1,132 @@
+"""
+Deep pagination of chat history: the old page query vs the keyset one.
+
+Seeds one chat with N messages (1M by default) into a scratch database and
+times a page of 50 messages at several depths, for
+
+  old: JOIN chats for ownership, ORDER BY created_at DESC, id < before_id
+  new: chat_id = ? AND id < before_id ORDER BY id DESC — a range scan of
+       ix_chat_messages_chat_id_id (ChatService.get_chat_messages)
+
+and prints the plan of each. Use an empty database: the tables are created
+if missing and the seeded rows are left in place for reruns.
+
+    python -m benchmarks.chat_history_pagination --url postgresql://localhost/bench
+    python -m benchmarks.chat_history_pagination --url sqlite:///bench.db --messages 200000
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.models import Chat, User
+from app.models.base import Base
+
+PAGE = 50
+
+OLD = """
+SELECT chat_messages.* FROM chat_messages JOIN chats ON chats.id = chat_messages.chat_id
+WHERE chats.owner_id = :owner AND chat_messages.chat_id = :chat AND chat_messages.id < :before
+ORDER BY chat_messages.created_at DESC LIMIT :page
+"""
+
+NEW = """
+SELECT chat_messages.* FROM chat_messages
+WHERE chat_messages.chat_id = :chat AND chat_messages.id < :before
+ORDER BY chat_messages.id DESC LIMIT :page
+"""
+
+
+def seed(conn, messages: int) -> tuple:
+    db = Session(bind=conn)
+    user = db.query(User).filter(User.email == "bench@example.com").first()
+    if user is None:
+        user = User(email="bench@example.com", hashed_password="x", timezone="UTC", gender="other")
+        db.add(user)
+        db.flush()
+    chat = db.query(Chat).filter(Chat.owner_id == user.id).first()
+    if chat is None:
+        chat = Chat(title="bench", owner_id=user.id)
+        db.add(chat)
+        db.flush()
+    owner, chat = user.id, chat.id
+
+    have = conn.execute(text("SELECT count(*) FROM chat_messages WHERE chat_id = :c"), {"c": chat}).scalar()
+    missing = messages - have
+    if missing > 0:
+        print(f"seeding {missing} messages...")
+        started = time.perf_counter()
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("""
+                INSERT INTO chat_messages (chat_id, role, content, created_at, updated_at)
+                SELECT :c, CASE WHEN g % 2 = 0 THEN 'user' ELSE 'assistant' END,
+                       'message number ' || g || ' about meetings, gym and groceries',
+                       now() - make_interval(secs => :n - g), now()
+                FROM generate_series(1, :n) AS g
+            """), {"c": chat, "n": missing})
+            conn.execute(text("ANALYZE chat_messages"))
+        else:
+            conn.execute(text("""
+                WITH RECURSIVE g(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM g WHERE n < :n)
+                INSERT INTO chat_messages (chat_id, role, content, created_at, updated_at)
+                SELECT :c, CASE WHEN n % 2 = 0 THEN 'user' ELSE 'assistant' END,
+                       'message number ' || n || ' about meetings, gym and groceries',
+                       datetime('now', '-' || (:n - n) || ' seconds'), datetime('now')
+                FROM g
+            """), {"c": chat, "n": missing})
+            conn.execute(text("ANALYZE"))
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+    return owner, chat
+
+
+def plan(conn, sql: str, params: dict) -> str:
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql), params).all()
+        return "\n".join("    " + r[0] for r in rows)
+    rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).all()
+    return "\n".join("    " + str(r[-1]) for r in rows)
+
+
+def timed(conn, sql: str, params: dict, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = conn.execute(text(sql), params).all()
+        samples.append(time.perf_counter() - started)
+    assert len(rows) <= PAGE
+    return statistics.median(samples) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", required=True, help="scratch database URL")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--plans", action="store_true", help="print query plans")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        owner, chat = seed(conn, args.messages)
+
+    with engine.connect() as conn:
+        top = conn.execute(text("SELECT max(id) + 1 FROM chat_messages WHERE chat_id = :c"), {"c": chat}).scalar()
+        low = conn.execute(text("SELECT min(id) FROM chat_messages WHERE chat_id = :c"), {"c": chat}).scalar()
+        print(f"{'depth':>8} {'before_id':>10} {'old ms':>9} {'new ms':>9}")
+        for depth in (0.0, 0.1, 0.5, 0.9, 0.999):
+            before = int(top - (top - low) * depth)
+            params = {"owner": owner, "chat": chat, "before": before, "page": PAGE}
+            old = timed(conn, OLD, params, args.runs)
+            new = timed(conn, NEW, params, args.runs)
+            print(f"{depth:>8.1%} {before:>10} {old:>9.2f} {new:>9.2f}")
+        if args.plans:
+            params["before"] = (top + low) // 2
+            print("old plan:\n" + plan(conn, OLD, params))
+            print("new plan:\n" + plan(conn, NEW, params))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Fast path: hit rate and latency of the local intent recognizer.
+
+Runs `recognize_intent` over CORPUS, a mixed set of typical calendar
+intents and messages that must go to the model (labelled with the expected
+kind, or None), and prints the hit rate, misclassifications and recognizer
+latency. No database needed for that part.
+
+With --end-to-end it also answers the query intents through FastPath
+against a scratch database (--url, in-memory SQLite by default; tables are
+created, one user is added) and prints the latency of a fast-path answer.
+That part imports AIService, so DATABASE_URL must point at a reachable
+database, as for the app.
+
+    python -m benchmarks.fast_path_corpus
+    python -m benchmarks.fast_path_corpus --end-to-end --url postgresql://localhost/bench
+"""
+import argparse
+import statistics
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.models import User
+from app.models.base import Base
+from app.services.calendar_service import CalendarService
+from app.services.fast_path import recognize_intent
+
+# (сообщение, ожидаемый kind или None — «к модели»)
+CORPUS = [
+    ("What do I have today?", "day"),
+    ("what do i have tomorrow", "day"),
+    ("show my week", "range"),
+    ("Show me my schedule for today", "day"),
+    ("any plans tomorrow?", "day"),
+    ("What's on my calendar this week?", "range"),
+    ("add dentist tomorrow at 15:00", "create"),
+    ("Schedule gym tomorrow at 18:00 for 2 hours", "create"),
+    ("book lunch with Anna tomorrow 13:00-14:00", "create"),
+    ("Что у меня сегодня?", "day"),
+    ("что у меня завтра", "day"),
+    ("покажи планы на неделю", "range"),
+    ("Какие планы на завтра?", "day"),
+    ("расписание на сегодня", "day"),
+    ("Добавь встречу с Иваном завтра в 15:00", "create"),
+    ("запиши тренировку завтра с 18:00 до 19:30", "create"),
+    ("добавь созвон сегодня в 23:30 на 30 минут", "create"),
+    ("Бүгін менде не бар?", "day"),
+    ("Ертең қандай жоспарларым бар", "day"),
+    ("Аптаға жоспарларымды көрсет", "range"),
+    ("Ертең 15:00-де кездесу қос", "create"),
+    ("What do I have on Friday?", "day"),
+    ("Add a meeting next Tuesday at 10:00", "create"),
+    ("Что у меня 15 августа?", "day"),
+    ("Какие планы на выходные?", "range"),
+    # к модели
+    ("Перенеси встречу на завтра", None),
+    ("thanks!", None),
+    ("Удали тренировку завтра", None),
+    ("добавь встречу завтра", None),
+    ("How should I prepare for my exam tomorrow?", None),
+    ("Я устал, что делать?", None),
+    ("add meeting tomorrow at 10:00 and lunch at 13:00", None),
+    ("Есть свободное окно завтра после обеда?", None),
+    ("Who are you?", None),
+    ("привет", None),
+    ("Сәлем, қалайсың?", None),
+    ("что у меня вчера было", None),
+    ("Can you move my gym session to 18:00?", None),
+    ("remind me to call mom", None),
+    ("what's the weather tomorrow", None),
+    # похоже на день недели, но нет («средств», «среднем»)
+    ("добавь обсуждение средств в 15:00", None),
+    ("добавь встречу в среднем офисе в 15:00", None),
+]
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--end-to-end", action="store_true")
+    parser.add_argument("--url", default="sqlite://")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    today = date(2030, 1, 1)
+    correct = hits = 0
+    for message, expected in CORPUS:
+        intent = recognize_intent(message, today)
+        kind = intent.kind if intent else None
+        # создание без длительности отдаётся модели — она переспросит
+        hits += kind is not None and (kind != "create" or intent.minutes is not None)
+        correct += kind == expected
+        if kind != expected:
+            print(f"MISMATCH  expected {expected}, got {kind}: {message}")
+        elif kind == "create":
+            print(f"create    {intent.title!r} {intent.day} {intent.start} {intent.minutes}  <- {message}")
+    n = len(CORPUS)
+    print(f"classified correctly {correct}/{n}, fast-path hit rate {hits}/{n}")
+
+    recognizer = []
+    for _ in range(args.rounds):
+        for message, _expected in CORPUS:
+            started = time.perf_counter()
+            recognize_intent(message, today)
+            recognizer.append((time.perf_counter() - started) * 1000)
+    print(f"recognizer         p50 {percentile(recognizer, 0.5):.3f} ms  p95 {percentile(recognizer, 0.95):.3f} ms")
+
+    if not args.end_to_end:
+        return
+    from app.services.ai_service import ai_service
+
+    engine = create_engine(args.url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        user = User(email=f"fast-path-{time.time_ns()}@bench.local", hashed_password="x", timezone="Asia/Almaty")
+        db.add(user)
+        db.commit()
+        calendar = CalendarService(db, user)
+        answered = []
+        for _ in range(args.rounds):
+            for message, expected in CORPUS:
+                if expected not in ("day", "range"):
+                    continue
+                started = time.perf_counter()
+                ai_service.fast_path.answer(message, lang="ru", personality="assistant", calendar_service=calendar)
+                answered.append((time.perf_counter() - started) * 1000)
+    print(f"fast-path answer   p50 {percentile(answered, 0.5):.3f} ms  p95 {percentile(answered, 0.95):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
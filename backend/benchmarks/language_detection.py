@@ -0,0 +1,104 @@
+"""
+Language detection: accuracy of `detect_language` on labelled chat messages.
+
+Runs the local ru/en/kk detector over SAMPLES, a hand-labelled set of short
+calendar-style messages, and prints accuracy from text alone, how many
+messages fall under the confidence threshold (and so go to the user's
+preferred_language), and the cost per call. The fallback is simulated with
+one fixed preferred_language for every message (--preferred, "ru" like a
+new account), not with the true label, so it can also make things worse.
+Use --threshold to see how another MIN_CONFIDENCE would do.
+
+    python -m benchmarks.language_detection --misses
+"""
+import argparse
+import time
+
+from app.utils.language import MIN_CONFIDENCE, detect_language_scored, normalize_language_code
+
+SAMPLES = [
+    ("en", "What do I have tomorrow?"),
+    ("en", "Add a meeting with John at 3pm"),
+    ("en", "show my week"),
+    ("en", "Cancel the dentist appointment on Friday"),
+    ("en", "thanks!"),
+    ("en", "Can you move my gym session to 18:00?"),
+    ("en", "Am I free next Tuesday afternoon?"),
+    ("en", "remind me to call mom"),
+    ("en", "What's on my schedule today"),
+    ("en", "Delete the standup tomorrow"),
+    ("en", "Book lunch with Anna on August 15 at 13:00"),
+    ("en", "hello there"),
+    ("ru", "Что у меня завтра?"),
+    ("ru", "Добавь встречу с Иваном в 15:00"),
+    ("ru", "покажи планы на неделю"),
+    ("ru", "Удали тренировку в пятницу"),
+    ("ru", "спасибо!"),
+    ("ru", "Перенеси звонок на вечер"),
+    ("ru", "Я свободен в следующий вторник?"),
+    ("ru", "напомни позвонить маме"),
+    ("ru", "Какое расписание на сегодня"),
+    ("ru", "Запиши меня к врачу 15 августа в 10 утра"),
+    ("ru", "привет, как дела?"),
+    ("ru", "сколько у меня встреч на этой неделе"),
+    ("ru", "Завтра в 9 созвон с командой"),
+    ("ru", "отмени все дела на выходные"),
+    ("ru", "есть окно после обеда?"),
+    ("ru", "добавь пробежку завтра утром на час"),
+    ("kk", "Ертең менде не бар?"),
+    ("kk", "Сағат 15:00-де кездесу қос"),
+    ("kk", "Аптаға арналған жоспарларымды көрсет"),
+    ("kk", "Жұмада жаттығуды өшір"),
+    ("kk", "рахмет!"),
+    ("kk", "Бүгін қандай жоспарларым бар"),
+    ("kk", "Маған анама қоңырау шалуды еске сал"),
+    ("kk", "Сәлем, қалайсың?"),
+    ("kk", "Келесі сейсенбіде бос уақытым бар ма?"),
+    ("kk", "Ертең таңертең жүгіруді қос"),
+    ("kk", "Дәрігерге жазылу 15 тамызда"),
+    ("kk", "Кездесуді кешке ауыстыр"),
+    # казахский без специфичных букв (набран на русской раскладке)
+    ("kk", "менде ертен не бар"),
+    ("kk", "кездесу барма"),
+    ("kk", "жоспарлар керек"),
+    ("kk", "сен кимсин"),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--preferred", default="ru", help="preferred_language the fallback uses")
+    parser.add_argument("--misses", action="store_true", help="print misclassified messages")
+    parser.add_argument("--calls", type=int, default=20_000)
+    args = parser.parse_args()
+
+    preferred = normalize_language_code(args.preferred)
+    alone = fallback = low = low_right = 0
+    for label, text in SAMPLES:
+        code, confidence = detect_language_scored(text)
+        predicted = code or "ru"
+        alone += predicted == label
+        if confidence < args.threshold:
+            low += 1
+            low_right += predicted == label
+            # в приложении здесь берётся preferred_language пользователя
+            predicted = preferred
+        fallback += predicted == label
+        if args.misses and code != label:
+            print(f"MISS  {label} -> {code} ({confidence:.2f})  {text}")
+
+    n = len(SAMPLES)
+    print(f"samples {n}, threshold {args.threshold}")
+    print(f"text alone      {alone}/{n} = {alone / n:.1%}")
+    print(f"below threshold {low} ({low_right} of them right from text)")
+    print(f"fallback to {preferred}  {fallback}/{n} = {fallback / n:.1%}")
+
+    started = time.perf_counter()
+    for i in range(args.calls):
+        detect_language_scored(SAMPLES[i % n][1])
+    print(f"{(time.perf_counter() - started) / args.calls * 1e6:.1f} us per call")
+
+
+if __name__ == "__main__":
+    main()
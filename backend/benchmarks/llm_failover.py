@@ -0,0 +1,213 @@
+"""
+LLM resilience: retries, failover and hedging of `ask_gpt` against two local stand-ins.
+
+Starts two Azure OpenAI stand-ins on localhost ("primary" and "secondary",
+same chat-completions route and response shape, scriptable failures and
+latency) and points openai_service's deployments at them. Each scenario
+checks what the stand-ins saw and what ask_gpt returned:
+
+  retry-after   primary answers 429 with Retry-After once; the call waits
+                it out and succeeds on the retry
+  failover      primary answers 500; the call falls over to the secondary,
+                and once the primary's breaker opens it is not called at all
+  hedge         5% of primary answers take 1.5 s; after the hedge delay the
+                request also goes to the secondary and the first answer wins
+                (latency percentiles with and without a secondary)
+
+No database or Azure key is needed: without the app, calls are not
+metered (openai_service.use_usage_meter).
+
+    python -m benchmarks.llm_failover
+    python -m benchmarks.llm_failover --scenario hedge --requests 400
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.core.config import settings
+from app.core.metrics import metrics
+import app.services.openai_service as llm
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class StandIn:
+    """Scriptable stand-in: `failures` are answered first (status, headers), then 200 after `delay()`."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.failures: list = []
+        self.slow_fraction = 0.0
+        self.slow_seconds = 0.0
+        self.fast_seconds = 0.01
+        self.hits = 0
+        self.cancelled = 0
+        self.url = self._serve()
+
+    def reset(self, **params) -> None:
+        self.failures, self.slow_fraction, self.slow_seconds, self.fast_seconds = [], 0.0, 0.0, 0.01
+        self.hits = self.cancelled = 0
+        for name, value in params.items():
+            setattr(self, name, value)
+
+    def _app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/openai/deployments/{deployment}/chat/completions")
+        async def complete(deployment: str, request: Request):
+            body = await request.json()
+            self.hits += 1
+            if self.failures:
+                status, headers = self.failures.pop(0)
+                return JSONResponse({"error": {"code": str(status), "message": "stand-in failure"}}, status, headers)
+            slow = random.random() < self.slow_fraction
+            try:
+                await asyncio.sleep(self.slow_seconds if slow else self.fast_seconds)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            chunk = {"id": "x", "created": 1, "model": deployment}
+            if body.get("stream"):
+                async def events():
+                    delta = {"index": 0, "delta": {"content": self.name}}
+                    yield "data: " + json.dumps({**chunk, "object": "chat.completion.chunk", "choices": [delta]}) + "\n\n"
+                    usage = {"prompt_tokens": 5, "completion_tokens": 1}
+                    yield "data: " + json.dumps({**chunk, "object": "chat.completion.chunk", "choices": [], "usage": usage}) + "\n\n"
+                    yield "data: [DONE]\n\n"
+                return StreamingResponse(events(), media_type="text/event-stream")
+            return JSONResponse({
+                **chunk, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": self.name}}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+            })
+
+        return app
+
+    def _serve(self) -> str:
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(self._app(), log_level="warning"))
+        threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def use(primary: StandIn, secondary=None) -> None:
+    """Fresh deployments (breakers, latency windows) pointing at the stand-ins."""
+    llm.primary = llm.Deployment("primary", llm._make_client(primary.url, "bench"), "bench-primary")
+    llm.secondary = (
+        llm.Deployment("secondary", llm._make_client(secondary.url, "bench"), "bench-secondary")
+        if secondary is not None else None
+    )
+
+
+async def ask(stream: bool = False) -> str:
+    reply = await llm.ask_gpt(MESSAGES, model=llm.primary.model, stream=stream)
+    if stream:
+        return "".join([delta async for delta in reply if isinstance(delta, str)])
+    return reply
+
+
+def check(name: str, ok: bool, detail: str) -> bool:
+    print(f"{'PASS' if ok else 'FAIL'}  {name}: {detail}")
+    return ok
+
+
+async def retry_after(primary: StandIn, secondary: StandIn) -> bool:
+    primary.reset(failures=[(429, {"retry-after": "1"})])
+    use(primary)
+    started = time.perf_counter()
+    reply = await ask()
+    took = time.perf_counter() - started
+    return check(
+        "retry-after", reply == "primary" and primary.hits == 2 and took >= 1.0,
+        f"reply {reply!r}, primary hits {primary.hits}, took {took:.2f}s (Retry-After 1s)",
+    )
+
+
+async def failover(primary: StandIn, secondary: StandIn) -> bool:
+    failures = [(500, {})] * 100
+    primary.reset(failures=list(failures))
+    secondary.reset()
+    use(primary, secondary)
+    replies = [await ask(stream=i % 2 == 1) for i in range(settings.LLM_BREAKER_FAILURES + 3)]
+    hits_when_open = primary.hits
+    extra = [await ask() for _ in range(5)]
+    return all([
+        check(
+            "failover", set(replies) == {"secondary"},
+            f"{len(replies)} calls with the primary failing -> {sorted(set(replies))}, "
+            f"primary hits {hits_when_open} (retries included), secondary hits {secondary.hits}",
+        ),
+        check(
+            "failover/breaker", set(extra) == {"secondary"} and primary.hits == hits_when_open,
+            f"breaker {llm.primary.breaker.state}: 5 more calls went to the secondary only "
+            f"(primary hits {primary.hits - hits_when_open})",
+        ),
+    ])
+
+
+async def hedge(primary: StandIn, secondary: StandIn, requests: int) -> bool:
+    results = {}
+    for label, with_secondary in (("off", False), ("on", True)):
+        primary.reset(slow_fraction=0.05, slow_seconds=1.5, fast_seconds=0.05)
+        secondary.reset(fast_seconds=0.06)
+        use(primary, secondary if with_secondary else None)
+        latencies, winners = [], {}
+
+        async def one(i: int) -> None:
+            started = time.perf_counter()
+            reply = await ask(stream=i % 2 == 1)
+            latencies.append(time.perf_counter() - started)
+            winners[reply] = winners.get(reply, 0) + 1
+
+        for start in range(0, requests, 10):
+            await asyncio.gather(*(one(start + i) for i in range(10)))
+        # первые запросы набирают окно задержек, пока задержка хеджа — дефолтная
+        steady = sorted(latencies[settings.LLM_HEDGE_MIN_SAMPLES * 3:])
+        p = lambda q: steady[min(int(q * len(steady)), len(steady) - 1)]
+        results[label] = p(0.99)
+        print(f"      hedge {label:<3} p50 {p(0.5):.3f}s  p95 {p(0.95):.3f}s  p99 {p(0.99):.3f}s  "
+              f"winners {winners}  primary hits {primary.hits}, secondary hits {secondary.hits} "
+              f"(cancelled {secondary.cancelled + primary.cancelled})")
+    return check(
+        "hedge", results["on"] < results["off"] / 2,
+        f"p99 {results['off']:.3f}s without a secondary -> {results['on']:.3f}s with one",
+    )
+
+
+async def run(args) -> None:
+    primary, secondary = StandIn("primary"), StandIn("secondary")
+    passed = []
+    if args.scenario in ("all", "retry-after"):
+        passed.append(await retry_after(primary, secondary))
+    if args.scenario in ("all", "failover"):
+        passed.append(await failover(primary, secondary))
+    if args.scenario in ("all", "hedge"):
+        passed.append(await hedge(primary, secondary, args.requests))
+    print("\n".join(
+        line for line in metrics.render().splitlines()
+        if line.startswith(("llm_hedges_total", "llm_retries_total", "llm_failures_total"))
+    ))
+    if not all(passed):
+        raise SystemExit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("all", "retry-after", "failover", "hedge"), default="all")
+    parser.add_argument("--requests", type=int, default=300, help="requests per hedge run")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
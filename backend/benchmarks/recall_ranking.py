@@ -0,0 +1,81 @@
+"""
+Long-term recall: ranking latency of the per-chat BM25 index.
+
+Builds an index of N synthetic messages (Zipf-distributed vocabulary, 4-40
+words each), then ranks random 3-12 word queries with `_ChatIndex.top` and
+with an exhaustive BM25 over the same postings. Prints latency percentiles
+and how many of the exhaustive top-3 the index returns. No database needed.
+
+    python -m benchmarks.recall_ranking --messages 50000
+"""
+import argparse
+import heapq
+import itertools
+import math
+import random
+import time
+
+from app.services.recall_service import _B, _K1, _MAX_DF, _ChatIndex
+
+VOCABULARY = 8000
+RECENT = 11
+
+
+def exhaustive(index: _ChatIndex, terms, k: int):
+    n = len(index.doc_ids)
+    below = index.doc_ids[-RECENT]
+    avg = index.total_len / n
+    scores = {}
+    for term in set(terms):
+        if term not in index.postings:
+            continue
+        ords, tfs = index.postings[term]
+        df = len(ords)
+        if df > _MAX_DF * n:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for ordinal, tf in zip(ords, tfs):
+            if index.doc_ids[ordinal] >= below:
+                continue
+            norm = _K1 * (1 - _B + _B * index.doc_lens[ordinal] / avg)
+            scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+    return {index.doc_ids[o] for o, _ in heapq.nlargest(k, scores.items(), key=lambda item: item[1])}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = [f"w{i}" for i in range(VOCABULARY)]
+    weights = list(itertools.accumulate(1 / (i + 1) for i in range(VOCABULARY)))
+
+    index = _ChatIndex()
+    started = time.perf_counter()
+    for message_id in range(1, args.messages + 1):
+        index.add(message_id, " ".join(rng.choices(words, cum_weights=weights, k=rng.randint(4, 40))))
+    print(f"indexed {args.messages} messages in {time.perf_counter() - started:.1f}s, "
+          f"~{index.size // 1024} KB in memory, {len(index.dumps()) // 1024} KB stored")
+
+    samples, found = [], 0.0
+    for _ in range(args.queries):
+        terms = rng.choices(words, cum_weights=weights, k=rng.randint(3, 12))
+        started = time.perf_counter()
+        ranked = index.top(terms, 3, index.doc_ids[-RECENT], 0.0)
+        samples.append(time.perf_counter() - started)
+        best = exhaustive(index, terms, 3)
+        found += len({message_id for _, message_id in ranked} & best) / max(len(best), 1)
+    samples.sort()
+
+    def pct(p: float) -> float:
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+    print(f"ranking ms: p50 {pct(0.5):.2f}  p95 {pct(0.95):.2f}  max {samples[-1] * 1000:.2f}")
+    print(f"exhaustive top-3 found: {found / args.queries:.1%}")
+
+
+if __name__ == "__main__":
+    main()
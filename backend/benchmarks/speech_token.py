@@ -0,0 +1,102 @@
+"""
+Speech tokens: latency of GET /api/speech/token's provider against a local STS stand-in.
+
+Starts a stand-in for the Azure STS on localhost (answers after --sts-delay
+ms with a random token), then serves --requests token requests in waves of
+--concurrency. Compares a plain STS call per request (what the endpoint did
+before) with SpeechTokenProvider, and prints latency percentiles and how
+many times the STS was called. No Azure key needed.
+
+    python -m benchmarks.speech_token --requests 2000 --concurrency 50 --sts-delay 80
+"""
+import argparse
+import asyncio
+import secrets
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Response
+
+from app.services.speech_service import SpeechTokenProvider
+
+REGION = "westeurope"
+
+
+def stand_in(delay: float, calls: list) -> FastAPI:
+    sts = FastAPI()
+
+    @sts.post("/{region}/sts/v1.0/issueToken")
+    async def issue_token(region: str):
+        calls.append(region)
+        await asyncio.sleep(delay)
+        return Response(secrets.token_urlsafe(600), media_type="text/plain")
+
+    return sts
+
+
+def serve(sts: FastAPI) -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(sts, log_level="warning"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/{{region}}/sts/v1.0/issueToken"
+
+
+async def waves(get, total: int, concurrency: int) -> list:
+    latencies = []
+
+    async def one() -> None:
+        started = time.perf_counter()
+        await get()
+        latencies.append(time.perf_counter() - started)
+
+    for start in range(0, total, concurrency):
+        await asyncio.gather(*(one() for _ in range(min(concurrency, total - start))))
+    return latencies
+
+
+def report(name: str, latencies: list, sts_calls: int) -> None:
+    ms = sorted(x * 1000 for x in latencies)
+    p = lambda q: ms[min(int(q * len(ms)), len(ms) - 1)]
+    print(f"{name:<10} p50 {p(0.5):8.2f} ms  p95 {p(0.95):8.2f} ms  p99 {p(0.99):8.2f} ms  "
+          f"mean {statistics.fmean(ms):8.2f} ms  STS calls {sts_calls}")
+
+
+async def run(args) -> None:
+    calls: list = []
+    url = serve(stand_in(args.sts_delay / 1000, calls))
+
+    async def direct():
+        # как было: новый запрос к STS на каждый вызов, без пула соединений
+        async with httpx.AsyncClient() as client:
+            resp = await client.post(url.format(region=REGION), headers={"Ocp-Apim-Subscription-Key": "bench"})
+            resp.raise_for_status()
+            return resp.text
+
+    report("direct", await waves(direct, args.requests, args.concurrency), len(calls))
+
+    calls.clear()
+    provider = SpeechTokenProvider(key="bench", url=url)
+    try:
+        report("cached", await waves(lambda: provider.get(REGION), args.requests, args.concurrency), len(calls))
+    finally:
+        await provider.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sts-delay", type=float, default=80.0, help="STS stand-in latency, ms")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
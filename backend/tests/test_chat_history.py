@@ -0,0 +1,56 @@
+import pytest
+
+try:
+    from app.main import app
+except Exception as e:  # app.core.database подключается к БД при импорте
+    pytest.skip(f"needs a database at TEST_DATABASE_URL: {e}", allow_module_level=True)
+
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import InvalidRequestError
+
+from app.dependencies.user import get_current_user
+from app.models import Chat, ChatMessage
+from app.services.chat_service import ChatService
+
+
+@pytest.fixture
+def chat(db, make_user):
+    user = make_user()
+    chat = ChatService(db, user).get_or_create_chat()
+    db.add_all(
+        ChatMessage(chat_id=chat.id, role="user" if i % 2 == 0 else "assistant", content=f"message {i}")
+        for i in range(25)
+    )
+    db.commit()
+    return chat
+
+
+@pytest.fixture
+def client(chat):
+    app.dependency_overrides[get_current_user] = lambda: chat.owner
+    # без with: startup-обработчики (буфер записи, обработчики задач) не запускаются
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def test_chat_messages_relationship_never_loads(db, chat):
+    loaded = db.get(Chat, chat.id)
+    with pytest.raises(InvalidRequestError):
+        loaded.messages
+
+
+def test_my_chat_returns_the_newest_window(client):
+    body = client.get("/api/chat/me", params={"limit": 10}).json()
+    contents = [m["content"] for m in body["messages"]]
+    assert contents == [f"message {i}" for i in range(15, 25)]
+    assert body["next_before_id"] == body["messages"][0]["id"]
+
+    older = client.get("/api/chat/me/messages", params={"before_id": body["next_before_id"], "limit": 10}).json()
+    assert [m["content"] for m in older] == [f"message {i}" for i in range(14, 4, -1)]
+
+
+def test_my_chat_without_older_messages_has_no_cursor(client):
+    # 25 сообщений и приветствие нового чата
+    body = client.get("/api/chat/me", params={"limit": 26}).json()
+    assert len(body["messages"]) == 26
+    assert body["next_before_id"] is None
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+try:
+    from app.services import chat_jobs
+except Exception as e:  # app.core.database подключается к БД при импорте
+    pytest.skip(f"needs a database at TEST_DATABASE_URL: {e}", allow_module_level=True)
+
+from app.core.job_queue import DONE, ERROR, InProcessJobQueue, Job
+from app.services.chat_jobs import ChatJobWorkers
+
+
+class ScriptedWorkers(ChatJobWorkers):
+    """Jobs sleep for payload["seconds"] instead of calling the model."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    async def _process(self, job: Job):
+        self.log.append(("start", job.payload["message"]))
+        try:
+            await asyncio.sleep(job.payload["seconds"])
+            return {"message": job.payload["message"]}, None
+        finally:
+            self.log.append(("end", job.payload["message"]))
+
+
+async def _wait_finished(queue, job_ids, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [await queue.get(job_id) for job_id in job_ids]
+        if all(job.finished for job in jobs):
+            return jobs
+        await asyncio.sleep(0.02)
+    raise AssertionError("jobs did not finish")
+
+
+def test_next_job_in_lane_waits_for_a_job_past_its_lease():
+    async def scenario():
+        # аренда истекает у зависшей первой задачи; вторая — того же пользователя
+        queue = InProcessJobQueue(lease_seconds=1.5)
+        workers = ScriptedWorkers(queue, size=2, lease_seconds=1.5)
+        hung, quick = Job(1, {"message": "hung", "seconds": 30}), Job(1, {"message": "quick", "seconds": 0})
+        await queue.submit(hung)
+        await queue.submit(quick)
+        workers.start()
+        try:
+            jobs = await _wait_finished(queue, [hung.id, quick.id])
+        finally:
+            await workers.stop()
+        return workers.log, jobs
+
+    log, (hung, quick) = asyncio.run(scenario())
+    assert log == [("start", "hung"), ("end", "hung"), ("start", "quick"), ("end", "quick")]
+    assert hung.status == ERROR and hung.error == "Job was interrupted"
+    assert quick.status == DONE and quick.started_at >= hung.finished_at
+
+
+def test_lanes_keep_order_and_users_run_in_parallel():
+    async def scenario():
+        queue = InProcessJobQueue()
+        workers = ScriptedWorkers(queue, size=2)
+        jobs = [Job(1, {"message": "a1", "seconds": 0.2}), Job(1, {"message": "a2", "seconds": 0}),
+                Job(2, {"message": "b1", "seconds": 0})]
+        for job in jobs:
+            await queue.submit(job)
+        workers.start()
+        try:
+            await _wait_finished(queue, [job.id for job in jobs])
+        finally:
+            await workers.stop()
+        return workers.log
+
+    log = asyncio.run(scenario())
+    # b1 не ждёт a1, a2 стартует только после конца a1
+    assert log.index(("end", "b1")) < log.index(("end", "a1"))
+    assert log.index(("end", "a1")) < log.index(("start", "a2"))
+
+
+def test_cancelled_job_finishes_the_write_in_flight(monkeypatch):
+    written = []
+
+    def slow_persist(user_id, chat_id, message, reply):
+        time.sleep(0.3)
+        written.append(message)
+
+    monkeypatch.setattr(chat_jobs, "persist_turn", slow_persist)
+
+    async def scenario():
+        task = asyncio.create_task(chat_jobs._persist(1, 1, "hi", "hello"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return list(written)
+
+    assert asyncio.run(scenario()) == ["hi"]
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+try:
+    from app.services.chat_retention import ChatRetention
+except Exception as e:  # app.core.database подключается к БД при импорте
+    pytest.skip(f"needs a database at TEST_DATABASE_URL: {e}", allow_module_level=True)
+
+from app.models import ChatArchive, ChatMessage, ChatSummary
+from app.services.chat_service import ChatService
+from app.services.memory_service import MemoryStore
+from app.services.summary_service import ConversationSummarizer
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    summarizer = ConversationSummarizer(MemoryStore(), enabled=True, max_input=40)
+    summarizer.folded = []
+
+    async def ask(previous, rows):
+        summarizer.folded.append([message_id for message_id, _role, _content in rows])
+        return f"{previous} +{len(rows)}"
+
+    monkeypatch.setattr(summarizer, "_ask", ask)
+    return summarizer
+
+
+@pytest.fixture
+def old_chat(db, make_user):
+    user = make_user(chat_retention_days=30)
+    chat = ChatService(db, user).get_or_create_chat()
+    long_ago = datetime.utcnow() - timedelta(days=400)
+    db.add_all(
+        ChatMessage(chat_id=chat.id, role="user", content=f"m{i}", created_at=long_ago + timedelta(minutes=i))
+        for i in range(300)
+    )
+    db.commit()
+    return chat
+
+
+def test_backlog_larger_than_max_input_is_archived_in_one_pass(db, summarizer, old_chat):
+    retention = ChatRetention(summarizer, keep_messages=20, batch_size=1000, summary_rounds=25)
+    moved = asyncio.run(retention.compact(old_chat.id, 30, old_chat.owner_id))
+
+    # всё, кроме 20 последних (приветствие — тоже старое сообщение)
+    assert moved == 301 - 20
+    hot = db.query(ChatMessage.id).filter(ChatMessage.chat_id == old_chat.id).count()
+    assert hot == 20
+    # в пересказ попало каждое архивированное сообщение, по порядку и не больше max_input за вызов
+    folded = [message_id for batch in summarizer.folded for message_id in batch]
+    archived_up_to = db.query(ChatSummary.last_message_id).filter(ChatSummary.chat_id == old_chat.id).scalar()
+    assert folded == sorted(folded) and len(folded) == moved and folded[-1] == archived_up_to
+    assert max(len(batch) for batch in summarizer.folded) == 40
+    assert sum(count for (count,) in db.query(ChatArchive.message_count).all()) == moved
+
+
+def test_summary_rounds_bound_a_pass(db, summarizer, old_chat):
+    retention = ChatRetention(summarizer, keep_messages=20, batch_size=1000, summary_rounds=2)
+    moved = asyncio.run(retention.compact(old_chat.id, 30, old_chat.owner_id))
+    assert moved == 80 and len(summarizer.folded) == 2
+    # следующий проход продолжает с того же места
+    moved = asyncio.run(retention.compact(old_chat.id, 30, old_chat.owner_id))
+    assert moved == 80 and summarizer.folded[2][0] == summarizer.folded[1][-1] + 1
@@ -0,0 +1,117 @@
+import pytest
+
+try:
+    from app.services.chat_service import ChatService, chat_ids
+except Exception as e:  # app.core.database подключается к БД при импорте
+    pytest.skip(f"needs a database at TEST_DATABASE_URL: {e}", allow_module_level=True)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.models import ChatMessage, User
+from app.models.base import Base
+
+
+def _fill(db, service, contents):
+    chat_id = service.get_chat_id()
+    messages = [ChatMessage(chat_id=chat_id, role="user", content=content) for content in contents]
+    db.add_all(messages)
+    db.commit()
+    return chat_id, [m.id for m in messages]
+
+
+def _all_pages(service, chat_id, query, limit):
+    hits, cursor, pages = [], None, 0
+    while True:
+        page, cursor, _ = service.search_messages(chat_id, query, limit=limit, cursor=cursor)
+        hits += page
+        pages += 1
+        if cursor is None:
+            return hits, pages
+
+
+@pytest.fixture
+def service(db, make_user):
+    return ChatService(db, make_user())
+
+
+# ───────────────── PostgreSQL: полнотекстовый поиск ─────────────────
+
+def test_denser_match_ranks_first(db, service):
+    chat_id, (once, twice, _) = _fill(db, service, [
+        "I should call the dentist", "dentist, dentist again: the dentist moved my slot", "lunch with Anna",
+    ])
+    hits, cursor, ranked_from_id = service.search_messages(chat_id, "dentist")
+    assert [hit["id"] for hit in hits] == [twice, once]
+    assert hits[0]["rank"] > hits[1]["rank"]
+    assert cursor is None and ranked_from_id is None
+
+
+def test_russian_morphology_and_escaped_snippet(db, service):
+    chat_id, (moved,) = _fill(db, service, ["Созвон с Иваном & Co перенесли"])
+    hits, _, _ = service.search_messages(chat_id, "Иван")
+    assert [hit["id"] for hit in hits] == [moved]
+    assert "<mark>Иваном</mark> &amp; Co" in hits[0]["snippet"]
+
+
+def test_cursor_pages_cover_every_hit_once_in_rank_order(db, service):
+    # разная плотность совпадений — разные ранги, плюс одинаковые ранги с разными id
+    chat_id, ids = _fill(db, service, [" ".join(["report"] * (1 + i % 4) + ["filler"] * 5) for i in range(30)])
+    hits, pages = _all_pages(service, chat_id, "report", limit=7)
+    assert sorted(hit["id"] for hit in hits) == sorted(ids)
+    assert pages == 5
+    keys = [(hit["rank"], hit["id"]) for hit in hits]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_only_the_newest_candidates_are_ranked(db, service, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_SEARCH_MAX_CANDIDATES", 5)
+    chat_id, ids = _fill(db, service, [f"standup note {i}" for i in range(12)])
+    hits, _, ranked_from_id = service.search_messages(chat_id, "standup", limit=3)
+    assert ranked_from_id == ids[-5]
+    hits, _ = _all_pages(service, chat_id, "standup", limit=3)
+    assert sorted(hit["id"] for hit in hits) == ids[-5:]
+
+
+def test_invalid_cursor_is_rejected(db, service):
+    chat_id, _ = _fill(db, service, ["anything"])
+    with pytest.raises(Exception) as excinfo:
+        service.search_messages(chat_id, "anything", cursor="not-a-cursor")
+    assert excinfo.value.status_code == 400
+
+
+# ───────────────── другие БД: поиск по подстроке ─────────────────
+
+@pytest.fixture
+def plain_service():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    user = User(email="plain@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    # id пользователя SQLite может совпасть с id из PostgreSQL
+    chat_ids.discard(user.id)
+    yield db, ChatService(db, user)
+    chat_ids.discard(user.id)
+    db.close()
+    engine.dispose()
+
+
+def test_plain_search_treats_like_wildcards_literally(plain_service):
+    db, service = plain_service
+    chat_id, (underscored, _) = _fill(db, service, ["file_name.txt", "file-name.txt"])
+    hits, _, ranked_from_id = service.search_messages(chat_id, "file_name")
+    assert [hit["id"] for hit in hits] == [underscored]
+    assert ranked_from_id is None
+    assert service.search_messages(chat_id, "%")[0] == []
+
+
+def test_plain_search_pages_newest_first(plain_service):
+    db, service = plain_service
+    chat_id, ids = _fill(db, service, [f"Gym session {i}" for i in range(9)])
+    hits, pages = _all_pages(service, chat_id, "gym", limit=4)
+    assert [hit["id"] for hit in hits] == ids[::-1]
+    assert pages == 3
+    assert "<mark>Gym</mark>" in hits[0]["snippet"]
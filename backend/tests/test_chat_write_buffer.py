@@ -0,0 +1,119 @@
+import asyncio
+import os
+
+import pytest
+
+try:
+    from app.services.chat_write_buffer import ChatWriteBuffer, Turn
+except Exception as e:  # app.core.database подключается к БД при импорте
+    pytest.skip(f"needs a database at TEST_DATABASE_URL: {e}", allow_module_level=True)
+
+from app.core.config import settings
+from app.models import Chat, ChatMessage
+
+# драйвер PostgreSQL не пропускает NUL в тексте: ход, который БД отвергает всегда
+POISON = "bad\x00turn"
+
+
+@pytest.fixture
+def chat(db, make_user):
+    user = make_user()
+    chat = Chat(owner_id=user.id)
+    db.add(chat)
+    db.commit()
+    return chat
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {"spill_path": str(tmp_path / "spill.jsonl"), "quarantine_path": str(tmp_path / "rejected.jsonl")}
+
+
+def turns(chat, texts):
+    return [Turn(chat.owner_id, chat.id, text, "ok") for text in texts]
+
+
+def written(db, chat):
+    db.expire_all()
+    rows = db.query(ChatMessage.content).filter(ChatMessage.chat_id == chat.id, ChatMessage.role == "user")
+    return sorted(content for (content,) in rows)
+
+
+def lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [Turn.from_json(line) for line in f]
+
+
+def test_bad_turn_is_bisected_out_and_quarantined(db, chat, paths, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_WRITE_BEHIND_ENABLED", True)
+    texts = [POISON if i == 5 else f"u{i:02}" for i in range(20)]
+    buffer = ChatWriteBuffer(batch_size=8, flush_seconds=60, max_attempts=3, **paths)
+
+    async def run():
+        await buffer.start()
+        assert all(buffer.add(turn) for turn in turns(chat, texts))
+        assert not await buffer.flush()
+        # пачка с плохим ходом записана без него
+        assert written(db, chat) == [f"u{i:02}" for i in range(8) if i != 5]
+        for _ in range(3):
+            await buffer.flush()
+        await buffer.close()
+
+    asyncio.run(run())
+    assert written(db, chat) == sorted(t for t in texts if t != POISON)
+    assert [t.user_text for t in lines(paths["quarantine_path"])] == [POISON]
+
+
+def test_outage_keeps_turns_buffered_without_quarantine(db, chat, paths, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_WRITE_BEHIND_ENABLED", True)
+    buffer = ChatWriteBuffer(batch_size=8, flush_seconds=60, max_attempts=2, **paths)
+
+    def down(*args):
+        raise ConnectionError("database is down")
+
+    async def run():
+        await buffer.start()
+        buffer.add(*turns(chat, ["u1"]))
+        with monkeypatch.context() as outage:
+            outage.setattr(ChatWriteBuffer, "_write", staticmethod(down))
+            outage.setattr(ChatWriteBuffer, "_ping", staticmethod(down))
+            for _ in range(5):
+                assert not await buffer.flush()
+        assert await buffer.flush()
+        await buffer.close()
+
+    asyncio.run(run())
+    assert written(db, chat) == ["u1"]
+    assert not os.path.exists(paths["quarantine_path"])
+
+
+def test_spill_replay_resumes_where_an_outage_stopped_it(db, chat, paths, monkeypatch):
+    texts = [POISON if i == 3 else f"s{i:02}" for i in range(20)]
+    with open(paths["spill_path"], "w", encoding="utf-8") as f:
+        f.writelines(turn.to_json() + "\n" for turn in turns(chat, texts))
+
+    # БД падает посреди первой пачки: после деления пополам записаны s00–s02
+    write, calls = ChatWriteBuffer._write, []
+
+    def flaky(db, batch):
+        calls.append(len(batch))
+        if len(calls) > 6:
+            raise ConnectionError("database is down")
+        write(db, batch)
+
+    def ping(db):
+        if len(calls) > 6:
+            raise ConnectionError("database is down")
+
+    with monkeypatch.context() as outage:
+        outage.setattr(ChatWriteBuffer, "_write", staticmethod(flaky))
+        outage.setattr(ChatWriteBuffer, "_ping", staticmethod(ping))
+        asyncio.run(ChatWriteBuffer(batch_size=8, max_attempts=3, **paths).start())
+    assert written(db, chat) == ["s00", "s01", "s02"]
+    # в файле осталось только незаписанное
+    assert [t.user_text for t in lines(paths["spill_path"])] == texts[3:]
+
+    asyncio.run(ChatWriteBuffer(batch_size=8, max_attempts=3, **paths).start())
+    assert written(db, chat) == sorted(t for t in texts if t != POISON)
+    assert [t.user_text for t in lines(paths["quarantine_path"])] == [POISON]
+    assert not os.path.exists(paths["spill_path"])
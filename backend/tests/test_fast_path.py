@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app.services.fast_path import recognize_intent
+
+TODAY = date(2025, 7, 9)
+
+
+@pytest.mark.parametrize(
+    "message, title",
+    [
+        ("добавь встречу с Иваном завтра в 15:00", "Встреча с Иваном"),
+        ("добавь срочную встречу завтра в 15:00", "Срочная встреча"),
+        ("добавь утреннюю пробежку завтра в 7:00", "Утренняя пробежка"),
+        ("запиши тренировку завтра с 18:00 до 19:30", "Тренировка"),
+        ("добавь лекцию завтра в 10:00", "Лекция"),
+        ("добавь статью завтра в 20:00", "Статья"),
+        ("добавь созвон завтра в 10:00 на 30 минут", "Созвон"),
+        ("добавь шоу завтра в 20:00", "Шоу"),
+        ("запиши к врачу завтра в 10:00", "К врачу"),
+        ("Ертең 15:00-де кездесу қос", "Кездесу"),
+        ("ертең 15:00-де кездесуді қос", "Кездесу"),
+        ("add dentist tomorrow at 15:00", "Dentist"),
+    ],
+)
+def test_create_title_is_nominative(message, title):
+    intent = recognize_intent(message, TODAY)
+    assert intent is not None and intent.kind == "create"
+    assert intent.title == title
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        # падеж не восстановить однозначно — пусть решает модель
+        "добавь стою завтра в 10:00",
+        "добавь ту завтра в 10:00",
+    ],
+)
+def test_create_declines_unclear_title(message):
+    assert recognize_intent(message, TODAY) is None
+
+
+@pytest.mark.parametrize(
+    "message, kind",
+    [
+        ("Что у меня сегодня?", "day"),
+        ("what do i have tomorrow", "day"),
+        ("покажи планы на неделю", "range"),
+        ("Перенеси встречу на завтра", None),
+        ("добавь встречу завтра", None),
+        ("How should I prepare for my exam tomorrow?", None),
+        ("add meeting tomorrow at 10:00 and lunch at 13:00", None),
+    ],
+)
+def test_recognize_kind(message, kind):
+    intent = recognize_intent(message, TODAY)
+    assert (intent.kind if intent else None) == kind
+
+
+@pytest.fixture
+def calendar(db, make_user):
+    from app.services.calendar_service import CalendarService
+
+    return CalendarService(db, make_user(timezone="Asia/Almaty"))
+
+
+def test_create_without_duration_goes_to_the_model(calendar):
+    from app.models import CalendarEvent
+    from app.services.fast_path import FastPath
+
+    fast_path = FastPath(build_calendar_context=None)
+    answer = fast_path.answer(
+        "добавь встречу с Иваном завтра в 15:00", lang="ru", personality="assistant", calendar_service=calendar,
+    )
+    assert answer is None
+    assert calendar.db.query(CalendarEvent).count() == 0
+
+
+def test_create_with_duration_is_answered_locally(calendar):
+    from app.models import CalendarEvent
+    from app.services.fast_path import FastPath
+
+    fast_path = FastPath(build_calendar_context=None)
+    answer = fast_path.answer(
+        "запиши тренировку завтра с 18:00 до 19:30", lang="ru", personality="assistant", calendar_service=calendar,
+    )
+    assert answer is not None and "18:00–19:30" in answer["message"]
+    event = calendar.db.query(CalendarEvent).one()
+    assert str(event.id) == answer["event_id"] and event.title == "Тренировка"
+    assert event.end_time - event.start_time == timedelta(minutes=90)
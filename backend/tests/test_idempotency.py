@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.core.idempotency import IdempotencyMiddleware
+from app.core.security import create_tokens
+
+
+class Endpoint:
+    """Counts calls; answers `status` after `delay` seconds, echoing the body."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.status = 201
+        self.delay = 0.0
+
+    async def handle(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return JSONResponse({"call": self.calls, "body": (await request.body()).decode()}, self.status)
+
+
+@pytest.fixture
+def endpoint():
+    return Endpoint()
+
+
+@pytest.fixture
+def app(endpoint):
+    inner = Starlette(routes=[Route("/events", endpoint.handle, methods=["POST"])])
+    middleware = IdempotencyMiddleware(inner, paths=["/events"])
+    middleware.shared = None  # только хранилище этого процесса
+    return middleware
+
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+
+def headers(key: str, user: str = "1") -> dict:
+    return {"Authorization": f"Bearer {create_tokens(user)[0]}", "Idempotency-Key": key}
+
+
+def test_retry_is_replayed(client, endpoint):
+    first = client.post("/events", content=b"lunch", headers=headers("k1"))
+    retry = client.post("/events", content=b"lunch", headers=headers("k1"))
+    assert endpoint.calls == 1
+    assert retry.status_code == first.status_code == 201
+    assert retry.json() == first.json() == {"call": 1, "body": "lunch"}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+
+
+def test_same_key_with_another_request_is_a_conflict(client, endpoint):
+    assert client.post("/events", content=b"lunch", headers=headers("k1")).status_code == 201
+    assert client.post("/events", content=b"dinner", headers=headers("k1")).status_code == 422
+    assert client.post("/events?mode=async", content=b"lunch", headers=headers("k1")).status_code == 422
+    assert endpoint.calls == 1
+
+
+def test_keys_are_per_user_and_optional(client, endpoint):
+    client.post("/events", content=b"lunch", headers=headers("k1", user="1"))
+    assert client.post("/events", content=b"lunch", headers=headers("k1", user="2")).json()["call"] == 2
+    auth = {"Authorization": headers("k1")["Authorization"]}
+    client.post("/events", content=b"lunch", headers=auth)
+    assert endpoint.calls == 3
+
+
+@pytest.mark.parametrize("status", [500, 429])
+def test_failed_request_releases_the_key(client, endpoint, status):
+    endpoint.status = status
+    assert client.post("/events", content=b"lunch", headers=headers("k1")).status_code == status
+    endpoint.status = 201
+    retry = client.post("/events", content=b"lunch", headers=headers("k1"))
+    assert retry.status_code == 201 and "idempotent-replayed" not in retry.headers
+    assert endpoint.calls == 2
+
+
+def test_concurrent_retry_waits_for_the_original(app, endpoint):
+    endpoint.delay = 0.2
+
+    async def both():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = client.post("/events", content=b"lunch", headers=headers("k1"))
+            retry = client.post("/events", content=b"lunch", headers=headers("k1"))
+            return await asyncio.gather(first, retry)
+
+    first, retry = asyncio.run(both())
+    assert endpoint.calls == 1
+    assert first.json() == retry.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+
+
+def test_retry_gives_up_waiting_with_409(app, endpoint):
+    endpoint.delay = 0.5
+    app.wait_seconds = 0.1
+
+    async def both():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = asyncio.ensure_future(client.post("/events", content=b"lunch", headers=headers("k1")))
+            await asyncio.sleep(0.05)
+            retry = await client.post("/events", content=b"lunch", headers=headers("k1"))
+            return await first, retry
+
+    first, retry = asyncio.run(both())
+    assert first.status_code == 201
+    assert retry.status_code == 409 and retry.headers["retry-after"] == "1"
+    assert endpoint.calls == 1
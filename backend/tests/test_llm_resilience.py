@@ -0,0 +1,193 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+from openai import BadRequestError, InternalServerError
+
+import app.services.openai_service as llm
+from app.core.config import settings
+from app.core.resilience import CircuitBreaker, backoff_delay, parse_retry_after
+from benchmarks.llm_failover import MESSAGES, StandIn
+
+
+def test_breaker_opens_probes_once_and_closes():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # одна проба за раз
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_cancelled_probe_frees_the_half_open_slot():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() and not breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_backoff_has_full_jitter_and_honors_retry_after():
+    delays = [backoff_delay(3, base=0.5, cap=2.0) for _ in range(200)]
+    assert all(0 <= d <= 2.0 for d in delays) and max(delays) > 1.0
+    delays = [backoff_delay(0, base=0.5, cap=2.0, retry_after=5) for _ in range(200)]
+    assert all(5 <= d <= 5.5 for d in delays)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({"retry-after-ms": "250", "retry-after": "9"}) == 0.25
+    assert parse_retry_after({"retry-after": "3"}) == 3.0
+    assert parse_retry_after({"retry-after": "-1"}) == 0.0
+    assert parse_retry_after({"retry-after": "soon"}) is None
+    assert parse_retry_after({}) is None and parse_retry_after(None) is None
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after({"retry-after": format_datetime(when, usegmt=True)}) <= 30
+
+
+@pytest.fixture(scope="module")
+def stand_in():
+    return StandIn("primary")
+
+
+@pytest.fixture
+def primary(stand_in, monkeypatch):
+    """The primary deployment pointed at a fresh stand-in, quick backoff, no secondary."""
+    stand_in.reset()
+    monkeypatch.setattr(settings, "LLM_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "LLM_BACKOFF_MAX_SECONDS", 0.05)
+    monkeypatch.setattr(llm, "primary", llm.Deployment("primary", llm._make_client(stand_in.url, "test"), "test"))
+    monkeypatch.setattr(llm, "secondary", None)
+    return stand_in
+
+
+def ask():
+    return asyncio.run(llm.ask_gpt(MESSAGES, model=llm.primary.model))
+
+
+def test_retries_until_success(primary):
+    primary.reset(failures=[(500, {})] * settings.LLM_MAX_RETRIES)
+    assert ask() == "primary"
+    assert primary.hits == settings.LLM_MAX_RETRIES + 1
+    assert llm.primary.breaker.state == "closed"
+
+
+def test_waits_out_retry_after(primary):
+    primary.reset(failures=[(429, {"retry-after-ms": "300"})])
+    started = time.perf_counter()
+    assert ask() == "primary"
+    assert time.perf_counter() - started >= 0.3 and primary.hits == 2
+
+
+def test_gives_up_after_max_retries(primary):
+    primary.reset(failures=[(500, {})] * (settings.LLM_MAX_RETRIES + 2))
+    with pytest.raises(InternalServerError):
+        ask()
+    assert primary.hits == settings.LLM_MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried_or_counted_as_failures(primary):
+    primary.reset(failures=[(400, {})])
+    with pytest.raises(BadRequestError):
+        ask()
+    assert primary.hits == 1 and llm.primary.breaker.state == "closed"
+
+
+def test_deadline_bounds_the_whole_call(primary, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_DEADLINE_SECONDS", 0.3)
+    primary.reset(fast_seconds=5)
+    started = time.perf_counter()
+    with pytest.raises(llm.LLMUnavailableError, match="deadline"):
+        ask()
+    assert time.perf_counter() - started < 1.0
+
+
+def test_retry_is_skipped_when_its_delay_passes_the_deadline(primary, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_DEADLINE_SECONDS", 1.0)
+    primary.reset(failures=[(429, {"retry-after": "5"})])
+    started = time.perf_counter()
+    with pytest.raises(llm.APIStatusError):
+        ask()
+    assert time.perf_counter() - started < 1.0 and primary.hits == 1
+
+
+def test_open_breaker_rejects_without_calling(primary):
+    primary.reset(failures=[(500, {})] * 1000)
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        with pytest.raises(InternalServerError):
+            ask()
+    hits = primary.hits
+    with pytest.raises(llm.LLMUnavailableError, match="circuit open"):
+        ask()
+    assert primary.hits == hits
+
+
+@pytest.fixture(scope="module")
+def second_stand_in():
+    return StandIn("secondary")
+
+
+@pytest.fixture
+def pair(primary, second_stand_in, monkeypatch):
+    """Primary and secondary stand-ins; a hedge goes out 0.1 s after the primary was asked."""
+    second_stand_in.reset()
+    monkeypatch.setattr(settings, "LLM_HEDGE_DEFAULT_DELAY_SECONDS", 0.1)
+    client = llm._make_client(second_stand_in.url, "test")
+    monkeypatch.setattr(llm, "secondary", llm.Deployment("secondary", client, "test-secondary"))
+    return primary, second_stand_in
+
+
+async def ask_text(stream: bool) -> str:
+    reply = await llm.ask_gpt(MESSAGES, model=llm.primary.model, stream=stream)
+    if stream:
+        return "".join([delta async for delta in reply if isinstance(delta, str)])
+    return reply
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_hedge_wins_over_a_slow_primary(pair, stream):
+    primary, secondary = pair
+    primary.reset(fast_seconds=3)
+    started = time.perf_counter()
+    assert asyncio.run(ask_text(stream)) == "secondary"
+    # ask_gpt дожидается снятия проигравшего: без отмены вызов длился бы 3 с
+    assert time.perf_counter() - started < 1.0
+    assert primary.hits == secondary.hits == 1
+    assert llm.primary.breaker.state == "closed"
+
+
+def test_no_hedge_when_the_primary_answers_in_time(pair):
+    primary, secondary = pair
+    assert asyncio.run(ask_text(stream=False)) == "primary"
+    assert secondary.hits == 0
+
+
+def test_failing_primary_fails_over_before_the_hedge_delay(pair, monkeypatch):
+    primary, secondary = pair
+    monkeypatch.setattr(settings, "LLM_HEDGE_DEFAULT_DELAY_SECONDS", 10)
+    primary.reset(failures=[(500, {})] * 100)
+    started = time.perf_counter()
+    assert asyncio.run(ask_text(stream=False)) == "secondary"
+    assert time.perf_counter() - started < 2.0
+    assert primary.hits == settings.LLM_MAX_RETRIES + 1 and secondary.hits == 1
+
+
+def test_open_primary_breaker_goes_straight_to_the_secondary(pair):
+    primary, secondary = pair
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        llm.primary.breaker.record_failure()
+    assert asyncio.run(ask_text(stream=True)) == "secondary"
+    assert primary.hits == 0 and secondary.hits == 1
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parents[1]
+
+
+def test_llm_client_imports_without_the_database():
+    # отдельный процесс: в этом app.core.database мог импортировать другой тест
+    code = (
+        "import sys, app.services.openai_service; "
+        "assert 'app.core.database' not in sys.modules, 'openai_service pulled in the DB layer'"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,76 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app.core.config import settings
+from app.core.rate_limit import BucketSpec, InProcessLimiter, RateLimitMiddleware
+from app.core.security import create_tokens
+
+
+def test_bucket_takes_every_cost_or_none():
+    limiter = InProcessLimiter([BucketSpec(capacity=2, rate=1), BucketSpec(capacity=10, rate=1)])
+    assert limiter.acquire("u", (1, 5), now=0) == 0
+    # второй bucket пуст наполовину: ждать секунду, и первый не списан
+    assert limiter.acquire("u", (1, 6), now=0) == pytest.approx(1.0)
+    assert limiter.acquire("u", (1, 5), now=0) == 0
+    assert limiter.acquire("u", (1, 0), now=0) == pytest.approx(1.0)
+    assert limiter.acquire("u", (1, 0), now=1) == 0
+
+
+def test_bucket_refills_up_to_its_capacity():
+    limiter = InProcessLimiter([BucketSpec(capacity=3, rate=0.5)])
+    assert [limiter.acquire("u", (1,), now=0) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("u", (1,), now=0) == pytest.approx(2.0)
+    # долгий простой не копит больше capacity
+    assert [limiter.acquire("u", (1,), now=1000) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("u", (1,), now=1000) == pytest.approx(2.0)
+
+
+def test_users_have_separate_buckets_and_idle_ones_are_evicted():
+    limiter = InProcessLimiter([BucketSpec(capacity=1, rate=1)], max_keys=2)
+    assert limiter.acquire("a", (1,), now=0) == 0
+    assert limiter.acquire("b", (1,), now=0) == 0
+    assert limiter.acquire("a", (1,), now=0) > 0
+    limiter.acquire("c", (1,), now=0)
+    # «b» вытеснен — его bucket снова полон
+    assert limiter.acquire("b", (1,), now=0) == 0
+
+
+@pytest.fixture
+def client():
+    async def chat(request):
+        return PlainTextResponse("ok")
+
+    inner = Starlette(routes=[Route("/chat", chat, methods=["GET", "POST"])])
+    middleware = RateLimitMiddleware(inner, paths=["/chat"])
+    middleware.shared = None  # только bucket'ы этого процесса
+    return TestClient(middleware)
+
+
+def auth(user_id: str) -> dict:
+    return {"Authorization": f"Bearer {create_tokens(user_id)[0]}"}
+
+
+def test_burst_then_429_with_retry_after(client):
+    headers = auth("burst")
+    codes = [client.post("/chat", headers=headers).status_code for _ in range(settings.RATE_LIMIT_BURST)]
+    assert codes == [200] * settings.RATE_LIMIT_BURST
+    response = client.post("/chat", headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) == 60 // settings.RATE_LIMIT_REQUESTS_PER_MINUTE
+    # другой пользователь, GET и запросы без токена не ограничиваются
+    assert client.post("/chat", headers=auth("other")).status_code == 200
+    assert client.get("/chat", headers=headers).status_code == 200
+    assert client.post("/chat").status_code == 200
+
+
+def test_oversized_body_costs_at_most_the_llm_budget(client):
+    headers = auth("big")
+    body = b"x" * (settings.LLM_TOKENS_PER_MINUTE * 8)
+    # оценка больше ёмкости обрезается: полный bucket такой запрос пропускает
+    assert client.post("/chat", headers=headers, content=body).status_code == 200
+    response = client.post("/chat", headers=headers, content=body)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) <= 60
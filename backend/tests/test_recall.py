@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import zlib
+
+import pytest
+
+try:
+    from app.services.recall_service import _B, _K1, _MAX_DF, ChatRecall, _ChatIndex, tokenize
+except Exception as e:  # app.core.database подключается к БД при импорте
+    pytest.skip(f"needs a database at TEST_DATABASE_URL: {e}", allow_module_level=True)
+
+from app.models import ChatMessage, ChatRecallIndex
+from app.services.chat_service import ChatService
+
+
+def build(messages: int, seed: int = 1) -> _ChatIndex:
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(400)]
+    weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+    index = _ChatIndex()
+    for message_id in range(1, messages + 1):
+        index.add(message_id * 3, " ".join(rng.choices(words, cum_weights=weights, k=rng.randint(4, 30))))
+    return index
+
+
+def exhaustive(index: _ChatIndex, terms, k: int, below_id: int):
+    """Plain BM25 over every posting (frequent terms skipped, as in `top`)."""
+    n = len(index.doc_ids)
+    avg = index.total_len / n
+    scores = {}
+    for term in set(terms):
+        if term not in index.postings:
+            continue
+        ords, tfs = index.postings[term]
+        df = len(ords)
+        if df > _MAX_DF * n:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for ordinal, tf in zip(ords, tfs):
+            if index.doc_ids[ordinal] >= below_id:
+                continue
+            norm = _K1 * (1 - _B + _B * index.doc_lens[ordinal] / avg)
+            scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+    return [(score, index.doc_ids[o]) for o, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+
+def test_top_k_matches_exhaustive_bm25():
+    index = build(600)
+    rng = random.Random(2)
+    below_id = index.doc_ids[-11]
+    for _ in range(100):
+        # до четырёх термов: все дают кандидатов, ранжирование точное
+        terms = [f"w{rng.randrange(20, 400)}" for _ in range(rng.randint(1, 4))]
+        ranked = index.top(terms, 5, below_id, 0.0)
+        expected = exhaustive(index, terms, 5, below_id)
+        assert [message_id for _, message_id in ranked] == [message_id for _, message_id in expected]
+        assert [score for score, _ in ranked] == pytest.approx([score for score, _ in expected])
+
+
+def test_top_skips_recent_messages_and_weak_matches():
+    index = _ChatIndex()
+    index.add(1, "Appointment with the dentist on Friday")
+    index.add(2, "Dentist moved to Monday, dentist again")
+    index.add(3, "Lunch with Anna")
+    index.add(4, "What did the dentist say?")
+    assert [message_id for _, message_id in index.top(tokenize("dentist"), 5, None, 0.0)][0] == 2
+    assert {message_id for _, message_id in index.top(tokenize("dentist"), 5, 4, 0.0)} == {1, 2}
+    assert len(index.top(tokenize("dentist"), 1, None, 0.0)) == 1
+    assert index.top(tokenize("dentist"), 5, None, 100.0) == []
+    assert index.top(tokenize("unknown words"), 5, None, 0.0) == []
+
+
+def test_word_forms_share_a_term():
+    index = _ChatIndex()
+    index.add(1, "Перенеси встречу с Иваном")
+    index.add(2, "Купить хлеб")
+    assert [message_id for _, message_id in index.top(tokenize("встречи"), 5, None, 0.0)] == [1]
+
+
+def test_rare_term_is_found_deep_in_a_long_history():
+    # редкий терм в самом старом сообщении — дальше любого окна сканирования
+    index = _ChatIndex()
+    index.add(1, "passport renewal at the consulate")
+    for message_id in range(2, 5000):
+        index.add(message_id, f"w{message_id % 50} w{message_id % 7}")
+    assert index.top(tokenize("consulate"), 3, None, 0.0)[0][1] == 1
+
+
+def test_index_survives_a_dumps_loads_roundtrip():
+    index = build(800)
+    index.add(10_000, "Встреча с Иваном в «Кофемании» ☕")
+    loaded = _ChatIndex.loads(index.dumps())
+    assert loaded.doc_ids == index.doc_ids and loaded.doc_lens == index.doc_lens
+    assert loaded.total_len == index.total_len
+    assert loaded.postings == index.postings
+    for terms in (["w30", "w77"], tokenize("встреча кофемания"), ["w5", "w250", "w399"]):
+        assert loaded.top(terms, 5, None, 0.0) == index.top(terms, 5, None, 0.0)
+    # новые сообщения дописываются в загруженный индекс как обычно
+    loaded.add(10_001, "another coffee")
+    assert loaded.last_id == 10_001
+
+
+def test_unknown_format_is_rejected():
+    blob = _ChatIndex().dumps()
+    raw = zlib.decompress(blob).replace(b'"v": 1', b'"v": 9')
+    with pytest.raises(ValueError, match="format"):
+        _ChatIndex.loads(zlib.compress(raw))
+
+
+def test_saved_index_is_loaded_and_caught_up(db, make_user):
+    chat = ChatService(db, make_user()).get_or_create_chat()
+    db.add_all(ChatMessage(chat_id=chat.id, role="user", content=f"note {i}") for i in range(30))
+    db.add(ChatMessage(chat_id=chat.id, role="user", content="dentist on Friday at 10"))
+    db.add_all(ChatMessage(chat_id=chat.id, role="user", content=f"later {i}") for i in range(5))
+    db.commit()
+
+    recall = ChatRecall(enabled=True, recent_messages=3)
+    hits = asyncio.run(recall.search(chat.id, "when is the dentist?"))
+    assert [h.content for h in hits] == ["dentist on Friday at 10"]
+    assert recall.save(db, chat.id) == "saved"
+    stored = db.query(ChatRecallIndex).filter(ChatRecallIndex.chat_id == chat.id).one()
+    last_id = db.query(ChatMessage.id).filter(ChatMessage.chat_id == chat.id).order_by(ChatMessage.id.desc()).first()[0]
+    assert stored.last_message_id == last_id
+    assert _ChatIndex.loads(stored.data).last_id == last_id
+
+    db.add(ChatMessage(chat_id=chat.id, role="user", content="dentist cancelled"))
+    db.add_all(ChatMessage(chat_id=chat.id, role="user", content=f"after {i}") for i in range(5))
+    db.commit()
+    # новый процесс: индекс из таблицы плюс сообщения после него
+    hits = asyncio.run(ChatRecall(enabled=True, recent_messages=3).search(chat.id, "dentist"))
+    assert {h.content for h in hits} == {"dentist on Friday at 10", "dentist cancelled"}
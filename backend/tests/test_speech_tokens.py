@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from app.services.speech_service import SpeechTokenError, SpeechTokenProvider
+from benchmarks.speech_token import serve, stand_in
+
+REGION = "westeurope"
+
+
+@pytest.fixture(scope="module")
+def sts():
+    """Local STS stand-in answering after 50 ms; `calls` lists the regions asked for."""
+    calls: list = []
+    url = serve(stand_in(0.05, calls))
+    return url, calls
+
+
+@pytest.fixture
+def calls(sts):
+    sts[1].clear()
+    return sts[1]
+
+
+def run(provider: SpeechTokenProvider, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await provider.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_misses_share_one_sts_call(sts, calls):
+    provider = SpeechTokenProvider(key="test", url=sts[0])
+
+    async def scenario():
+        tokens = await asyncio.gather(*(provider.get(REGION) for _ in range(50)))
+        again = await provider.get(REGION)
+        other = await provider.get("eastus")
+        return tokens, again, other
+
+    tokens, again, other = run(provider, scenario)
+    assert len({t.value for t in tokens}) == 1 and again is tokens[0]
+    assert other.value != again.value
+    assert calls == [REGION, "eastus"]
+
+
+def test_cancelled_request_does_not_cancel_the_shared_call(sts, calls):
+    provider = SpeechTokenProvider(key="test", url=sts[0])
+
+    async def scenario():
+        first = asyncio.ensure_future(provider.get(REGION))
+        second = asyncio.ensure_future(provider.get(REGION))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert run(provider, scenario).value
+    assert calls == [REGION]
+
+
+def test_token_is_refreshed_in_the_background_while_in_use(sts, calls):
+    provider = SpeechTokenProvider(key="test", url=sts[0], ttl=2.0, refresh_after=0.2)
+
+    async def scenario():
+        first = await provider.get(REGION)
+        await asyncio.sleep(0.1)
+        # ещё в ходу — фоновое обновление сходит в STS заранее
+        assert await provider.get(REGION) is first
+        await asyncio.sleep(0.3)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        fresh = await provider.get(REGION)
+        return first, fresh, loop.time() - started
+
+    first, fresh, waited = run(provider, scenario)
+    assert fresh.value != first.value and fresh.expires_at >= first.expires_at
+    assert waited < 0.04  # новый токен уже в кэше, STS отвечает 50 мс
+    assert calls == [REGION, REGION]
+
+
+def test_idle_region_is_not_refreshed(sts, calls):
+    provider = SpeechTokenProvider(key="test", url=sts[0], ttl=2.0, refresh_after=0.1)
+
+    async def scenario():
+        await provider.get(REGION)
+        await asyncio.sleep(0.4)
+
+    run(provider, scenario)
+    assert calls == [REGION]
+
+
+def test_expired_token_is_fetched_again(sts, calls):
+    provider = SpeechTokenProvider(key="test", url=sts[0], ttl=0.1, refresh_after=10)
+
+    async def scenario():
+        first = await provider.get(REGION)
+        await asyncio.sleep(0.15)
+        return first, await provider.get(REGION)
+
+    first, second = run(provider, scenario)
+    assert second.value != first.value
+    assert calls == [REGION, REGION]
+
+
+@pytest.mark.parametrize(
+    "url, timeout, status",
+    [
+        ("{base}/missing", 5.0, 502),   # STS отвечает 404
+        ("{base}", 0.01, 504),          # STS не успевает
+        ("http://127.0.0.1:1/{{region}}", 5.0, 502),  # STS недоступен
+    ],
+)
+def test_sts_failures_map_to_gateway_errors(sts, url, timeout, status):
+    provider = SpeechTokenProvider(key="test", url=url.format(base=sts[0]), timeout=timeout)
+
+    async def scenario():
+        with pytest.raises(SpeechTokenError) as err:
+            await provider.get(REGION)
+        return err.value
+
+    assert run(provider, scenario).status_code == status
@@ -0,0 +1,88 @@
+from datetime import date, time
+
+import pytest
+
+from app.services.fast_path import recognize_intent
+from app.utils.temporal import parse_date_range
+
+TODAY = date(2025, 7, 9)  # среда
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("что у меня в пятницу", (date(2025, 7, 11), date(2025, 7, 11))),
+        ("в среду", (date(2025, 7, 9), date(2025, 7, 9))),
+        ("в следующую среду", (date(2025, 7, 16), date(2025, 7, 16))),
+        ("до среды", (date(2025, 7, 9), date(2025, 7, 9))),
+        ("в субботу", (date(2025, 7, 12), date(2025, 7, 12))),
+        ("в воскресенье", (date(2025, 7, 13), date(2025, 7, 13))),
+        ("по понедельникам", (date(2025, 7, 14), date(2025, 7, 14))),
+        ("next Tuesday", (date(2025, 7, 15), date(2025, 7, 15))),
+        ("friday", (date(2025, 7, 11), date(2025, 7, 11))),
+        ("жұмада", (date(2025, 7, 11), date(2025, 7, 11))),
+        ("сенбіде", (date(2025, 7, 12), date(2025, 7, 12))),
+        ("келесі сейсенбіде", (date(2025, 7, 15), date(2025, 7, 15))),
+        ("завтра", (date(2025, 7, 10), date(2025, 7, 10))),
+        ("завтра и послезавтра", (date(2025, 7, 10), date(2025, 7, 11))),
+        ("бүгін", (date(2025, 7, 9), date(2025, 7, 9))),
+        ("15 августа", (date(2025, 8, 15), date(2025, 8, 15))),
+        ("August 15", (date(2025, 8, 15), date(2025, 8, 15))),
+        ("15 тамызда", (date(2025, 8, 15), date(2025, 8, 15))),
+        ("2025-08-15", (date(2025, 8, 15), date(2025, 8, 15))),
+        ("15.08.2025", (date(2025, 8, 15), date(2025, 8, 15))),
+        ("через 3 дня", (date(2025, 7, 12), date(2025, 7, 12))),
+        ("ближайшие 3 дня", (date(2025, 7, 9), date(2025, 7, 11))),
+        ("на следующей неделе", (date(2025, 7, 14), date(2025, 7, 20))),
+        ("на выходных", (date(2025, 7, 12), date(2025, 7, 13))),
+    ],
+)
+def test_parse_date_range(text, expected):
+    found = parse_date_range(text, TODAY)
+    assert found is not None
+    assert (found.start, found.end) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # слова, начинающиеся с основы дня недели, — не дни недели
+        "обсуждение средств",
+        "в среднем офисе",
+        "среди коллег",
+        "средство от простуды",
+        "пятничный отчёт",
+        "жұмақ",
+        "what's up",
+        "в 15:00",
+    ],
+)
+def test_parse_date_range_ignores_lookalikes(text):
+    assert parse_date_range(text, TODAY) is None
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "добавь обсуждение средств в 15:00",
+        "добавь встречу в среднем офисе в 15:00",
+        "добавь встречу среди недели в 15:00",
+        "что у меня среди дел",
+    ],
+)
+def test_fast_path_declines_weekday_lookalikes(message):
+    assert recognize_intent(message, TODAY) is None
+
+
+@pytest.mark.parametrize(
+    "message, day, start",
+    [
+        ("добавь созвон в среду в 15:00", date(2025, 7, 9), time(15, 0)),
+        ("добавь созвон в пятницу в 10:30", date(2025, 7, 11), time(10, 30)),
+        ("add call on Friday at 10:00", date(2025, 7, 11), time(10, 0)),
+    ],
+)
+def test_fast_path_create_on_weekday(message, day, start):
+    intent = recognize_intent(message, TODAY)
+    assert intent is not None and intent.kind == "create"
+    assert (intent.day, intent.start) == (day, start)